@@ -0,0 +1,47 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from django_fitbit_healthkit.simulator import JSONHandler
+
+SUMMARY = {"summary": {"steps": 1234}}
+
+
+class StandInHandler(JSONHandler):
+    """
+    A keep-alive stand-in for api.fitbit.com:
+
+    * POST /oauth2/token hands out new tokens
+    * GET /retry/... fails with a 500 every other request
+    * GET /refresh/... answers 401 to the "access" token (a stale one)
+    * any other GET answers with a small activity summary
+    """
+
+    retries = 0
+
+    def do_GET(self):
+        if self.path.startswith("/retry/"):
+            StandInHandler.retries += 1
+            if StandInHandler.retries % 2:
+                return self.send(500, {})
+        if self.path.startswith("/refresh/"):
+            if self.headers["Authorization"] == "Bearer access":
+                return self.send(401, {})
+        self.send(200, SUMMARY)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send(
+            200,
+            {"access_token": "fresh", "refresh_token": "refresh", "expires_in": 28800},
+        )
+
+
+@pytest.fixture(scope="session")
+def stand_in():
+    """The base URL of a local stand-in for api.fitbit.com."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
@@ -0,0 +1,75 @@
+"""
+Per-call latency of fresh connections vs the pooled session.
+
+Starts a keep-alive HTTP/1.1 stand-in for api.fitbit.com on localhost and
+times the same GET with module-level ``requests.get`` (a new connection per
+call, what make_request used to do) and with the shared session from
+``django_fitbit_healthkit.session``.
+
+    python -m benchmarks.session_latency [--calls 500]
+
+Against the real API the gap is larger still, since each new connection
+there also pays for a TLS handshake and a cross-network round trip.
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sample.settings")
+django.setup()
+
+import requests  # noqa: E402
+
+from django_fitbit_healthkit.session import get_session  # noqa: E402
+from django_fitbit_healthkit.simulator import JSONHandler  # noqa: E402
+
+
+class StandInHandler(JSONHandler):
+    def do_GET(self):
+        self.send(200, {"summary": {"steps": 1234}})
+
+
+def time_calls(get, url: str, calls: int) -> list:
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        get(url).content
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(name: str, timings: list) -> None:
+    timings = sorted(timings)
+    print(
+        f"{name:>14}: mean {statistics.mean(timings):.3f}ms"
+        f"  p50 {timings[len(timings) // 2]:.3f}ms"
+        f"  p99 {timings[int(len(timings) * 0.99)]:.3f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=500)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/1/user/-/activities/date/2024-01-01.json"
+
+    # warm up both paths
+    requests.get(url)
+    get_session().get(url)
+
+    report("requests.get", time_calls(requests.get, url, args.calls))
+    report("pooled session", time_calls(get_session().get, url, args.calls))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Benchmarks of the hot paths, with pytest-benchmark.
+
+Run them (they're not part of the test suite) and compare against the
+saved baseline with:
+
+    python -m pytest benchmarks/test_hot_paths.py \
+        --benchmark-storage=benchmarks/baselines --benchmark-compare
+
+and save a new baseline after an intended change with
+``--benchmark-save=baseline`` instead of ``--benchmark-compare``.
+"""
+
+import json
+import random
+from datetime import date, timedelta
+
+import numpy
+import pytest
+from django.test import Client
+from django.urls import reverse
+
+from django_fitbit_healthkit import retry
+from django_fitbit_healthkit.models import FitbitNotification
+from django_fitbit_healthkit.util import (
+    extract_active_from_total,
+    extract_active_from_totals,
+    make_digest,
+    verify_fitbit_signature,
+)
+from tests.utils import make_fitbit_user
+
+SUMMARY_PATH = "/1/user/-/activities/date/2024-01-02.json"
+
+
+@pytest.fixture
+def fitbit_user(db, settings, stand_in):
+    # the budgets would run out long before the benchmarks do
+    settings.FITBIT_RATE_LIMIT_ENABLED = False
+    settings.FITBIT_RETRY_BUDGET_RATIO = 1
+    # time our own overhead, not the backoff
+    settings.FITBIT_RETRY_BASE_DELAY = 0
+    retry.reset()
+    settings.FITBIT_ACCESS_REFRESH_TOKEN_REQUEST_URI = f"{stand_in}/oauth2/token"
+    return make_fitbit_user()
+
+
+def notifications(n: int):
+    rng = random.Random(0)
+    start = date(2024, 1, 1)
+    return [
+        {
+            "collectionType": rng.choice(["activities", "sleep"]),
+            "date": (start + timedelta(days=i % 30)).isoformat(),
+            "ownerId": f"FB-user{i % 25}",
+            "ownerType": "user",
+            "subscriptionId": "1",
+        }
+        for i in range(n)
+    ]
+
+
+def test_make_request(benchmark, fitbit_user, stand_in):
+    resp, err = benchmark(fitbit_user.make_request, "get", stand_in + SUMMARY_PATH)
+    assert err is None
+
+
+def test_make_request_with_retry(benchmark, fitbit_user, stand_in):
+    resp, err = benchmark(
+        fitbit_user.make_request, "get", stand_in + "/retry" + SUMMARY_PATH
+    )
+    assert err is None
+
+
+def test_make_request_with_refresh(benchmark, fitbit_user, stand_in):
+    def stale_token():
+        fitbit_user.access_token = "access"
+
+    resp, err = benchmark.pedantic(
+        fitbit_user.make_request,
+        args=("get", stand_in + "/refresh" + SUMMARY_PATH),
+        setup=stale_token,
+        rounds=200,
+    )
+    assert err is None
+
+
+def test_webhook_ingest(benchmark, db, settings):
+    settings.FITBIT_CLIENT_SECRET = "secret"
+    for i in range(25):
+        make_fitbit_user(f"user{i}")
+    body = json.dumps(notifications(100))
+    signature = make_digest("secret&", body)
+    client = Client()
+    url = reverse("fitbitsubscription")
+
+    response = benchmark(
+        client.post,
+        url,
+        body,
+        content_type="application/json",
+        HTTP_X_FITBIT_SIGNATURE=signature,
+    )
+    assert response.status_code == 204
+    assert FitbitNotification.objects.exists()
+
+
+def test_verify_fitbit_signature(benchmark, settings):
+    settings.FITBIT_CLIENT_SECRET = "secret"
+    body = json.dumps(notifications(100))
+    signature = make_digest("secret&", body)
+    assert benchmark(verify_fitbit_signature, signature, body)
+
+
+@pytest.fixture(scope="module")
+def month_of_minutes():
+    rng = numpy.random.default_rng(0)
+    n = 30 * 1440
+    # resting minutes sit at 10 METs, with some zeros from gaps in the data
+    return (
+        rng.uniform(0.8, 12.0, n),
+        rng.choice([0, 10, 10, 10, 12, 30, 60, 90], n).astype(numpy.float64),
+    )
+
+
+def active_calories_numpy(calories, mets):
+    return extract_active_from_totals(calories, mets, 1).sum()
+
+
+def active_calories_python(calories, mets):
+    # one call per minute, how per-interval extraction was done
+    return sum(
+        extract_active_from_total(total, m, 1) for total, m in zip(calories, mets)
+    )
+
+
+@pytest.mark.benchmark(group="active_calories")
+@pytest.mark.parametrize(
+    "active_calories",
+    [active_calories_numpy, active_calories_python],
+    ids=["numpy", "python"],
+)
+def test_active_calories_month(benchmark, month_of_minutes, active_calories):
+    calories, mets = month_of_minutes
+    if active_calories is active_calories_python:
+        calories, mets = calories.tolist(), mets.tolist()
+    total = benchmark(active_calories, calories, mets)
+    assert numpy.isclose(total, active_calories_numpy(*month_of_minutes))
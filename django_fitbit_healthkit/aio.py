@@ -0,0 +1,331 @@
+"""
+Asyncio counterparts of FitbitUser.make_request and the helpers in methods.py.
+
+The coroutines here mirror their blocking versions one-to-one and return the
+same ``(response, error)`` tuples (with ``httpx.Response`` objects, which expose
+the same ``status_code``, ``headers``, ``text`` and ``json()``), so a single
+ASGI worker can keep many Fitbit calls in flight at once:
+
+    responses = await asyncio.gather(
+        *(aio.daily_activity_summary(u, date.today()) for u in users)
+    )
+
+Requires the ``async`` extra (``pip install django-fitbit-healthkit[async]``).
+
+Requests share one pooled ``httpx.AsyncClient`` per event loop, sized by
+``FITBIT_ASYNC_MAX_CONNECTIONS`` (default 100) and
+``FITBIT_ASYNC_MAX_KEEPALIVE_CONNECTIONS`` (default 20).
+"""
+
+import asyncio
+import time
+import weakref
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from . import methods, ratelimit, requestlog, retry, signals
+from .models import REFRESH_LOCK_STRIPES, TOKEN_FIELDS, FitbitUser
+from .session import get_timeout
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_refresh_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, List]" = (
+    weakref.WeakKeyDictionary()
+)
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _never_connected(e: "httpx.TransportError") -> bool:
+    """See models._never_connected."""
+    return isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+def get_client() -> "httpx.AsyncClient":
+    """
+    Return the shared client for the running event loop, creating it on first use.
+    """
+    if httpx is None:
+        raise ImportError(
+            "The async client requires httpx: pip install django-fitbit-healthkit[async]"
+        )
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=getattr(settings, "FITBIT_ASYNC_MAX_CONNECTIONS", 100),
+                max_keepalive_connections=getattr(
+                    settings, "FITBIT_ASYNC_MAX_KEEPALIVE_CONNECTIONS", 20
+                ),
+            ),
+            timeout=get_timeout(),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def aclose_client() -> None:
+    """Close the running loop's shared client, e.g. on ASGI lifespan shutdown."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def get_new_tokens(
+    fitbitUser: FitbitUser, client: Optional["httpx.AsyncClient"] = None
+) -> Tuple[Optional[Dict], Optional[Exception]]:
+    logger.info("Getting new tokens")
+    if fitbitUser.refresh_token is None or fitbitUser.refresh_token == "":
+        logger.info("No refresh token, can't get new tokens")
+        return (None, Exception("No refresh token available"))
+
+    client = client or get_client()
+    try:
+        response = await client.post(
+            settings.FITBIT_ACCESS_REFRESH_TOKEN_REQUEST_URI,
+            **fitbitUser._token_request_kwargs(),
+        )
+        result = fitbitUser._parse_token_response(response)
+    except Exception as e:
+        logger.info(f"Error in fitbit token request: {e}")
+        result = (None, e)
+    signals.tokens_refreshed.send(
+        sender=FitbitUser, fitbit_user=fitbitUser, error=result[1]
+    )
+    return result
+
+
+def _refresh_lock(pk) -> asyncio.Lock:
+    # striped like models._refresh_lock
+    locks = _refresh_locks.get(asyncio.get_running_loop())
+    if locks is None:
+        locks = [asyncio.Lock() for _ in range(REFRESH_LOCK_STRIPES)]
+        _refresh_locks[asyncio.get_running_loop()] = locks
+    return locks[hash(pk) % REFRESH_LOCK_STRIPES]
+
+
+def _current_tokens(pk) -> FitbitUser:
+    return FitbitUser.objects.only(*TOKEN_FIELDS).get(pk=pk)
+
+
+async def update_tokens(
+    fitbitUser: FitbitUser, client: Optional["httpx.AsyncClient"] = None
+) -> None:
+    """
+    Updates the tokens.
+    Raises a generic exception if there are any errors.
+
+    Like FitbitUser.update_tokens, refreshes are coalesced: one at a time
+    per user on this event loop, and a caller that waited for someone
+    else's refresh picks up the new tokens. Across processes the save only
+    goes through if nobody else rotated the refresh token in the meantime
+    (we can't hold a row lock across the awaited token request).
+    """
+    logger.info("Updating tokens")
+    if fitbitUser.pk is None:
+        fitbitUser._set_tokens(*await get_new_tokens(fitbitUser, client))
+        await sync_to_async(fitbitUser.save)()
+        return
+
+    stale_refresh_token = fitbitUser.refresh_token
+    async with _refresh_lock(fitbitUser.pk):
+        current = await sync_to_async(_current_tokens)(fitbitUser.pk)
+        if current.refresh_token != stale_refresh_token:
+            logger.info("Tokens were refreshed elsewhere, reusing them")
+            fitbitUser._adopt_tokens(current)
+            return
+        fitbitUser._set_tokens(*await get_new_tokens(fitbitUser, client))
+        if not await sync_to_async(fitbitUser._save_tokens)(stale_refresh_token):
+            logger.info("Lost a token refresh race, reloading tokens")
+            await sync_to_async(fitbitUser.refresh_from_db)(fields=TOKEN_FIELDS)
+    logger.info("Successfully updated tokens")
+
+
+async def make_request(
+    fitbitUser: FitbitUser,
+    request_type: str,
+    *args,
+    headers: Optional[Dict] = None,
+    max_fetch_attempts: int = 3,
+    max_rate_limit_wait: Optional[float] = None,
+    idempotent: Optional[bool] = None,
+    client: Optional["httpx.AsyncClient"] = None,
+    **kwargs,
+) -> Tuple[Optional["httpx.Response"], Optional[Exception]]:
+    """
+    Async version of FitbitUser.make_request: handles the token refresh
+    and retries for the user credentials.
+
+    This captures all exceptions and returns them as the second
+    tuple element.
+    """
+    try:
+        client = client or get_client()
+    except ImportError as e:
+        return (None, e)
+
+    if fitbitUser.is_expired:
+        logger.info("Token expired, will attempt an update")
+        try:
+            await update_tokens(fitbitUser, client)
+        except Exception as e:
+            return (None, e)
+
+    fetch_attempts = 0
+    method = request_type.upper()
+    url = args[0] if args else kwargs.get("url", "")
+
+    headers = {"authorization": f"Bearer {fitbitUser.access_token}", **(headers or {})}
+    retry.get_budget().deposit()
+
+    while fetch_attempts < max_fetch_attempts:
+        logger.debug("Fetch attempt #%d", fetch_attempts)
+        fetch_attempts += 1
+        err = await ratelimit.aacquire(fitbitUser, max_rate_limit_wait)
+        if err is not None:
+            return (None, err)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, *args, headers=headers, **kwargs)
+        except httpx.TransportError as e:
+            delay = retry.after_error(
+                method,
+                fetch_attempts,
+                max_fetch_attempts,
+                e,
+                not _never_connected(e),
+                idempotent,
+            )
+            if delay is None:
+                return (None, e)
+            await asyncio.sleep(delay)
+            continue
+        except httpx.HTTPError as e:
+            return (None, e)
+        requestlog.response_completed(
+            fitbitUser,
+            method,
+            url,
+            response.status_code,
+            time.perf_counter() - started,
+            len(response.content),
+            lambda: response.text,
+            fetch_attempts,
+        )
+        reset_at = await ratelimit.arecord(
+            fitbitUser, response.status_code, response.headers
+        )
+
+        if response.status_code == 401:
+            try:
+                await update_tokens(fitbitUser, client)
+            except Exception as e:
+                return (None, e)
+            headers["authorization"] = f"Bearer {fitbitUser.access_token}"
+            # make another fetch attempt
+            continue
+        elif 200 <= response.status_code < 300:
+            # 201 Created and 204 No Content from the subscription endpoints
+            return (response, None)
+
+        delay, err = retry.after_response(
+            method,
+            fetch_attempts,
+            max_fetch_attempts,
+            response.status_code,
+            response.headers,
+            lambda: response.text,
+            idempotent,
+            reset_at,
+        )
+        if err is not None:
+            return (None, err)
+        await asyncio.sleep(delay)
+    return (None, Exception("Max attempts"))
+
+
+async def check_fitbit_access(fitbitUser: FitbitUser) -> bool:
+    """See methods.check_fitbit_access."""
+    if not fitbitUser.is_expired:
+        return True
+    key = methods.access_check_key(fitbitUser)
+    verdict = await caches["default"].aget(key)
+    if verdict is not None:
+        return verdict
+    try:
+        await update_tokens(fitbitUser)
+        verdict = True
+    except Exception as e:
+        logger.info(f"Error wrapped in check_fitbit_access: {e}")
+        verdict = False
+    await caches["default"].aset(
+        key, verdict, getattr(settings, "FITBIT_ACCESS_CHECK_TTL", 60)
+    )
+    return verdict
+
+
+async def daily_activity_summary(
+    fitbitUser: FitbitUser, d: date
+) -> Tuple[Optional["httpx.Response"], Optional[Exception]]:
+    """See methods.daily_activity_summary."""
+    return await make_request(fitbitUser, "get", methods._daily_activity_summary_url(d))
+
+
+async def sleep_log_by_date(
+    fitbitUser: FitbitUser, d: date
+) -> Tuple[Optional["httpx.Response"], Optional[Exception]]:
+    """See methods.sleep_log_by_date."""
+    return await make_request(fitbitUser, "get", methods._sleep_log_by_date_url(d))
+
+
+async def sleep_log_by_date_range(
+    fitbitUser: FitbitUser, start_date: date, end_date: date
+) -> Tuple[Optional["httpx.Response"], Optional[Exception]]:
+    """See methods.sleep_log_by_date_range."""
+    url = methods._sleep_log_by_date_range_url(start_date, end_date)
+    if url is None:
+        return {}
+    return await make_request(fitbitUser, "get", url)
+
+
+async def activity_intraday_by_date(
+    fitbitUser: FitbitUser, activity: str, d: date, interval: str
+) -> Tuple[Optional["httpx.Response"], Optional[Exception]]:
+    """See methods.activity_intraday_by_date."""
+    url = methods._activity_intraday_by_date_url(activity, d, interval)
+    if url is None:
+        return {}
+    return await make_request(fitbitUser, "get", url)
+
+
+async def activity_timeseries_by_date(
+    fitbitUser: FitbitUser, resource: str, d: date, period: str
+) -> Tuple[Optional["httpx.Response"], Optional[Exception]]:
+    """See methods.activity_timeseries_by_date."""
+    url = methods._activity_timeseries_by_date_url(resource, d, period)
+    if url is None:
+        return {}
+    return await make_request(fitbitUser, "get", url)
+
+
+async def activity_timeseries_by_date_range(
+    fitbitUser: FitbitUser, resource: str, start_date: date, end_date: date
+) -> Tuple[Optional["httpx.Response"], Optional[Exception]]:
+    """See methods.activity_timeseries_by_date_range."""
+    url = methods._activity_timeseries_by_date_range_url(resource, start_date, end_date)
+    if url is None:
+        return {}
+    return await make_request(fitbitUser, "get", url)
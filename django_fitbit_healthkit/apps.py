@@ -5,3 +5,9 @@ class FitbitConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "django_fitbit_healthkit"
     label = "fitbit"
+
+    def ready(self):
+        # connect the signal receivers
+        from . import metrics, store  # noqa: F401
+
+        metrics.connect()
@@ -0,0 +1,226 @@
+"""
+Backfilling a user's history.
+
+plan_backfill() breaks a user's history into BackfillChunk rows, one per
+API call, and the ``fitbit_backfill`` workers work through them, storing
+the data (see store.py) and marking each chunk completed. The chunks are
+the checkpoints: a crashed worker's chunks are picked up again once their
+lease runs out, rate-limited chunks wait for the user's budget to reset,
+and finished chunks are never fetched again.
+
+Workers claim chunks the same way the notification workers do (see
+leases.py), so run as many as the rate limit budget allows.
+Within a worker, users are fetched concurrently and each user's chunks
+one after another. Settings:
+
+* ``FITBIT_BACKFILL_DAYS``: how many days back to go, default 365
+* ``FITBIT_BACKFILL_DAILY_SUMMARIES``: fetch a summary per day, default True
+* ``FITBIT_BACKFILL_TIMESERIES``: time series resources to fetch
+* ``FITBIT_BACKFILL_INTRADAY``: intraday activities to fetch per day,
+  default none (they need special access)
+* ``FITBIT_BACKFILL_INTRADAY_INTERVAL``: default ``"1min"``
+* ``FITBIT_BACKFILL_LEASE``: seconds a claimed chunk is held, default 300
+* ``FITBIT_BACKFILL_MAX_ATTEMPTS``: default 5
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max
+from django.utils import timezone
+
+from . import leases, methods, store
+from .models import BackfillChunk, FitbitUser
+from .ranges import date_chunks
+from .ratelimit import RateLimited
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMESERIES = [
+    "steps",
+    "calories",
+    "distance",
+    "floors",
+    "minutesSedentary",
+    "minutesLightlyActive",
+    "minutesFairlyActive",
+    "minutesVeryActive",
+]
+
+
+def _days(start_date: date, end_date: date) -> List[date]:
+    return [
+        start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)
+    ]
+
+
+def plan_backfill(
+    fitbitUser: FitbitUser,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+) -> int:
+    """
+    Plan the chunks of a user's history from start_date (default
+    ``FITBIT_BACKFILL_DAYS`` before end_date) to end_date (default
+    yesterday; today is kept up to date by subscription notifications).
+    Days already planned for the user are skipped, so planning again
+    later only adds the days since. Returns the number of chunks planned.
+    """
+    end_date = end_date or date.today() - timedelta(days=1)
+    start_date = start_date or end_date - timedelta(
+        days=getattr(settings, "FITBIT_BACKFILL_DAYS", 365) - 1
+    )
+    planned_until = BackfillChunk.objects.filter(user=fitbitUser).aggregate(
+        Max("end_date")
+    )["end_date__max"]
+    if planned_until is not None:
+        start_date = max(start_date, planned_until + timedelta(days=1))
+    if start_date > end_date:
+        return 0
+
+    chunks = []
+
+    def plan(kind, spans, resource=""):
+        chunks.extend(
+            BackfillChunk(
+                user=fitbitUser,
+                kind=kind,
+                resource=resource,
+                start_date=start,
+                end_date=end,
+            )
+            for start, end in spans
+        )
+
+    days = [(d, d) for d in _days(start_date, end_date)]
+    if "activity" in fitbitUser.scopes:
+        if getattr(settings, "FITBIT_BACKFILL_DAILY_SUMMARIES", True):
+            plan("summary", days)
+        for resource in getattr(
+            settings, "FITBIT_BACKFILL_TIMESERIES", DEFAULT_TIMESERIES
+        ):
+            max_days = methods.timeseries_range_max_days(resource)
+            plan("timeseries", date_chunks(start_date, end_date, max_days), resource)
+        for activity in getattr(settings, "FITBIT_BACKFILL_INTRADAY", []):
+            plan("intraday", days, activity)
+    if "sleep" in fitbitUser.scopes:
+        plan("sleep", date_chunks(start_date, end_date, methods.SLEEP_RANGE_MAX_DAYS))
+
+    BackfillChunk.objects.bulk_create(chunks, ignore_conflicts=True)
+    logger.info(f"Planned {len(chunks)} backfill chunks for {fitbitUser.pk}")
+    return len(chunks)
+
+
+def claim_chunks(batch_size: int = 50) -> List[BackfillChunk]:
+    """
+    Claim up to batch_size pending chunks for this worker, most recent days
+    first, skipping any that another worker has locked.
+    """
+    return leases.claim(
+        BackfillChunk.objects.order_by("-end_date", "pk"),
+        "completed",
+        getattr(settings, "FITBIT_BACKFILL_LEASE", 300),
+        batch_size,
+    )
+
+
+def _fetch_and_store(
+    fitbitUser: FitbitUser, chunk: BackfillChunk
+) -> Optional[Exception]:
+    if chunk.kind == "summary":
+        data, err = methods.fetch_json(
+            methods.daily_activity_summary, fitbitUser, chunk.start_date
+        )
+        if err is None:
+            store.store_daily_activity_summary(fitbitUser, chunk.start_date, data)
+    elif chunk.kind == "sleep":
+        data, err = methods.fetch_json(
+            methods.sleep_log_by_date_range,
+            fitbitUser,
+            chunk.start_date,
+            chunk.end_date,
+        )
+        if err is None:
+            store.store_sleep_logs(fitbitUser, data, chunk.start_date, chunk.end_date)
+    elif chunk.kind == "timeseries":
+        data, err = methods.fetch_json(
+            methods.activity_timeseries_by_date_range,
+            fitbitUser,
+            chunk.resource,
+            chunk.start_date,
+            chunk.end_date,
+        )
+        if err is None:
+            store.store_timeseries(fitbitUser, chunk.resource, data)
+    elif chunk.kind == "intraday":
+        interval = getattr(settings, "FITBIT_BACKFILL_INTRADAY_INTERVAL", "1min")
+        data, err = methods.fetch_json(
+            methods.activity_intraday_by_date,
+            fitbitUser,
+            chunk.resource,
+            chunk.start_date,
+            interval,
+        )
+        if err is None:
+            store.store_intraday(
+                fitbitUser, chunk.resource, chunk.start_date, interval, data
+            )
+    else:
+        err = ValueError(f"Unknown backfill chunk kind {chunk.kind}")
+    return err
+
+
+def _process_user(fitbitUser: FitbitUser, chunks: List[BackfillChunk]) -> None:
+    try:
+        for i, chunk in enumerate(chunks):
+            try:
+                err = _fetch_and_store(fitbitUser, chunk)
+            except Exception as e:
+                err = e
+            if err is None:
+                leases.finish([chunk], completed=timezone.now(), last_error="")
+                continue
+            max_attempts = getattr(settings, "FITBIT_BACKFILL_MAX_ATTEMPTS", 5)
+            if isinstance(err, RateLimited):
+                # the rest of the user's chunks would only be rate limited too
+                logger.info(f"Rate limited, deferring backfill for {fitbitUser.pk}")
+                leases.fail(chunks[i:], err, "completed", max_attempts)
+                return
+            leases.fail([chunk], err, "completed", max_attempts)
+    finally:
+        close_old_connections()
+
+
+def process_chunks(
+    chunks: List[BackfillChunk], max_workers: Optional[int] = None
+) -> None:
+    """Fetch and store claimed chunks, users concurrently."""
+    users = FitbitUser.objects.in_bulk({c.user_id for c in chunks})
+    by_user = {}
+    for chunk in chunks:
+        if chunk.user_id in users:
+            by_user.setdefault(chunk.user_id, []).append(chunk)
+    max_workers = max_workers or getattr(settings, "FITBIT_BATCH_MAX_WORKERS", 16)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(
+            executor.map(
+                lambda item: _process_user(users[item[0]], item[1]),
+                by_user.items(),
+            )
+        )
+
+
+def process_pending_chunks(batch_size: int = 50) -> int:
+    """
+    Claim and process one batch of chunks.
+    Returns how many chunks were claimed (0 once every backfill is done).
+    """
+    batch = claim_chunks(batch_size)
+    if batch:
+        process_chunks(batch)
+    return len(batch)
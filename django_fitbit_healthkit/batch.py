@@ -0,0 +1,157 @@
+"""
+Run methods.py helpers for many users, or many helpers for one user, at once.
+
+Almost all of the time spent syncing a user is spent waiting on Fitbit,
+so a bounded pool of threads sharing the pooled session (see session.py)
+gets through a user base many times faster than a plain loop, and a page
+showing several endpoints takes as long as the slowest of them instead
+of their sum.
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import date
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import FitbitUser
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def call_safely(fn: Callable, *args, **kwargs):
+    """
+    ``fn(*args, **kwargs)`` for a worker thread: an exception comes back as
+    ``(None, error)`` and the thread's db connections are cleaned up after.
+    """
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        logger.info(f"Error wrapped in {fn.__name__}: {e}")
+        return (None, e)
+    finally:
+        # token refreshes touch the db from this worker thread
+        close_old_connections()
+
+
+def fetch_many(
+    users: Iterable[FitbitUser],
+    endpoint: Callable,
+    dates: Optional[Iterable[date]] = None,
+    max_workers: Optional[int] = None,
+    **kwargs,
+) -> Iterator[
+    Tuple[
+        FitbitUser,
+        Optional[date],
+        Tuple[Optional[requests.models.Response], Optional[Exception]],
+    ]
+]:
+    """
+    Call ``endpoint(user, d=d, **kwargs)`` for every user and date
+    (or ``endpoint(user, **kwargs)`` once per user if no dates are given)
+    on a bounded thread pool, and yield ``(user, d, result)`` in completion order.
+
+    ``result`` is whatever the helper returned, normally the usual
+    ``(response, error)`` tuple; exceptions raised by the helper
+    come back as ``(None, error)`` instead of stopping the whole batch.
+
+        for user, d, (resp, err) in fetch_many(users, daily_activity_summary, days):
+            ...
+
+    Only ``max_workers`` (default ``FITBIT_BATCH_MAX_WORKERS``, 16) calls are
+    in flight at a time and only a few more are queued, so ``users`` can be
+    a lazy queryset iterator over the whole user base.
+    """
+    max_workers = max_workers or getattr(settings, "FITBIT_BATCH_MAX_WORKERS", 16)
+    dates = list(dates) if dates is not None else [None]
+
+    def tasks():
+        for fitbitUser in users:
+            for d in dates:
+                yield fitbitUser, d
+
+    pending = {}
+    task_iter = tasks()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def submit(n: int) -> None:
+            for fitbitUser, d in task_iter:
+                call_kwargs = kwargs if d is None else {"d": d, **kwargs}
+                future = executor.submit(
+                    call_safely, endpoint, fitbitUser, **call_kwargs
+                )
+                pending[future] = (fitbitUser, d)
+                n -= 1
+                if n == 0:
+                    break
+
+        submit(max_workers * 2)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                fitbitUser, d = pending.pop(future)
+                yield fitbitUser, d, future.result()
+            submit(len(done))
+
+
+def _run(call: Callable[[], Any]):
+    try:
+        return call()
+    except Exception as e:
+        logger.info(f"Error wrapped in gather: {e}")
+        return (None, e)
+    finally:
+        close_old_connections()
+
+
+def gather(
+    calls: Dict[str, Callable[[], Any]], timeout: Optional[float] = None
+) -> Dict[str, Any]:
+    """
+    Run independent calls (no arguments, e.g. functools.partials of the
+    methods.py or store.py helpers) all at once, and return their results
+    by name once every one has finished or the shared deadline, ``timeout``
+    seconds from now (default ``FITBIT_GATHER_TIMEOUT``, 10), has passed:
+
+        results = gather({
+            "summary": partial(get_daily_activity_summary, fitbitUser, today),
+            "sleep": partial(get_sleep_logs, fitbitUser, today),
+        })
+        summary, err = results["summary"]
+
+    Results are partial rather than all-or-nothing: exceptions raised by a
+    call come back as ``(None, error)``, and calls still running at the
+    deadline as ``(None, TimeoutError)`` (they finish in the background and
+    their results are dropped).
+    """
+    if timeout is None:
+        timeout = getattr(settings, "FITBIT_GATHER_TIMEOUT", 10)
+    if not calls:
+        return {}
+    deadline = time.monotonic() + timeout
+    executor = ThreadPoolExecutor(max_workers=len(calls))
+    futures = {name: executor.submit(_run, call) for name, call in calls.items()}
+    results = {}
+    try:
+        for name, future in futures.items():
+            try:
+                results[name] = future.result(
+                    timeout=max(deadline - time.monotonic(), 0)
+                )
+            except FuturesTimeoutError:
+                logger.info(f"{name} missed the {timeout}s deadline")
+                results[name] = (
+                    None,
+                    TimeoutError(f"{name} took longer than {timeout}s"),
+                )
+    finally:
+        # don't wait for the calls that missed the deadline
+        executor.shutdown(wait=False)
+    return results
@@ -0,0 +1,254 @@
+"""
+A response cache under the methods.py helpers.
+
+Successful GETs are cached per (user, endpoint URL) in a Django cache, so
+re-reading the same days doesn't spend the user's hourly quota. Responses
+for ranges ending today or yesterday (which are still changing) are kept
+for ``FITBIT_RESPONSE_CACHE_RECENT_TTL`` seconds (default 60), older ones
+for ``FITBIT_RESPONSE_CACHE_PAST_TTL`` seconds (default a week).
+
+Every cached response is listed in a per (user, collectionType) index
+together with the dates it covers, and ingest_notifications() drops exactly
+the responses covering each notified (user, collectionType, date). The index
+keeps at most ``FITBIT_RESPONSE_CACHE_MAX_ENTRIES`` responses (default 100)
+per user and collection, evicting the oldest, and responses over
+``FITBIT_RESPONSE_CACHE_MAX_BYTES`` (default 1MB) aren't cached at all.
+Updates to an index hold a short lock (a ``cache.add``ed key), so concurrent
+fetches for the same user don't drop each other's entries, and invalidating
+an index starts a new generation of it: a fetch that began before the
+invalidation, and may have read the old data, isn't cached.
+
+The cache is off unless ``FITBIT_RESPONSE_CACHE`` names a cache alias. The
+webhook and the code reading data have to see the same cache for
+invalidation to work, so use a shared backend (redis, memcached, ...) when
+running more than one process.
+"""
+
+import hashlib
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from requests.structures import CaseInsensitiveDict
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# seconds an index lock is held at most, in case its holder dies
+INDEX_LOCK_TIMEOUT = 5
+# seconds an index generation is kept, longer than any fetch takes
+INDEX_GENERATION_TIMEOUT = 3600
+
+
+def _cache():
+    alias = getattr(settings, "FITBIT_RESPONSE_CACHE", None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def _response_key(user_pk, url: str) -> str:
+    # hashed to stay within memcached's key limits
+    return f"fitbit:response:{user_pk}:{hashlib.sha1(url.encode()).hexdigest()}"
+
+
+def _index_key(user_pk, collection: str) -> str:
+    return f"fitbit:response:{user_pk}:{collection}:index"
+
+
+def _generation_key(index_key: str) -> str:
+    return f"{index_key}:generation"
+
+
+def _ttl(end_date: date) -> int:
+    if end_date >= date.today() - timedelta(days=1):
+        return getattr(settings, "FITBIT_RESPONSE_CACHE_RECENT_TTL", 60)
+    return getattr(settings, "FITBIT_RESPONSE_CACHE_PAST_TTL", 7 * 24 * 3600)
+
+
+def _freeze(response: requests.Response) -> Dict:
+    return {
+        "status_code": response.status_code,
+        "headers": dict(response.headers),
+        "content": response.content,
+        "encoding": response.encoding,
+        "url": response.url,
+    }
+
+
+def _thaw(frozen: Dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = frozen["status_code"]
+    response.headers = CaseInsensitiveDict(frozen["headers"])
+    response._content = frozen["content"]
+    response.encoding = frozen["encoding"]
+    response.url = frozen["url"]
+    return response
+
+
+@contextmanager
+def _index_lock(cache, index_key: str) -> Iterator[bool]:
+    """
+    Hold the lock on index_key, waiting at most INDEX_LOCK_TIMEOUT for it.
+    Yields whether it got the lock.
+    """
+    lock_key = f"{index_key}:lock"
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + INDEX_LOCK_TIMEOUT
+    locked = cache.add(lock_key, token, timeout=INDEX_LOCK_TIMEOUT)
+    while not locked and time.monotonic() < deadline:
+        time.sleep(0.005)
+        locked = cache.add(lock_key, token, timeout=INDEX_LOCK_TIMEOUT)
+    try:
+        yield locked
+    finally:
+        # not ours anymore if we held it past its timeout
+        if locked and cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def _add_to_index(
+    cache,
+    user_pk,
+    collection: str,
+    start_date: date,
+    end_date: date,
+    key: str,
+    frozen: Dict,
+    generation: Optional[str],
+) -> None:
+    """
+    Cache a response fetched while the index was at generation,
+    unless it has been invalidated since.
+    """
+    index_key = _index_key(user_pk, collection)
+    with _index_lock(cache, index_key) as locked:
+        if not locked:
+            # an unindexed response would never be invalidated
+            logger.info(f"Could not lock {index_key}, not caching {key}")
+            return
+        if cache.get(_generation_key(index_key)) != generation:
+            logger.info(f"{index_key} was invalidated during the fetch of {key}")
+            return
+        cache.set(key, frozen, timeout=_ttl(end_date))
+        _update_index(cache, index_key, start_date, end_date, key)
+
+
+def _update_index(
+    cache, index_key: str, start_date: date, end_date: date, key: str
+) -> None:
+    now = time.time()
+    # entries are (first date, last date, response key, expiry), oldest first
+    entries = [
+        entry
+        for entry in cache.get(index_key, [])
+        if entry[3] > now and entry[2] != key
+    ]
+    entries.append(
+        (
+            start_date.toordinal(),
+            end_date.toordinal(),
+            key,
+            now + _ttl(end_date),
+        )
+    )
+    max_entries = getattr(settings, "FITBIT_RESPONSE_CACHE_MAX_ENTRIES", 100)
+    if len(entries) > max_entries:
+        evicted, entries = entries[:-max_entries], entries[-max_entries:]
+        cache.delete_many([entry[2] for entry in evicted])
+    cache.set(index_key, entries, timeout=max(entry[3] for entry in entries) - now)
+
+
+def cached_get(
+    fitbitUser,
+    url: str,
+    collection: str,
+    start_date: date,
+    end_date: date,
+) -> Tuple[Optional[requests.models.Response], Optional[Exception]]:
+    """
+    GET url for fitbitUser through the cache.
+    collection is the notification collectionType the data belongs to,
+    and start_date to end_date the dates the response covers.
+    """
+    cache = _cache()
+    if cache is None:
+        return fitbitUser.make_request("get", url)
+
+    key = _response_key(fitbitUser.pk, url)
+    frozen = cache.get(key)
+    if frozen is not None:
+        return (_thaw(frozen), None)
+
+    generation = cache.get(_generation_key(_index_key(fitbitUser.pk, collection)))
+    resp, err = fitbitUser.make_request("get", url)
+    if err is None and resp.status_code == 200:
+        if len(resp.content) > getattr(
+            settings, "FITBIT_RESPONSE_CACHE_MAX_BYTES", 1024 * 1024
+        ):
+            logger.info(f"Response too large to cache: {url}")
+        else:
+            _add_to_index(
+                cache,
+                fitbitUser.pk,
+                collection,
+                start_date,
+                end_date,
+                key,
+                _freeze(resp),
+                generation,
+            )
+    return (resp, err)
+
+
+def invalidate(changes: Iterable[Tuple[int, str, date]]) -> None:
+    """
+    Drop the cached responses covering each (user pk, collectionType, date).
+    """
+    cache = _cache()
+    if cache is None:
+        return
+
+    dates: Dict[str, List[int]] = {}
+    for user_pk, collection, d in changes:
+        dates.setdefault(_index_key(user_pk, collection), []).append(d.toordinal())
+    if not dates:
+        return
+
+    for index_key, notified in dates.items():
+        # invalidating matters more than the lock: go ahead without it
+        with _index_lock(cache, index_key):
+            cache.set(
+                _generation_key(index_key),
+                uuid.uuid4().hex,
+                timeout=INDEX_GENERATION_TIMEOUT,
+            )
+            _invalidate_index(cache, index_key, notified)
+
+
+def _invalidate_index(cache, index_key: str, dates: List[int]) -> None:
+    entries = cache.get(index_key)
+    if entries is None:
+        return
+    now = time.time()
+    stale = []
+    keep = []
+    for entry in entries:
+        if any(entry[0] <= d <= entry[1] for d in dates):
+            stale.append(entry[2])
+        elif entry[3] > now:
+            keep.append(entry)
+    if stale:
+        cache.delete_many(stale)
+    if len(keep) == len(entries):
+        return
+    if keep:
+        cache.set(index_key, keep, timeout=max(entry[3] for entry in keep) - now)
+    else:
+        cache.delete(index_key)
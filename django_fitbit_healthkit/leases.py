@@ -0,0 +1,94 @@
+"""
+The work queue behind the notification workers (notifications.py) and the
+backfill workers (backfill.py).
+
+A queue is a model with a nullable "done" timestamp (set once a row is
+finished, successfully or not), ``available_at``, ``attempts`` and
+``last_error``. Workers claim pending rows with
+``select_for_update(skip_locked=True)``, so they never wait on or
+double-process each other's rows, and lease them by moving ``available_at``
+into the future, so rows claimed by a worker that died are picked up again
+once the lease runs out. Finishing a row only touches it if it's still held
+under the same lease.
+"""
+
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from typing import List
+
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .ratelimit import RateLimited
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def pending(done_field: str, now: datetime) -> Q:
+    return Q(**{f"{done_field}__isnull": True}) & (
+        Q(available_at__isnull=True) | Q(available_at__lte=now)
+    )
+
+
+def claim(
+    queryset: models.QuerySet, done_field: str, lease: float, batch_size: int
+) -> List[models.Model]:
+    """
+    Claim up to batch_size pending rows of queryset (in its order) for
+    lease seconds, skipping any that another worker has locked.
+    """
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=lease)
+    with transaction.atomic():
+        batch = list(
+            queryset.select_for_update(skip_locked=True).filter(
+                pending(done_field, now)
+            )[:batch_size]
+        )
+        queryset.model.objects.filter(pk__in=[row.pk for row in batch]).update(
+            available_at=lease_until
+        )
+    for row in batch:
+        row.available_at = lease_until
+    return batch
+
+
+def finish(rows: List[models.Model], **fields) -> None:
+    """Update claimed rows, unless their lease was reset in the meantime."""
+    type(rows[0]).objects.filter(
+        pk__in=[row.pk for row in rows], available_at=rows[0].available_at
+    ).update(**fields)
+
+
+def fail(
+    rows: List[models.Model], err: Exception, done_field: str, max_attempts: int
+) -> None:
+    """
+    Put claimed rows back after a failed attempt: rate limited rows until
+    the user's budget resets, others after an exponential backoff
+    (2, 4, 8, ... minutes), or done for good after max_attempts.
+    """
+    if isinstance(err, RateLimited):
+        finish(
+            rows, available_at=datetime.fromtimestamp(err.retry_at, tz=dt_timezone.utc)
+        )
+        return
+    attempts = max(row.attempts for row in rows) + 1
+    if attempts >= max_attempts:
+        logger.info(f"Giving up on {[row.pk for row in rows]}: {err}")
+        finish(
+            rows,
+            **{done_field: timezone.now()},
+            attempts=attempts,
+            last_error=str(err),
+        )
+    else:
+        finish(
+            rows,
+            available_at=timezone.now() + timedelta(minutes=2**attempts),
+            attempts=attempts,
+            last_error=str(err),
+        )
@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from django_fitbit_healthkit.backfill import plan_backfill, process_pending_chunks
+from django_fitbit_healthkit.models import FitbitUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill the history of connected Fitbit users. "
+        "Run as many of these as the rate limit allows, on as many nodes as you like."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            help="First plan the backfill of every user (only adds days not planned yet).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Number of chunks to claim at a time.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once there are no pending chunks left.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=5,
+            help="Seconds to wait when there's nothing to do.",
+        )
+
+    def handle(self, *args, **options):
+        if options["plan"]:
+            planned = sum(
+                plan_backfill(fitbitUser)
+                for fitbitUser in FitbitUser.objects.iterator()
+            )
+            self.stdout.write(f"Planned {planned} chunks.")
+        total = 0
+        while True:
+            claimed = process_pending_chunks(options["batch_size"])
+            total += claimed
+            if claimed:
+                self.stdout.write(f"Processed {claimed} chunks.")
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["sleep"])
+        self.stdout.write(f"Processed {total} chunks in total.")
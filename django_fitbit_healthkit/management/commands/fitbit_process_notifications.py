@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from django_fitbit_healthkit.notifications import (
+    ingest_pending_payloads,
+    process_pending_notifications,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch the data for pending Fitbit subscription notifications. "
+        "Run as many of these as you like, on as many nodes as you like."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of notifications to claim at a time.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once there are no pending notifications left.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=5,
+            help="Seconds to wait when the queue is empty.",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            # payloads queued by the async webhook first
+            ingested = ingest_pending_payloads(options["batch_size"])
+            if ingested:
+                self.stdout.write(f"Ingested {ingested} webhook payloads.")
+            claimed = process_pending_notifications(options["batch_size"])
+            total += claimed
+            if claimed:
+                self.stdout.write(f"Processed {claimed} notifications.")
+            if ingested or claimed:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["sleep"])
+        self.stdout.write(f"Processed {total} notifications in total.")
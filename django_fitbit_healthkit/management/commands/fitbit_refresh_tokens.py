@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from django_fitbit_healthkit.tokens import refresh_expiring_tokens
+
+
+class Command(BaseCommand):
+    help = "Refresh Fitbit access tokens that expire soon."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--within",
+            type=int,
+            default=None,
+            help="Refresh tokens expiring within this many seconds "
+            "(default: FITBIT_TOKEN_REFRESH_WINDOW, 3600).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of concurrent refreshes (default: FITBIT_BATCH_MAX_WORKERS).",
+        )
+
+    def handle(self, *args, **options):
+        within = options["within"]
+        refreshed, failed = refresh_expiring_tokens(
+            within=timedelta(seconds=within) if within is not None else None,
+            max_workers=options["workers"],
+        )
+        self.stdout.write(f"Refreshed {refreshed} tokens, {failed} failed.")
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from django_fitbit_healthkit.models import FitbitUser
+from django_fitbit_healthkit.subscriptions import reconcile_many
+
+
+class Command(BaseCommand):
+    help = (
+        "Subscribe every Fitbit user to the collections in "
+        "FITBIT_SUBSCRIPTION_COLLECTIONS and delete any other subscriptions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--collection",
+            action="append",
+            dest="collections",
+            help="Subscribe to this collection instead (repeat for several).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would change.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Users to reconcile at a time (default FITBIT_BATCH_MAX_WORKERS).",
+        )
+
+    def handle(self, *args, **options):
+        users = FitbitUser.objects.iterator()
+        created = deleted = failed = 0
+        for fitbitUser, (changes, err) in reconcile_many(
+            users,
+            collections=options["collections"],
+            dry_run=options["dry_run"],
+            max_workers=options["workers"],
+        ):
+            if changes:
+                created += len(changes["created"])
+                deleted += len(changes["deleted"])
+            if err is not None:
+                failed += 1
+                self.stderr.write(f"{fitbitUser}: {err}")
+        if options["dry_run"]:
+            self.stdout.write(
+                f"Would create {created} and delete {deleted} subscriptions."
+            )
+        else:
+            self.stdout.write(f"Created {created} and deleted {deleted} subscriptions.")
+        if failed:
+            self.stdout.write(f"{failed} users failed.")
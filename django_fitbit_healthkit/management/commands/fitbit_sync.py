@@ -0,0 +1,80 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_fitbit_healthkit.sync import sync_shard
+
+
+def shard(value):
+    try:
+        i, n = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise CommandError(f"--shard must look like i/N, not {value!r}.")
+    if not 0 <= i < n:
+        raise CommandError(f"--shard {value}: i must be between 0 and N - 1.")
+    return (i, n)
+
+
+class Command(BaseCommand):
+    help = (
+        "Sync the recent data of every Fitbit user (or of this node's shard of "
+        "them) on a pool of worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--shard",
+            default="0/1",
+            help="Only sync shard i of N, as i/N (0-based). Run one per node.",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Worker processes (default the number of CPUs).",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            help="Users to sync at a time per process (default FITBIT_BATCH_MAX_WORKERS).",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            help="Days to sync, up to today (default FITBIT_SYNC_DAYS).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Users per progress report.",
+        )
+
+    def handle(self, *args, **options):
+        i, n = shard(options["shard"])
+        done = [0]
+
+        def report(progress):
+            done[0] += sum(progress)
+            synced, limited, failed = progress
+            self.stdout.write(
+                f"Synced {synced}, rate limited {limited}, failed {failed} "
+                f"({done[0]} users done)."
+            )
+
+        try:
+            synced, limited, failed = sync_shard(
+                shard=i,
+                shards=n,
+                processes=options["processes"],
+                days=options["days"],
+                max_workers=options["threads"],
+                batch_size=options["batch_size"],
+                report=report,
+            )
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            f"Shard {i}/{n}: synced {synced} users, {limited} rate limited, "
+            f"{failed} failed."
+        )
@@ -1,23 +1,70 @@
-from datetime import date
-from typing import Optional, Tuple
+import hashlib
+from datetime import date, timedelta
+from typing import Callable, Dict, Optional, Tuple
 
 import requests
+from django.conf import settings
+from django.core.cache import caches
 
+from .cache import cached_get
 from .models import FitbitUser
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+ACTIVITY_RESOURCES = [
+    "activityCalories",
+    "calories",
+    "caloriesBMR",
+    "distance",
+    "elevation",
+    "floors",
+    "minutesSedentary",
+    "minutesLightlyActive",
+    "minutesFairlyActive",
+    "minutesVeryActive",
+    "steps",
+]
+TRACKER_ONLY_RESOURCES = [
+    "tracker/activityCalories",
+    "tracker/calories",
+    "tracker/distance",
+    "tracker/elevation",
+    "tracker/floors",
+    "tracker/minutesSedentary",
+    "tracker/minutesLightlyActive",
+    "tracker/minutesFairlyActive",
+    "tracker/minutesVeryActive",
+    "tracker/steps",
+]
+INTRADAY_ACTIVITIES = ["calories", "distance", "elevation", "floors", "steps"]
+INTRADAY_INTERVALS = ["1min", "5min", "15min"]
+TIMESERIES_PERIODS = ["1d", "7d", "30d", "1w", "1m", "3m", "6m", "1y"]
+# the longest ranges (end - start, in days) the range endpoints accept,
+# see ranges.py for fetching longer ones in chunks
+SLEEP_RANGE_MAX_DAYS = 100
+ACTIVITY_CALORIES_RANGE_MAX_DAYS = 30
+TIMESERIES_RANGE_MAX_DAYS = 1095
+# the most days each period can cover, for cache invalidation
+TIMESERIES_PERIOD_DAYS = {
+    "1d": 1,
+    "7d": 7,
+    "30d": 30,
+    "1w": 7,
+    "1m": 31,
+    "3m": 92,
+    "6m": 184,
+    "1y": 366,
+}
+
 
 def check_fitbit_access_profile(fitbitUser: FitbitUser) -> bool:
     """
     This is a good idea BUT need write access to profile do use this endpoint.
     > Invalid authentication token. The PROFILE (WRITE) scope is required.
     """
-    resp, _ = fitbitUser.make_request(
-        "get", "https://api.fitbit.com/1/user/-/profile.json"
-    )
+    resp, _ = fitbitUser.make_request("get", f"{api_base_url()}/1/user/-/profile.json")
 
     if resp.status_code != 200:
         return False
@@ -31,15 +78,121 @@ def check_fitbit_access_profile(fitbitUser: FitbitUser) -> bool:
     return True
 
 
-# instead, wrap fitbitUser.update_tokens()
-# and catch exceptions to return T/F on having access
+def access_check_key(fitbitUser: FitbitUser) -> str:
+    # keyed on the refresh token too, so a failed verdict
+    # doesn't outlive the user connecting again
+    digest = hashlib.sha256(fitbitUser.refresh_token.encode()).hexdigest()[:16]
+    return f"fitbit:access:{fitbitUser.pk}:{digest}"
+
+
+# instead, decide from the token expiry, and only when it has expired
+# wrap fitbitUser.update_tokens() and catch exceptions to return T/F on having access
 def check_fitbit_access(fitbitUser: FitbitUser) -> bool:
+    """
+    Whether we can (still) call Fitbit for the user, without a round trip
+    unless their access token has expired. Then the tokens are refreshed
+    (coalesced with any concurrent refresh, see FitbitUser.update_tokens)
+    and the verdict is cached for FITBIT_ACCESS_CHECK_TTL seconds (default 60),
+    so a user who revoked access doesn't cost a refresh attempt per page load.
+    A token revoked before it expires still shows up as a 401 from make_request.
+    """
+    if not fitbitUser.is_expired:
+        return True
+    key = access_check_key(fitbitUser)
+    verdict = caches["default"].get(key)
+    if verdict is not None:
+        return verdict
     try:
         fitbitUser.update_tokens()
+        verdict = True
     except Exception as e:
         logger.info(f"Error wrapped in check_fitbit_access: {e}")
-        return False
-    return True
+        verdict = False
+    caches["default"].set(
+        key, verdict, getattr(settings, "FITBIT_ACCESS_CHECK_TTL", 60)
+    )
+    return verdict
+
+
+def api_base_url() -> str:
+    """
+    FITBIT_API_BASE_URL (default https://api.fitbit.com),
+    e.g. to point the helpers at the simulator (see simulator.py).
+    """
+    return getattr(settings, "FITBIT_API_BASE_URL", "https://api.fitbit.com").rstrip(
+        "/"
+    )
+
+
+def timeseries_range_max_days(resource: str) -> int:
+    if resource in {"activityCalories", "tracker/activityCalories"}:
+        return ACTIVITY_CALORIES_RANGE_MAX_DAYS
+    return TIMESERIES_RANGE_MAX_DAYS
+
+
+def timeseries_key(resource: str) -> str:
+    """The key of the list in a time series response, e.g. activities-tracker-steps."""
+    return "activities-" + resource.replace("/", "-")
+
+
+# The _*_url functions validate the arguments and build the endpoint URL
+# (None if the arguments are invalid), so that the helpers below and their
+# async counterparts in aio.py share one definition of each endpoint.
+
+
+def _daily_activity_summary_url(d: date) -> str:
+    return f"{api_base_url()}/1/user/-/activities/date/{d.isoformat()}.json"
+
+
+def _sleep_log_by_date_url(d: date) -> str:
+    return f"{api_base_url()}/1.2/user/-/sleep/date/{d.isoformat()}.json"
+
+
+def _sleep_log_by_date_range_url(start_date: date, end_date: date) -> Optional[str]:
+    # check max range
+    if (end_date - start_date).days > SLEEP_RANGE_MAX_DAYS:
+        logger.info("Date range is too long, won't try to fetch data.")
+        return None
+    return f"{api_base_url()}/1.2/user/-/sleep/date/{start_date.isoformat()}/{end_date.isoformat()}.json"
+
+
+def _activity_intraday_by_date_url(
+    activity: str, d: date, interval: str
+) -> Optional[str]:
+    # calories | distance | elevation | floors | steps
+    if activity not in INTRADAY_ACTIVITIES:
+        logger.info(f"Invalid activity {activity}, won't try to fetch data.")
+        return None
+    # 1min | 5min | 15min
+    if interval not in INTRADAY_INTERVALS:
+        logger.info(f"Invalid interval {interval}, won't try to fetch data.")
+        return None
+    return f"{api_base_url()}/1/user/-/activities/{activity}/date/{d.isoformat()}/1d/{interval}.json"
+
+
+def _activity_timeseries_by_date_url(
+    resource: str, d: date, period: str
+) -> Optional[str]:
+    if resource not in ACTIVITY_RESOURCES + TRACKER_ONLY_RESOURCES:
+        logger.info(f"Invalid resource {resource}, won't try to fetch data.")
+        return None
+    if period not in TIMESERIES_PERIODS:
+        logger.info(f"Invalid period {period}, won't try to fetch data.")
+        return None
+    return f"{api_base_url()}/1/user/-/activities/{resource}/date/{d.isoformat()}/{period}.json"
+
+
+def _activity_timeseries_by_date_range_url(
+    resource: str, start_date: date, end_date: date
+) -> Optional[str]:
+    # check max range
+    if (end_date - start_date).days > timeseries_range_max_days(resource):
+        logger.info("Date range is too long, won't try to fetch data.")
+        return None
+    if resource not in ACTIVITY_RESOURCES + TRACKER_ONLY_RESOURCES:
+        logger.info(f"Invalid resource {resource}, won't try to fetch data.")
+        return None
+    return f"{api_base_url()}/1/user/-/activities/{resource}/date/{start_date.isoformat()}/{end_date.isoformat()}.json"
 
 
 def daily_activity_summary(
@@ -49,10 +202,7 @@ def daily_activity_summary(
     ref: https://dev.fitbit.com/build/reference/web-api/activity/get-daily-activity-summary/
     format: /1/user/[user-id]/activities/date/[date].json
     """
-    return fitbitUser.make_request(
-        "get",
-        f"https://api.fitbit.com/1/user/-/activities/date/{d.isoformat()}.json",
-    )
+    return cached_get(fitbitUser, _daily_activity_summary_url(d), "activities", d, d)
 
 
 def sleep_log_by_date(
@@ -62,9 +212,7 @@ def sleep_log_by_date(
     ref: https://dev.fitbit.com/build/reference/web-api/sleep/get-sleep-log-by-date/
     format: /1.2/user/[user-id]/sleep/date/[date].json
     """
-    return fitbitUser.make_request(
-        "get", f"https://api.fitbit.com/1.2/user/-/sleep/date/{d.isoformat()}.json"
-    )
+    return cached_get(fitbitUser, _sleep_log_by_date_url(d), "sleep", d, d)
 
 
 def sleep_log_by_date_range(
@@ -76,14 +224,10 @@ def sleep_log_by_date_range(
 
     note maximum range: 100 days
     """
-    # check max range
-    if (end_date - start_date).days > 100:
-        logger.info("Date range is too long, won't try to fetch data.")
+    url = _sleep_log_by_date_range_url(start_date, end_date)
+    if url is None:
         return {}
-    return fitbitUser.make_request(
-        "get",
-        f"https://api.fitbit.com/1.2/user/-/sleep/date/{start_date.isoformat()}/{end_date.isoformat()}.json",
-    )
+    return cached_get(fitbitUser, url, "sleep", start_date, end_date)
 
 
 def activity_intraday_by_date(
@@ -95,19 +239,10 @@ def activity_intraday_by_date(
     * /1/user/[user-id]/activities/[resource]/date/[date]/1d/[detail-level].json
     * /1/user/[user-id]/activities/[resource]/date/[date]/1d/[detail-level]/time/[start-time]/[end-time].json
     """
-    # calories | distance | elevation | floors | steps
-    if activity not in ["calories", "distance", "elevation", "floors", "steps"]:
-        logger.info(f"Invalid activity {activity}, won't try to fetch data.")
-        return {}
-    # 1min | 5min | 15min
-    if interval not in ["1min", "5min", "15min"]:
-        logger.info(f"Invalid interval {interval}, won't try to fetch data.")
+    url = _activity_intraday_by_date_url(activity, d, interval)
+    if url is None:
         return {}
-
-    return fitbitUser.make_request(
-        "get",
-        f"https://api.fitbit.com/1/user/-/activities/{activity}/date/{d.isoformat()}/1d/{interval}.json",
-    )
+    return cached_get(fitbitUser, url, "activities", d, d)
 
 
 def activity_timeseries_by_date(
@@ -117,41 +252,11 @@ def activity_timeseries_by_date(
     ref: https://dev.fitbit.com/build/reference/web-api/activity-timeseries/get-activity-timeseries-by-date/
     format: /1/user/[user-id]/activities/[resource-path]/date/[date]/[period].json
     """
-    all_activity_resources = [
-        "activityCalories",
-        "calories",
-        "caloriesBMR",
-        "distance",
-        "elevation",
-        "floors",
-        "minutesSedentary",
-        "minutesLightlyActive",
-        "minutesFairlyActive",
-        "minutesVeryActive",
-        "steps",
-    ]
-    tracker_only_resources = [
-        "tracker/activityCalories",
-        "tracker/calories",
-        "tracker/distance",
-        "tracker/elevation",
-        "tracker/floors",
-        "tracker/minutesSedentary",
-        "tracker/minutesLightlyActive",
-        "tracker/minutesFairlyActive",
-        "tracker/minutesVeryActive",
-        "tracker/steps",
-    ]
-    if resource not in all_activity_resources + tracker_only_resources:
-        logger.info(f"Invalid resource {resource}, won't try to fetch data.")
-        return {}
-    if period not in ["1d", "7d", "30d", "1w", "1m", "3m", "6m", "1y"]:
-        logger.info(f"Invalid period {period}, won't try to fetch data.")
+    url = _activity_timeseries_by_date_url(resource, d, period)
+    if url is None:
         return {}
-    return fitbitUser.make_request(
-        "get",
-        f"https://api.fitbit.com/1/user/-/activities/{resource}/date/{d.isoformat()}/{period}.json",
-    )
+    start_date = d - timedelta(days=TIMESERIES_PERIOD_DAYS[period] - 1)
+    return cached_get(fitbitUser, url, "activities", start_date, d)
 
 
 def activity_timeseries_by_date_range(
@@ -163,45 +268,27 @@ def activity_timeseries_by_date_range(
 
     note maximum range: 30 days for calories, 1095 days for everything else
     """
-    # check max range
-    if (
-        resource in {"activityCalories", "tracker/activityCalories"}
-        and (end_date - start_date).days > 30
-    ):
-        logger.info("Date range is too long, won't try to fetch data.")
+    url = _activity_timeseries_by_date_range_url(resource, start_date, end_date)
+    if url is None:
         return {}
-    elif (end_date - start_date).days > 1095:
-        logger.info("Date range is too long, won't try to fetch data.")
-        return {}
-    all_activity_resources = [
-        "activityCalories",
-        "calories",
-        "caloriesBMR",
-        "distance",
-        "elevation",
-        "floors",
-        "minutesSedentary",
-        "minutesLightlyActive",
-        "minutesFairlyActive",
-        "minutesVeryActive",
-        "steps",
-    ]
-    tracker_only_resources = [
-        "tracker/activityCalories",
-        "tracker/calories",
-        "tracker/distance",
-        "tracker/elevation",
-        "tracker/floors",
-        "tracker/minutesSedentary",
-        "tracker/minutesLightlyActive",
-        "tracker/minutesFairlyActive",
-        "tracker/minutesVeryActive",
-        "tracker/steps",
-    ]
-    if resource not in all_activity_resources + tracker_only_resources:
-        logger.info(f"Invalid resource {resource}, won't try to fetch data.")
-        return {}
-    return fitbitUser.make_request(
-        "get",
-        f"https://api.fitbit.com/1/user/-/activities/{resource}/date/{start_date.isoformat()}/{end_date.isoformat()}.json",
-    )
+    return cached_get(fitbitUser, url, "activities", start_date, end_date)
+
+
+def fetch_json(
+    helper: Callable, fitbitUser: FitbitUser, *args, **kwargs
+) -> Tuple[Optional[Dict], Optional[Exception]]:
+    """
+    Call one of the helpers above and return its parsed response as
+    ``(data, error)``. The ``{}`` the helpers return for arguments they
+    won't fetch comes back as a ValueError.
+    """
+    result = helper(fitbitUser, *args, **kwargs)
+    if not result:
+        return (
+            None,
+            ValueError(f"Invalid arguments for {helper.__name__}: {args} {kwargs}"),
+        )
+    resp, err = result
+    if err is not None:
+        return (None, err)
+    return (resp.json(), None)
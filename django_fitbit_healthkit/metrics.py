@@ -0,0 +1,220 @@
+"""
+Metrics about our calls to Fitbit, in the Prometheus text format.
+
+The receivers here turn the signals in signals.py into counters and
+histograms, and views.metrics serves them (add ``fitbit/metrics`` to your
+scrape config, and set ``FITBIT_METRICS_TOKEN`` or keep it off the public
+internet). Recording a request is a lock and a few dict updates, cheap
+enough to leave on; set ``FITBIT_METRICS_ENABLED = False`` to not connect
+the receivers at all.
+
+* ``fitbit_requests_total{method, endpoint, status}``
+* ``fitbit_request_duration_seconds{method, endpoint}`` (histogram)
+* ``fitbit_response_bytes_total{method, endpoint}``
+* ``fitbit_request_retries_total{method, endpoint}``
+* ``fitbit_token_refreshes_total{result}``
+* ``fitbit_rate_limit_remaining`` (histogram of the remaining budgets
+  Fitbit reports; per-user gauges would mean one series per user)
+* ``fitbit_webhook_notifications_total`` / ``fitbit_webhook_notifications_stored_total``
+* ``fitbit_webhook_batch_size`` (histogram)
+
+Metrics are per process, like prometheus_client's default registry,
+so scrape every process (or sum them in your queries).
+"""
+
+import bisect
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+from django.conf import settings
+
+from .signals import (
+    notifications_ingested,
+    rate_limit_updated,
+    request_completed,
+    tokens_refreshed,
+)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+RATE_LIMIT_BUCKETS = (0, 5, 10, 25, 50, 75, 100, 150)
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100)
+
+_lock = threading.Lock()
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        buckets: Sequence[float],
+        labels: Sequence[str] = (),
+    ):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        # labels -> [count per bucket (and +Inf), sum]
+        self.values: Dict[Tuple, List] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][i] += 1
+            counts[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket"
+                    f"{_labels(self.labels + ('le',), labels + (bound,))} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total}")
+            lines.append(
+                f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+            )
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple, values: Tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+REQUESTS = Counter(
+    "fitbit_requests_total",
+    "Responses from Fitbit.",
+    ["method", "endpoint", "status"],
+)
+REQUEST_DURATION = Histogram(
+    "fitbit_request_duration_seconds",
+    "Time to get a response from Fitbit.",
+    LATENCY_BUCKETS,
+    ["method", "endpoint"],
+)
+RESPONSE_BYTES = Counter(
+    "fitbit_response_bytes_total",
+    "Bytes received from Fitbit.",
+    ["method", "endpoint"],
+)
+RETRIES = Counter(
+    "fitbit_request_retries_total",
+    "Requests to Fitbit that were retries of an earlier attempt.",
+    ["method", "endpoint"],
+)
+TOKEN_REFRESHES = Counter(
+    "fitbit_token_refreshes_total",
+    "Token refresh requests made to Fitbit.",
+    ["result"],
+)
+RATE_LIMIT_REMAINING = Histogram(
+    "fitbit_rate_limit_remaining",
+    "Requests left in a user's rate limit window, as reported by Fitbit.",
+    RATE_LIMIT_BUCKETS,
+)
+WEBHOOK_NOTIFICATIONS = Counter(
+    "fitbit_webhook_notifications_total",
+    "Notifications received from Fitbit.",
+)
+WEBHOOK_NOTIFICATIONS_STORED = Counter(
+    "fitbit_webhook_notifications_stored_total",
+    "Notifications stored after skipping unknown owners and duplicates.",
+)
+WEBHOOK_BATCH_SIZE = Histogram(
+    "fitbit_webhook_batch_size",
+    "Notifications per webhook POST.",
+    BATCH_SIZE_BUCKETS,
+)
+
+METRICS = [
+    REQUESTS,
+    REQUEST_DURATION,
+    RESPONSE_BYTES,
+    RETRIES,
+    TOKEN_REFRESHES,
+    RATE_LIMIT_REMAINING,
+    WEBHOOK_NOTIFICATIONS,
+    WEBHOOK_NOTIFICATIONS_STORED,
+    WEBHOOK_BATCH_SIZE,
+]
+
+
+def render() -> str:
+    """All metrics in the Prometheus text format."""
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.render()]
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    """Forget everything recorded so far (for tests)."""
+    with _lock:
+        for metric in METRICS:
+            metric.values.clear()
+
+
+def on_request_completed(
+    sender, method, endpoint, status_code, latency, nbytes, attempt, **kwargs
+):
+    REQUESTS.inc(method, endpoint, status_code)
+    REQUEST_DURATION.observe(latency, method, endpoint)
+    RESPONSE_BYTES.inc(method, endpoint, amount=nbytes)
+    if attempt > 1:
+        RETRIES.inc(method, endpoint)
+
+
+def on_tokens_refreshed(sender, error, **kwargs):
+    TOKEN_REFRESHES.inc("success" if error is None else "error")
+
+
+def on_rate_limit_updated(sender, remaining, **kwargs):
+    RATE_LIMIT_REMAINING.observe(remaining)
+
+
+def on_notifications_ingested(sender, received, stored, **kwargs):
+    WEBHOOK_NOTIFICATIONS.inc(amount=received)
+    WEBHOOK_NOTIFICATIONS_STORED.inc(amount=stored)
+    WEBHOOK_BATCH_SIZE.observe(received)
+
+
+def connect() -> None:
+    """Connect the receivers, unless FITBIT_METRICS_ENABLED is False."""
+    if not getattr(settings, "FITBIT_METRICS_ENABLED", True):
+        return
+    request_completed.connect(on_request_completed, dispatch_uid="fitbit_metrics")
+    tokens_refreshed.connect(on_tokens_refreshed, dispatch_uid="fitbit_metrics")
+    rate_limit_updated.connect(on_rate_limit_updated, dispatch_uid="fitbit_metrics")
+    notifications_ingested.connect(
+        on_notifications_ingested, dispatch_uid="fitbit_metrics"
+    )
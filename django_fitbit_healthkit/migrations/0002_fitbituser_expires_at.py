@@ -0,0 +1,35 @@
+# Generated by Django 6.1.2 on 2026-10-18 09:32
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def set_expires_at(apps, schema_editor):
+    FitbitUser = apps.get_model("fitbit", "FitbitUser")
+    users = FitbitUser.objects.filter(expires_in__isnull=False).only(
+        "last_updated", "expires_in"
+    )
+    for fitbit_user in users.iterator():
+        fitbit_user.expires_at = fitbit_user.last_updated + timedelta(
+            seconds=fitbit_user.expires_in
+        )
+        # queryset update so that last_updated (auto_now) is left alone
+        FitbitUser.objects.filter(pk=fitbit_user.pk).update(
+            expires_at=fitbit_user.expires_at
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("fitbit", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fitbituser",
+            name="expires_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(set_expires_at, migrations.RunPython.noop),
+    ]
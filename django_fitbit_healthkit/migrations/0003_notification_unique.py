@@ -0,0 +1,45 @@
+# Generated by Django 6.1.2 on 2026-10-18 09:33
+
+from django.db import migrations, models
+
+
+def delete_duplicate_notifications(apps, schema_editor):
+    FitbitNotification = apps.get_model("fitbit", "FitbitNotification")
+    duplicates = (
+        FitbitNotification.objects.values("user", "notification", "date")
+        .annotate(keep=models.Min("id"), count=models.Count("id"))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        FitbitNotification.objects.filter(
+            user=duplicate["user"],
+            notification=duplicate["notification"],
+            date=duplicate["date"],
+        ).exclude(id=duplicate["keep"]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("fitbit", "0002_fitbituser_expires_at"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="fitbituser",
+            name="fitbit_id",
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name="fitbitnotification",
+            name="notification",
+            field=models.CharField(max_length=64),
+        ),
+        migrations.RunPython(delete_duplicate_notifications, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="fitbitnotification",
+            constraint=models.UniqueConstraint(
+                fields=("user", "notification", "date"),
+                name="fitbit_notification_unique",
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.1.2 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("fitbit", "0003_notification_unique"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fitbitnotification",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="fitbitnotification",
+            name="available_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="fitbitnotification",
+            name="last_error",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="fitbitnotification",
+            name="processed",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="fitbitnotification",
+            index=models.Index(
+                condition=models.Q(("processed__isnull", True)),
+                fields=["available_at"],
+                name="fitbit_notification_pending",
+            ),
+        ),
+    ]
@@ -0,0 +1,115 @@
+# Generated by Django 6.1.2 on 2026-10-18 09:35
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("fitbit", "0004_notification_processing"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyActivitySummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("data", models.JSONField()),
+                ("fetched", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="fitbit.fitbituser",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "date"), name="fitbit_daily_activity_unique"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="SleepLog",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("log_id", models.BigIntegerField()),
+                ("date_of_sleep", models.DateField()),
+                ("data", models.JSONField()),
+                ("fetched", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="fitbit.fitbituser",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "date_of_sleep"], name="fitbit_sleep_log_date"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "log_id"), name="fitbit_sleep_log_unique"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="TimeSeriesValue",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("resource", models.CharField(max_length=64)),
+                ("date", models.DateField()),
+                ("value", models.FloatField()),
+                ("fetched", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="fitbit.fitbituser",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "resource", "date"),
+                        name="fitbit_timeseries_unique",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 6.1.2 on 2026-10-18 09:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("fitbit", "0005_activity_store"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IntradaySeries",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("resource", models.CharField(max_length=64)),
+                ("date", models.DateField()),
+                ("interval", models.CharField(max_length=8)),
+                ("data", models.BinaryField()),
+                ("fetched", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="fitbit.fitbituser",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "resource", "interval", "date"),
+                        name="fitbit_intraday_unique",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 6.1.2 on 2026-10-18 09:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("fitbit", "0006_intraday_series"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BackfillChunk",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("summary", "Daily activity summary"),
+                            ("sleep", "Sleep logs"),
+                            ("timeseries", "Activity time series"),
+                            ("intraday", "Intraday activity"),
+                        ],
+                        max_length=16,
+                    ),
+                ),
+                ("resource", models.CharField(blank=True, default="", max_length=64)),
+                ("start_date", models.DateField()),
+                ("end_date", models.DateField()),
+                ("added", models.DateTimeField(auto_now_add=True)),
+                ("completed", models.DateTimeField(blank=True, null=True)),
+                ("available_at", models.DateTimeField(blank=True, null=True)),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("last_error", models.TextField(blank=True, default="")),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="fitbit.fitbituser",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("completed__isnull", True)),
+                        fields=["available_at"],
+                        name="fitbit_backfill_pending",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "kind", "resource", "start_date"),
+                        name="fitbit_backfill_chunk_unique",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.1.2 on 2026-10-18 09:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("fitbit", "0007_backfill"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationPayload",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("body", models.TextField()),
+                ("received", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
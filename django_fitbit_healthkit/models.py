@@ -1,22 +1,72 @@
+import os
+import threading
+import time
 from ast import Dict
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Tuple
 
 import requests
+import urllib3
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone as django_timezone
 
+from . import ratelimit, requestlog, retry, series, signals
+from .session import get_session, get_timeout
 from .util import encoded_secret
 import logging
 
 logger = logging.getLogger(__name__)
 
+# the only fields a token refresh writes
+TOKEN_FIELDS = [
+    "access_token",
+    "refresh_token",
+    "expires_in",
+    "expires_at",
+    "scopes",
+    "last_updated",
+]
+
+# one refresh at a time per user within this process: users share a fixed
+# set of locks (a refresh holds its user's for one token request), so the
+# locks don't pile up in workers that go through the whole user base
+REFRESH_LOCK_STRIPES = 64
+_refresh_locks = [threading.Lock() for _ in range(REFRESH_LOCK_STRIPES)]
+
+
+def _refresh_lock(pk) -> threading.Lock:
+    return _refresh_locks[hash(pk) % REFRESH_LOCK_STRIPES]
+
+
+def _reset_refresh_locks() -> None:
+    global _refresh_locks
+    _refresh_locks = [threading.Lock() for _ in range(REFRESH_LOCK_STRIPES)]
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_refresh_locks)
+
+
+def _never_connected(e: requests.exceptions.RequestException) -> bool:
+    """
+    Whether a connection error or timeout happened before the request could
+    be sent (see aio.make_request for httpx's equivalent).
+    """
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    # requests wraps urllib3's errors: MaxRetryError(reason=NewConnectionError)
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
 
 class FitbitUser(models.Model):
     """Adds a token to a custom User model."""
 
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    fitbit_id = models.CharField(max_length=1024)
+    # indexed: the subscription webhook looks users up by their fitbit id
+    # (short enough for MySQL to index)
+    fitbit_id = models.CharField(max_length=255, db_index=True)
     access_token = models.CharField(max_length=1024)
     refresh_token = models.CharField(max_length=1024)
     expires_in = models.IntegerField()
@@ -24,63 +74,84 @@ class FitbitUser(models.Model):
     # store the last updated datetime
     # so that we can check if the token is expired
     last_updated = models.DateTimeField(auto_now=True)
+    # when the access token expires, set whenever we get new tokens
+    # (last_updated moves on any save, so it can't be used for this)
+    # indexed so that tokens about to expire can be refreshed in bulk
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     @property
     def is_expired(self) -> bool:
+        if self.expires_at is not None:
+            return datetime.now(timezone.utc) > self.expires_at
         return self.expires_in is None or datetime.now(timezone.utc) > (
             self.last_updated + timedelta(seconds=self.expires_in)
         )
 
+    def _token_request_kwargs(self) -> Dict:
+        """
+        Headers and params for the refresh token POST,
+        shared by get_new_tokens and the async client in aio.py.
+        """
+        return {
+            "headers": {
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Authorization": f"Basic {encoded_secret(settings.FITBIT_CLIENT_ID, settings.FITBIT_CLIENT_SECRET)}",
+            },
+            "params": {
+                "grant_type": "refresh_token",
+                "refresh_token": self.refresh_token,
+            },
+        }
+
+    @staticmethod
+    def _parse_token_response(response) -> Tuple[Optional[Dict], Optional[Exception]]:
+        if response.status_code == 401:
+            logger.info("401 from fitbit, unauthorized")
+            # unauthorized, clear the tokens
+            return (None, Exception("Unauthorized"))
+        elif response.status_code == 200:
+            # return the new token data
+            return (response.json(), None)
+        # should propogate the error up to the caller
+        logger.info(f"Error in fitbit oauth handshake: {response.text}")
+        return (
+            None,
+            Exception(f"Error in fitbit oauth handshake: {response.text}"),
+        )
+
     def get_new_tokens(self) -> Tuple[Optional[Dict], Optional[Exception]]:
         logger.info("Getting new tokens")
         if self.refresh_token is None or self.refresh_token == "":
             logger.info("No refresh token, can't get new tokens")
             return (None, Exception("No refresh token available"))
 
-        params = {
-            "grant_type": "refresh_token",
-            "refresh_token": self.refresh_token,
-        }
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Authorization": f"Basic {encoded_secret(settings.FITBIT_CLIENT_ID, settings.FITBIT_CLIENT_SECRET)}",
-        }
         try:
-            response = requests.post(
+            response = get_session().post(
                 settings.FITBIT_ACCESS_REFRESH_TOKEN_REQUEST_URI,
-                headers=headers,
-                params=params,
+                timeout=get_timeout(),
+                **self._token_request_kwargs(),
             )
-            if response.status_code == 401:
-                logger.info("401 from fitbit, unauthorized")
-                # unauthorized, clear the tokens
-                return (None, Exception("Unauthorized"))
-            elif response.status_code == 200:
-                # return the new token data
-                return (response.json(), None)
-            else:
-                # should propogate the error up to the caller
-                logger.info(f"Error in fitbit oauth handshake: {response.text}")
-                return (
-                    None,
-                    Exception(f"Error in fitbit oauth handshake: {response.text}"),
-                )
+            result = self._parse_token_response(response)
         # catch these separately
         except requests.exceptions.RequestException as e:
             logger.info(f"Error in fitbit token request: {e}")
-            return (None, e)
+            result = (None, e)
         except Exception as e:
             logger.info(f"Error in fitbit token request: {e}")
-            return (None, e)
+            result = (None, e)
+        signals.tokens_refreshed.send(
+            sender=FitbitUser, fitbit_user=self, error=result[1]
+        )
+        return result
 
-    def update_tokens(self) -> None:
+    def _set_tokens(
+        self, reauth_data: Optional[Dict], err: Optional[Exception] = None
+    ) -> None:
         """
-        Updates the tokens.
+        Copies the result of a token refresh onto the instance (without saving).
         Raises a generic exception if there are any errors.
         """
-        logger.info("Updating tokens")
         required_keys = ["access_token", "refresh_token", "expires_in"]
-        reauth_data, err = self.get_new_tokens()
         if err is not None:
             logger.info((reauth_data, err))
             raise Exception(f"Error in fitbit oauth handshake: {err}")
@@ -90,8 +161,59 @@ class FitbitUser(models.Model):
         self.access_token = reauth_data["access_token"]
         self.refresh_token = reauth_data["refresh_token"]
         self.expires_in = reauth_data["expires_in"]
+        self.expires_at = django_timezone.now() + timedelta(seconds=self.expires_in)
         self.scopes = reauth_data.get("scope", "")
-        self.save()
+
+    def _adopt_tokens(self, other: "FitbitUser") -> None:
+        for field in TOKEN_FIELDS:
+            setattr(self, field, getattr(other, field))
+
+    def _save_tokens(self, stale_refresh_token: str) -> bool:
+        """
+        Writes only the token fields, and only if nobody else has rotated
+        the refresh token since we read it (optimistic versioning, for
+        databases where select_for_update doesn't lock).
+        Returns False if we lost that race.
+        """
+        self.last_updated = django_timezone.now()
+        return bool(
+            FitbitUser.objects.filter(
+                pk=self.pk, refresh_token=stale_refresh_token
+            ).update(**{field: getattr(self, field) for field in TOKEN_FIELDS})
+        )
+
+    def update_tokens(self) -> None:
+        """
+        Updates the tokens.
+        Raises a generic exception if there are any errors.
+
+        Fitbit rotates the refresh token on every refresh, so two concurrent
+        refreshes for the same user would log them out. Refreshes are
+        coalesced: one at a time per user in this process, and across
+        processes the user's row is locked while refreshing. A caller that
+        waited for someone else's refresh just picks up the new tokens.
+        """
+        logger.info("Updating tokens")
+        if self.pk is None:
+            self._set_tokens(*self.get_new_tokens())
+            self.save()
+            return
+
+        stale_refresh_token = self.refresh_token
+        with _refresh_lock(self.pk), transaction.atomic():
+            current = (
+                FitbitUser.objects.select_for_update()
+                .only(*TOKEN_FIELDS)
+                .get(pk=self.pk)
+            )
+            if current.refresh_token != stale_refresh_token:
+                logger.info("Tokens were refreshed elsewhere, reusing them")
+                self._adopt_tokens(current)
+                return
+            self._set_tokens(*self.get_new_tokens())
+            if not self._save_tokens(stale_refresh_token):
+                logger.info("Lost a token refresh race, reloading tokens")
+                self.refresh_from_db(fields=TOKEN_FIELDS)
         logger.info("Successfully updated tokens")
 
     def make_request(
@@ -100,12 +222,27 @@ class FitbitUser(models.Model):
         *args,
         headers: Optional[Dict] = {},
         max_fetch_attempts: int = 3,
+        max_rate_limit_wait: Optional[float] = None,
+        idempotent: Optional[bool] = None,
         **kwargs,
     ) -> Tuple[Optional[requests.models.Response], Optional[Exception]]:
         """
         Wrapper for requests.get and requests.post that will handle
         the token refresh and retries for the user credentials.
 
+        Requests go through the process-wide pooled session
+        (see session.py), so retries and subsequent calls reuse
+        the same keep-alive connections.
+
+        Failed attempts are retried with backoff, honouring Retry-After,
+        as retry.py decides; POSTs are only retried if they never got
+        sent, unless the caller passes idempotent=True.
+
+        Each attempt is counted against the user's rate limit budget
+        (see ratelimit.py). If the budget is spent and won't reset within
+        max_rate_limit_wait seconds, this returns a RateLimited error
+        carrying the time the caller can try again.
+
         This captures all exceptions and returns them as the second
         tuple element.
         """
@@ -117,22 +254,52 @@ class FitbitUser(models.Model):
                 return (None, e)
 
         fetch_attempts = 0
+        method = request_type.upper()
+        url = args[0] if args else kwargs.get("url", "")
 
         headers = {"authorization": f"Bearer {self.access_token}", **headers}
+        kwargs.setdefault("timeout", get_timeout())
+        session = get_session()
+        retry.get_budget().deposit()
 
         while fetch_attempts < max_fetch_attempts:
-            logger.info(f"Fetch attempt #{fetch_attempts}")
+            logger.debug("Fetch attempt #%d", fetch_attempts)
             fetch_attempts += 1
-            if request_type == "GET":
-                requester = requests.get
-            else:
-                requester = requests.post
-
+            err = ratelimit.acquire(self, max_rate_limit_wait)
+            if err is not None:
+                return (None, err)
+            started = time.perf_counter()
             try:
-                response = requester(*args, headers=headers, **kwargs)
+                response = session.request(method, *args, headers=headers, **kwargs)
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                delay = retry.after_error(
+                    method,
+                    fetch_attempts,
+                    max_fetch_attempts,
+                    e,
+                    not _never_connected(e),
+                    idempotent,
+                )
+                if delay is None:
+                    return (None, e)
+                time.sleep(delay)
+                continue
             except requests.exceptions.RequestException as e:
                 return (None, e)
-            logger.info((response.status_code, response.text))
+            requestlog.response_completed(
+                self,
+                method,
+                url,
+                response.status_code,
+                time.perf_counter() - started,
+                len(response.content),
+                lambda: response.text,
+                fetch_attempts,
+            )
+            reset_at = ratelimit.record(self, response.status_code, response.headers)
 
             if response.status_code == 401:
                 try:
@@ -142,14 +309,23 @@ class FitbitUser(models.Model):
                 headers["authorization"] = f"Bearer {self.access_token}"
                 # make another fetch attempt
                 continue
-            elif response.status_code == 200:
+            elif 200 <= response.status_code < 300:
+                # 201 Created and 204 No Content from the subscription endpoints
                 return (response, None)
-            elif response.status_code == 429:
-                # backoff warning/error
-                # don't keep making requests
-                # should propogate the error up to the caller
-                return (None, Exception(f"Backoff: {response.text}"))
-            # else, we'll just try again up to max_fetch_attempts
+
+            delay, err = retry.after_response(
+                method,
+                fetch_attempts,
+                max_fetch_attempts,
+                response.status_code,
+                response.headers,
+                lambda: response.text,
+                idempotent,
+                reset_at,
+            )
+            if err is not None:
+                return (None, err)
+            time.sleep(delay)
         return (None, Exception("Max attempts"))
 
 
@@ -186,8 +362,199 @@ class FitbitNotification(models.Model):
 
     user = models.ForeignKey(FitbitUser, on_delete=models.CASCADE)
     date = models.DateField()
-    notification = models.TextField()
+    # the collectionType, bounded so it can be part of the unique key
+    notification = models.CharField(max_length=64)
     added = models.DateTimeField(auto_now_add=True)
+    # when the data was fetched (see notifications.py), null while pending
+    processed = models.DateTimeField(null=True, blank=True)
+    # a pending notification isn't picked up before this time,
+    # set while a worker has claimed it and when it's retried later
+    available_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        constraints = [
+            # Fitbit can tell us about the same change many times,
+            # we only need to know once
+            models.UniqueConstraint(
+                fields=["user", "notification", "date"],
+                name="fitbit_notification_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["available_at"],
+                condition=models.Q(processed__isnull=True),
+                name="fitbit_notification_pending",
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"{self.user}: {self.date} - {self.notification}"
+
+
+class NotificationPayload(models.Model):
+    """
+    A webhook POST from Fitbit as it was received, queued by the async
+    webhook (views.fitbit_subscription_async) until a worker expands it
+    into FitbitNotification rows and deletes it
+    (see notifications.ingest_pending_payloads).
+    """
+
+    body = models.TextField()
+    received = models.DateTimeField(default=django_timezone.now)
+
+    def __str__(self) -> str:
+        return f"Payload received {self.received}"
+
+
+class BackfillChunk(models.Model):
+    """
+    One planned call of a user's history backfill (see backfill.py),
+    and its checkpoint: completed is set once its data is stored.
+    """
+
+    KIND_CHOICES = [
+        ("summary", "Daily activity summary"),
+        ("sleep", "Sleep logs"),
+        ("timeseries", "Activity time series"),
+        ("intraday", "Intraday activity"),
+    ]
+
+    user = models.ForeignKey(FitbitUser, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    # the time series or intraday activity, blank for the others
+    resource = models.CharField(max_length=64, blank=True, default="")
+    start_date = models.DateField()
+    end_date = models.DateField()
+    added = models.DateTimeField(auto_now_add=True)
+    completed = models.DateTimeField(null=True, blank=True)
+    # same as FitbitNotification: the lease while claimed, or when to retry
+    available_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "kind", "resource", "start_date"],
+                name="fitbit_backfill_chunk_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["available_at"],
+                condition=models.Q(completed__isnull=True),
+                name="fitbit_backfill_pending",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user}: {self.kind} {self.resource} {self.start_date} - {self.end_date}"
+
+
+class DailyActivitySummary(models.Model):
+    """
+    A stored daily activity summary (the response of
+    methods.daily_activity_summary) for one user and day. See store.py.
+    """
+
+    user = models.ForeignKey(FitbitUser, on_delete=models.CASCADE)
+    date = models.DateField()
+    data = models.JSONField()
+    fetched = models.DateTimeField(default=django_timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "date"], name="fitbit_daily_activity_unique"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user}: {self.date}"
+
+
+class SleepLog(models.Model):
+    """
+    A stored sleep log, one of the entries in the "sleep" list
+    returned by the sleep log endpoints. See store.py.
+    """
+
+    user = models.ForeignKey(FitbitUser, on_delete=models.CASCADE)
+    log_id = models.BigIntegerField()
+    date_of_sleep = models.DateField()
+    data = models.JSONField()
+    fetched = models.DateTimeField(default=django_timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "log_id"], name="fitbit_sleep_log_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "date_of_sleep"], name="fitbit_sleep_log_date"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user}: {self.date_of_sleep} - {self.log_id}"
+
+
+class TimeSeriesValue(models.Model):
+    """
+    A stored daily value of an activity time series
+    (e.g. steps on a date). See store.py.
+    """
+
+    user = models.ForeignKey(FitbitUser, on_delete=models.CASCADE)
+    resource = models.CharField(max_length=64)
+    date = models.DateField()
+    value = models.FloatField()
+    fetched = models.DateTimeField(default=django_timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "resource", "date"], name="fitbit_timeseries_unique"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user}: {self.resource} {self.date} - {self.value}"
+
+
+class IntradaySeries(models.Model):
+    """
+    One day of an intraday series (e.g. steps per minute) for one user,
+    stored as a fixed-length float32 array. See series.py and store.py.
+    """
+
+    user = models.ForeignKey(FitbitUser, on_delete=models.CASCADE)
+    resource = models.CharField(max_length=64)
+    date = models.DateField()
+    interval = models.CharField(max_length=8)
+    data = models.BinaryField()
+    fetched = models.DateTimeField(default=django_timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "resource", "interval", "date"],
+                name="fitbit_intraday_unique",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user}: {self.resource} {self.date} ({self.interval})"
+
+    def as_array(self):
+        """The values as an array.array, NaN where Fitbit returned nothing."""
+        return series.to_array(self.data)
+
+    def as_numpy(self):
+        """The values as a float32 NumPy array (requires the numpy extra)."""
+        return series.to_numpy(self.data)
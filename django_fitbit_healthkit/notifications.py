@@ -0,0 +1,197 @@
+"""
+Turning Fitbit subscription notifications into FitbitNotification rows,
+and working through those rows to go get the data they point at.
+
+Processing is safe to run from many worker processes on many nodes at once:
+each worker claims a batch of pending rows and leases them for
+``FITBIT_NOTIFICATION_LEASE`` seconds (default 300), see leases.py and the
+``fitbit_process_notifications`` management command.
+
+The async webhook only queues the raw POSTs as NotificationPayload rows;
+the same workers expand those into notifications first
+(``ingest_pending_payloads``).
+"""
+
+import json
+from datetime import datetime
+from typing import Dict, List
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache, leases, methods
+from .models import FitbitNotification, FitbitUser, NotificationPayload
+from .ratelimit import RateLimited
+from .signals import notification_data_fetched, notifications_ingested
+from .util import upsert
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# collectionType -> the methods.py helpers that fetch the data for a date
+NOTIFICATION_FETCHERS = {
+    "activities": [methods.daily_activity_summary],
+    "sleep": [methods.sleep_log_by_date],
+}
+
+
+def validate_notifications(data) -> None:
+    """
+    Raise ValueError unless data is a list of notifications, each with a
+    collectionType, an ownerId and a date (YYYY-MM-DD).
+    """
+    if not isinstance(data, list):
+        raise ValueError("Expected a list of notifications")
+    max_length = FitbitNotification._meta.get_field("notification").max_length
+    for d in data:
+        if not isinstance(d, dict):
+            raise ValueError(f"Not a notification: {d!r}")
+        for key in ["collectionType", "ownerId", "date"]:
+            if not isinstance(d.get(key), str):
+                raise ValueError(f"Notification without a {key}: {d!r}")
+        if len(d["collectionType"]) > max_length:
+            raise ValueError(f"Unknown collectionType {d['collectionType']!r}")
+        datetime.strptime(d["date"], "%Y-%m-%d")
+
+
+def ingest_notifications(data: List[Dict]) -> List[FitbitNotification]:
+    """
+    Store a batch of notifications as POSTed by Fitbit (up to 100 at a time).
+
+    All owners are looked up in one query, notifications for unknown
+    owners are skipped, and duplicates (within the batch or already stored)
+    collapse into one row per (user, collectionType, date). A notification
+    for a row that was already processed makes it pending again, and the
+    cached responses covering each notification are dropped (see cache.py).
+    Returns the notifications that were stored.
+    """
+    users: Dict[str, List[FitbitUser]] = {}
+    for fitbitUser in FitbitUser.objects.filter(
+        fitbit_id__in={d["ownerId"] for d in data}
+    ).only("pk", "fitbit_id"):
+        users.setdefault(fitbitUser.fitbit_id, []).append(fitbitUser)
+
+    objs = {}
+    for d in data:
+        if d["ownerId"] not in users:
+            logger.info(f"Notification for unknown owner {d['ownerId']}, skipping")
+            continue
+        notification_date = datetime.strptime(d["date"], "%Y-%m-%d").date()
+        for fitbitUser in users[d["ownerId"]]:
+            key = (fitbitUser.pk, d["collectionType"], notification_date)
+            objs[key] = FitbitNotification(
+                user=fitbitUser,
+                notification=d["collectionType"],
+                date=notification_date,
+            )
+    cache.invalidate(objs)
+    notifications_ingested.send(
+        sender=FitbitNotification, received=len(data), stored=len(objs)
+    )
+    return upsert(
+        FitbitNotification,
+        list(objs.values()),
+        unique_fields=["user", "notification", "date"],
+        update_fields=["processed", "available_at", "attempts", "last_error"],
+    )
+
+
+def ingest_pending_payloads(batch_size: int = 100) -> int:
+    """
+    Expand up to batch_size queued webhook payloads into notifications
+    (see ingest_notifications) and delete them, skipping payloads another
+    worker has locked. A payload that can't be expanded is logged and dropped.
+    Returns how many payloads were taken off the queue (0 once it's empty).
+    """
+    with transaction.atomic():
+        payloads = list(
+            NotificationPayload.objects.select_for_update(skip_locked=True).order_by(
+                "pk"
+            )[:batch_size]
+        )
+        for payload in payloads:
+            try:
+                data = json.loads(payload.body)
+                validate_notifications(data)
+                with transaction.atomic():
+                    ingest_notifications(data)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.info(f"Dropping webhook payload {payload.pk}: {e!r}")
+        NotificationPayload.objects.filter(pk__in=[p.pk for p in payloads]).delete()
+    return len(payloads)
+
+
+def claim_notifications(batch_size: int = 100) -> List[FitbitNotification]:
+    """
+    Claim up to batch_size pending notifications for this worker,
+    skipping any that another worker has locked.
+    """
+    return leases.claim(
+        FitbitNotification.objects.order_by("added"),
+        "processed",
+        getattr(settings, "FITBIT_NOTIFICATION_LEASE", 300),
+        batch_size,
+    )
+
+
+def _process_group(
+    fitbitUser: FitbitUser,
+    collection_type: str,
+    d,
+    notifications: List[FitbitNotification],
+) -> None:
+    # leases.finish only touches rows we still hold: a new notification for
+    # the same (user, collectionType, date) resets the lease and must be
+    # processed again
+    for endpoint in NOTIFICATION_FETCHERS.get(collection_type, []):
+        resp, err = endpoint(fitbitUser, d)
+        if err is not None:
+            if isinstance(err, RateLimited):
+                logger.info(
+                    f"Rate limited, deferring notifications for {fitbitUser.pk}"
+                )
+            leases.fail(
+                notifications,
+                err,
+                "processed",
+                getattr(settings, "FITBIT_NOTIFICATION_MAX_ATTEMPTS", 5),
+            )
+            return
+        notification_data_fetched.send(
+            sender=FitbitNotification,
+            fitbit_user=fitbitUser,
+            collection_type=collection_type,
+            date=d,
+            endpoint=endpoint,
+            response=resp,
+        )
+    leases.finish(notifications, processed=timezone.now(), last_error="")
+
+
+def process_notifications(notifications: List[FitbitNotification]) -> None:
+    """
+    Fetch the data for claimed notifications, once per
+    (user, collectionType, date), and mark them processed.
+    Collection types without a fetcher are just marked processed.
+    """
+    users = FitbitUser.objects.in_bulk({n.user_id for n in notifications})
+    groups = {}
+    for notification in notifications:
+        key = (notification.user_id, notification.notification, notification.date)
+        groups.setdefault(key, []).append(notification)
+    for (user_id, collection_type, d), group in groups.items():
+        if user_id in users:
+            _process_group(users[user_id], collection_type, d, group)
+
+
+def process_pending_notifications(batch_size: int = 100) -> int:
+    """
+    Claim and process one batch of notifications.
+    Returns how many notifications were claimed (0 once the queue is drained).
+    """
+    batch = claim_notifications(batch_size)
+    if batch:
+        process_notifications(batch)
+    return len(batch)
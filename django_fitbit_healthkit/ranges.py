@@ -0,0 +1,147 @@
+"""
+Fetching date ranges of any length.
+
+The range endpoints refuse spans over a limit (100 days of sleep, 30 days of
+activityCalories, 1095 days of other time series). The functions here split
+a range into chunks the API accepts, fetch the chunks concurrently on up to
+``FITBIT_RANGE_MAX_WORKERS`` threads (default 4), and merge them back into
+one response-shaped dict, in date order with duplicates removed:
+
+    data, err = ranges.activity_timeseries(fitbitUser, "steps", joined, date.today())
+    data["activities-steps"]  # [{"dateTime": ..., "value": ...}, ...]
+
+Each chunk is one request from the user's rate limit budget (see
+ratelimit.py). If the budget is known to be too small for all chunks,
+nothing is fetched and the error is a RateLimited.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from . import methods, ratelimit
+from .batch import call_safely
+from .models import FitbitUser
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def date_chunks(
+    start_date: date, end_date: date, max_days: int
+) -> List[Tuple[date, date]]:
+    """
+    Split start_date to end_date (inclusive) into consecutive
+    (start, end) chunks with (end - start).days <= max_days.
+    """
+    chunks = []
+    while start_date <= end_date:
+        chunk_end = min(start_date + timedelta(days=max_days), end_date)
+        chunks.append((start_date, chunk_end))
+        start_date = chunk_end + timedelta(days=1)
+    return chunks
+
+
+def _fetch_chunks(
+    fitbitUser: FitbitUser,
+    endpoint: Callable,
+    chunks: List[Tuple[date, date]],
+    max_workers: Optional[int] = None,
+    **kwargs,
+) -> Tuple[Optional[List[Dict]], Optional[Exception]]:
+    remaining = ratelimit.remaining(fitbitUser)
+    if remaining is not None and remaining < len(chunks):
+        logger.info(f"Not enough budget for {len(chunks)} chunks for {fitbitUser.pk}")
+        return (
+            None,
+            ratelimit.RateLimited(
+                f"{len(chunks)} requests needed, {remaining} left",
+                ratelimit.reset_at(fitbitUser),
+            ),
+        )
+
+    max_workers = max_workers or getattr(settings, "FITBIT_RANGE_MAX_WORKERS", 4)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        results = list(
+            executor.map(
+                lambda chunk: call_safely(
+                    methods.fetch_json,
+                    endpoint,
+                    fitbitUser,
+                    start_date=chunk[0],
+                    end_date=chunk[1],
+                    **kwargs,
+                ),
+                chunks,
+            )
+        )
+
+    for _, err in results:
+        if err is not None:
+            return (None, err)
+    return ([data for data, _ in results], None)
+
+
+def sleep_logs(
+    fitbitUser: FitbitUser,
+    start_date: date,
+    end_date: date,
+    max_workers: Optional[int] = None,
+) -> Tuple[Optional[Dict], Optional[Exception]]:
+    """
+    methods.sleep_log_by_date_range for any range, as {"sleep": [...]}
+    ordered by dateOfSleep and startTime.
+    """
+    if end_date < start_date:
+        return ({"sleep": []}, None)
+    chunks = date_chunks(start_date, end_date, methods.SLEEP_RANGE_MAX_DAYS)
+    data, err = _fetch_chunks(
+        fitbitUser, methods.sleep_log_by_date_range, chunks, max_workers
+    )
+    if err is not None:
+        return (None, err)
+    logs = {log["logId"]: log for chunk in data for log in chunk.get("sleep", [])}
+    return (
+        {
+            "sleep": sorted(
+                logs.values(),
+                key=lambda log: (log["dateOfSleep"], log.get("startTime", "")),
+            )
+        },
+        None,
+    )
+
+
+def activity_timeseries(
+    fitbitUser: FitbitUser,
+    resource: str,
+    start_date: date,
+    end_date: date,
+    max_workers: Optional[int] = None,
+) -> Tuple[Optional[Dict], Optional[Exception]]:
+    """
+    methods.activity_timeseries_by_date_range for any range,
+    as {"activities-<resource>": [...]} ordered by dateTime.
+    """
+    key = methods.timeseries_key(resource)
+    if end_date < start_date:
+        return ({key: []}, None)
+    chunks = date_chunks(
+        start_date, end_date, methods.timeseries_range_max_days(resource)
+    )
+    data, err = _fetch_chunks(
+        fitbitUser,
+        methods.activity_timeseries_by_date_range,
+        chunks,
+        max_workers,
+        resource=resource,
+    )
+    if err is not None:
+        return (None, err)
+    entries = {
+        entry["dateTime"]: entry for chunk in data for entry in chunk.get(key, [])
+    }
+    return ({key: [entries[d] for d in sorted(entries)]}, None)
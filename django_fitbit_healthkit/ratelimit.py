@@ -0,0 +1,252 @@
+"""
+Per-user request budget, kept in step with Fitbit's rate limit headers.
+
+Fitbit allows 150 requests per user per hour and reports where each user
+stands on every response:
+
+* ``Fitbit-Rate-Limit-Limit``: the quota
+* ``Fitbit-Rate-Limit-Remaining``: requests left in this window
+* ``Fitbit-Rate-Limit-Reset``: seconds until the window resets (top of the hour)
+
+Before each request make_request takes one unit from the user's budget and
+after each response it records the headers, so we stop *before* Fitbit
+starts answering 429. The budget lives in a Django cache so that every
+process and node talking to Fitbit for the same app shares it; point
+``FITBIT_RATE_LIMIT_CACHE`` at a shared backend (redis, memcached, ...)
+when running more than one process. Settings:
+
+* ``FITBIT_RATE_LIMIT_ENABLED``: default True
+* ``FITBIT_RATE_LIMIT_CACHE``: cache alias, default ``"default"``
+* ``FITBIT_RATE_LIMIT_PER_HOUR``: budget assumed before any headers are seen, default 150
+* ``FITBIT_RATE_LIMIT_MAX_WAIT``: seconds a caller will sleep for the budget
+  to reset before giving up with RateLimited (default 0, i.e. defer right away)
+"""
+
+import asyncio
+import time
+from typing import Dict, Mapping, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .signals import rate_limit_updated
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    """
+    The user's request budget is spent until ``retry_at`` (a unix timestamp,
+    the top of the next hour if Fitbit didn't say).
+    Callers that can should defer the work until then.
+    """
+
+    def __init__(self, message: str, retry_at: Optional[float] = None):
+        super().__init__(message)
+        self.retry_at = retry_at if retry_at is not None else _next_hour(time.time())
+
+
+def _enabled() -> bool:
+    return getattr(settings, "FITBIT_RATE_LIMIT_ENABLED", True)
+
+
+def _cache():
+    return caches[getattr(settings, "FITBIT_RATE_LIMIT_CACHE", "default")]
+
+
+def _keys(user_pk) -> tuple:
+    # requests left as of the last headers (or the assumed quota), and
+    # requests taken since: counting up is safe with caches like memcached
+    # whose decr stops at 0
+    return (
+        f"fitbit:ratelimit:{user_pk}:budget",
+        f"fitbit:ratelimit:{user_pk}:used",
+        f"fitbit:ratelimit:{user_pk}:reset",
+    )
+
+
+def _next_hour(now: float) -> float:
+    return now - (now % 3600) + 3600
+
+
+def _max_wait(max_wait: Optional[float]) -> float:
+    if max_wait is None:
+        return getattr(settings, "FITBIT_RATE_LIMIT_MAX_WAIT", 0)
+    return max_wait
+
+
+def _new_window(user_pk, now: float) -> Dict:
+    # no headers seen for this window yet,
+    # assume the full quota until the top of the hour
+    budget_key, used_key, reset_key = _keys(user_pk)
+    return {
+        reset_key: _next_hour(now),
+        budget_key: getattr(settings, "FITBIT_RATE_LIMIT_PER_HOUR", 150),
+        used_key: 0,
+    }
+
+
+def _try_acquire(user_pk) -> Optional[float]:
+    """
+    Take one request from the budget.
+    Returns None on success, or the time the budget resets.
+    """
+    cache = _cache()
+    budget_key, used_key, reset_key = _keys(user_pk)
+    now = time.time()
+    window = cache.get_many([budget_key, reset_key])
+    budget, reset_at = window.get(budget_key), window.get(reset_key)
+    if budget is None or reset_at is None or reset_at <= now:
+        window = _new_window(user_pk, now)
+        timeout = window[reset_key] - now
+        if reset_at is not None and reset_at <= now:
+            # the last window's keys, not expired yet
+            cache.set_many(window, timeout=timeout)
+        else:
+            # unless another process just started it
+            for key, value in window.items():
+                cache.add(key, value, timeout=timeout)
+        budget, reset_at = window[budget_key], window[reset_key]
+    try:
+        used = cache.incr(used_key)
+    except ValueError:
+        # the window expired between the get and the incr
+        cache.delete(reset_key)
+        return _try_acquire(user_pk)
+    if used <= budget:
+        return None
+    return reset_at
+
+
+async def _atry_acquire(user_pk) -> Optional[float]:
+    """_try_acquire() with the cache's async methods."""
+    cache = _cache()
+    budget_key, used_key, reset_key = _keys(user_pk)
+    now = time.time()
+    window = await cache.aget_many([budget_key, reset_key])
+    budget, reset_at = window.get(budget_key), window.get(reset_key)
+    if budget is None or reset_at is None or reset_at <= now:
+        window = _new_window(user_pk, now)
+        timeout = window[reset_key] - now
+        if reset_at is not None and reset_at <= now:
+            await cache.aset_many(window, timeout=timeout)
+        else:
+            for key, value in window.items():
+                await cache.aadd(key, value, timeout=timeout)
+        budget, reset_at = window[budget_key], window[reset_key]
+    try:
+        used = await cache.aincr(used_key)
+    except ValueError:
+        await cache.adelete(reset_key)
+        return await _atry_acquire(user_pk)
+    if used <= budget:
+        return None
+    return reset_at
+
+
+def acquire(fitbitUser, max_wait: Optional[float] = None) -> Optional[RateLimited]:
+    """
+    Take one request from the user's budget, sleeping up to ``max_wait``
+    seconds (default ``FITBIT_RATE_LIMIT_MAX_WAIT``) for it to reset.
+    Returns None if the request may go ahead, otherwise a RateLimited error.
+    """
+    if not _enabled():
+        return None
+    max_wait = _max_wait(max_wait)
+    while True:
+        reset_at = _try_acquire(fitbitUser.pk)
+        if reset_at is None:
+            return None
+        wait = reset_at - time.time()
+        if wait > max_wait:
+            logger.info(f"Rate limit budget spent for {fitbitUser.pk}, deferring")
+            return RateLimited(f"Rate limit budget spent until {reset_at}", reset_at)
+        time.sleep(max(wait, 0))
+
+
+async def aacquire(
+    fitbitUser, max_wait: Optional[float] = None
+) -> Optional[RateLimited]:
+    """Same as acquire(), but waits without blocking the event loop."""
+    if not _enabled():
+        return None
+    max_wait = _max_wait(max_wait)
+    while True:
+        reset_at = await _atry_acquire(fitbitUser.pk)
+        if reset_at is None:
+            return None
+        wait = reset_at - time.time()
+        if wait > max_wait:
+            logger.info(f"Rate limit budget spent for {fitbitUser.pk}, deferring")
+            return RateLimited(f"Rate limit budget spent until {reset_at}", reset_at)
+        await asyncio.sleep(max(wait, 0))
+
+
+def _parse_headers(status_code: int, headers: Mapping) -> Optional[Tuple[int, float]]:
+    """(remaining, seconds until reset) from a response's headers, if they say."""
+    remaining = headers.get("Fitbit-Rate-Limit-Remaining")
+    reset = headers.get("Fitbit-Rate-Limit-Reset") or headers.get("Retry-After")
+    if reset is None:
+        return None
+    try:
+        return (0 if status_code == 429 else int(remaining), float(reset))
+    except (TypeError, ValueError):
+        return None
+
+
+def _recorded(fitbitUser, remaining: int, reset_at: float) -> float:
+    rate_limit_updated.send(
+        sender=type(fitbitUser),
+        fitbit_user=fitbitUser,
+        remaining=remaining,
+        reset_at=reset_at,
+    )
+    return reset_at
+
+
+def record(fitbitUser, status_code: int, headers: Mapping) -> Optional[float]:
+    """
+    Sync the user's budget with the rate limit headers of a response.
+    Returns the time the budget resets, if the headers said.
+    """
+    parsed = _parse_headers(status_code, headers) if _enabled() else None
+    if parsed is None:
+        return None
+    remaining, reset = parsed
+    reset_at = time.time() + reset
+    budget_key, used_key, reset_key = _keys(fitbitUser.pk)
+    # gone when the window resets, see _try_acquire
+    _cache().set_many(
+        {budget_key: remaining, used_key: 0, reset_key: reset_at}, timeout=reset
+    )
+    return _recorded(fitbitUser, remaining, reset_at)
+
+
+async def arecord(fitbitUser, status_code: int, headers: Mapping) -> Optional[float]:
+    """Same as record(), with the cache's async methods."""
+    parsed = _parse_headers(status_code, headers) if _enabled() else None
+    if parsed is None:
+        return None
+    remaining, reset = parsed
+    reset_at = time.time() + reset
+    budget_key, used_key, reset_key = _keys(fitbitUser.pk)
+    await _cache().aset_many(
+        {budget_key: remaining, used_key: 0, reset_key: reset_at}, timeout=reset
+    )
+    return _recorded(fitbitUser, remaining, reset_at)
+
+
+def remaining(fitbitUser) -> Optional[int]:
+    """What's left of the user's budget in this window, if known."""
+    budget_key, used_key, _ = _keys(fitbitUser.pk)
+    window = _cache().get_many([budget_key, used_key])
+    if budget_key not in window:
+        return None
+    return max(window[budget_key] - window.get(used_key, 0), 0)
+
+
+def reset_at(fitbitUser) -> Optional[float]:
+    """When the user's budget resets (a unix timestamp), if known."""
+    return _cache().get(_keys(fitbitUser.pk)[2])
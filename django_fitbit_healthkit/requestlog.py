@@ -0,0 +1,108 @@
+"""
+Logging of the requests made to Fitbit.
+
+make_request (and its async counterpart in aio.py) logs one line per
+attempt at INFO: method, endpoint template (the URL path with dates,
+times and subscription ids replaced, so lines group by endpoint), status,
+latency and response size. The same values are attached to the record as
+``fitbit_*`` extra fields for structured handlers, and nothing is formatted
+unless a handler is going to emit the record.
+
+Response bodies, which can be megabytes for intraday and sleep ranges, are
+only logged at DEBUG, and only when ``FITBIT_LOG_BODIES`` is True or for a
+``FITBIT_LOG_BODY_SAMPLE_RATE`` fraction of responses (default 0).
+"""
+
+import random
+import re
+from typing import Callable
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from .signals import request_completed
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_TIME = re.compile(r"\d{2}:\d{2}(:\d{2})?")
+# subscription ids are per user (see subscriptions.default_subscription_id)
+_SUBSCRIPTION_ID = re.compile(r"(/apiSubscriptions/)[^/]+(\.json)$")
+
+
+def endpoint_template(url: str) -> str:
+    """
+    The path of url with dates, times and subscription ids replaced, e.g.
+    /1/user/-/activities/date/{date}.json
+    """
+    path = _SUBSCRIPTION_ID.sub(r"\1{subscription_id}\2", urlsplit(url).path)
+    return _TIME.sub("{time}", _DATE.sub("{date}", path))
+
+
+def _log_body() -> bool:
+    if getattr(settings, "FITBIT_LOG_BODIES", False):
+        return True
+    rate = getattr(settings, "FITBIT_LOG_BODY_SAMPLE_RATE", 0)
+    return rate > 0 and random.random() < rate
+
+
+def log_response(
+    method: str,
+    url: str,
+    status_code: int,
+    latency: float,
+    nbytes: int,
+    body: Callable[[], str],
+) -> None:
+    """
+    Log one response. latency is in seconds, and body is only called
+    if the body is going to be logged.
+    """
+    if logger.isEnabledFor(logging.INFO):
+        endpoint = endpoint_template(url)
+        logger.info(
+            "%s %s %s %.1fms %dB",
+            method,
+            endpoint,
+            status_code,
+            latency * 1000,
+            nbytes,
+            extra={
+                "fitbit_method": method,
+                "fitbit_endpoint": endpoint,
+                "fitbit_status": status_code,
+                "fitbit_latency_ms": latency * 1000,
+                "fitbit_bytes": nbytes,
+            },
+        )
+    if logger.isEnabledFor(logging.DEBUG) and _log_body():
+        logger.debug("%s %s body: %s", method, endpoint_template(url), body())
+
+
+def response_completed(
+    fitbitUser,
+    method: str,
+    url: str,
+    status_code: int,
+    latency: float,
+    nbytes: int,
+    body: Callable[[], str],
+    attempt: int,
+) -> None:
+    """
+    Log one response of make_request (or aio.make_request) and send
+    signals.request_completed for it.
+    """
+    log_response(method, url, status_code, latency, nbytes, body)
+    request_completed.send(
+        sender=type(fitbitUser),
+        fitbit_user=fitbitUser,
+        method=method,
+        endpoint=endpoint_template(url),
+        status_code=status_code,
+        latency=latency,
+        nbytes=nbytes,
+        attempt=attempt,
+    )
@@ -0,0 +1,235 @@
+"""
+When and how long make_request (and aio.make_request) waits to retry.
+
+Failed attempts are retried after an exponential backoff with full jitter
+(a random delay between 0 and ``base * 2**(attempt - 1)``, capped), so that
+clients failing together during a Fitbit brownout spread their retries out
+instead of coming back in synchronized waves. When Fitbit says how long to
+wait, with ``Retry-After`` or (on a 429) ``Fitbit-Rate-Limit-Reset``, we
+wait at least that long (plus a little jitter), or give up right away if
+it's longer than we're willing to wait.
+
+Only what's safe to repeat is retried: timeouts, connection errors and
+5xx/408 responses for idempotent methods, 429s for any method (Fitbit
+didn't act on the request), and POSTs only when the caller says they're
+idempotent or the request never got sent. Other 4xx won't change on retry
+and are returned straight away.
+
+Retries also draw on a per-process budget, a token bucket refilled by a
+fraction of the requests made plus a small steady rate, so a process
+retries at most that fraction more than it requests once Fitbit starts
+failing everything. Settings:
+
+* ``FITBIT_RETRY_BASE_DELAY``: seconds, default 0.5
+* ``FITBIT_RETRY_MAX_DELAY``: the longest we'll wait before a retry,
+  backoff or Retry-After, default 30
+* ``FITBIT_RETRY_BUDGET_RATIO``: retries allowed per request, default 0.2
+* ``FITBIT_RETRY_BUDGET_MIN_PER_SECOND``: retries allowed regardless, default 1
+"""
+
+import email.utils
+import random
+import threading
+import time
+from typing import Callable, Mapping, Optional, Tuple
+
+from django.conf import settings
+
+from .ratelimit import RateLimited
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# seconds of the steady rate the budget can save up
+BUDGET_WINDOW = 10
+
+
+class RetryBudget:
+    """
+    A token bucket of retries: each request deposits ``ratio``, each retry
+    withdraws one, and ``min_per_second`` trickles in regardless so that a
+    quiet process can still retry.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max(min_per_second * BUDGET_WINDOW, 1)
+        self.balance = self.max_balance
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.balance = min(
+            self.max_balance,
+            self.balance + (now - self.updated) * self.min_per_second,
+        )
+        self.updated = now
+
+    def deposit(self) -> None:
+        with self.lock:
+            self._refill()
+            self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            self._refill()
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+_budget: Optional[RetryBudget] = None
+_budget_lock = threading.Lock()
+
+
+def get_budget() -> RetryBudget:
+    """The process-wide retry budget."""
+    global _budget
+    if _budget is None:
+        with _budget_lock:
+            if _budget is None:
+                _budget = RetryBudget(
+                    getattr(settings, "FITBIT_RETRY_BUDGET_RATIO", 0.2),
+                    getattr(settings, "FITBIT_RETRY_BUDGET_MIN_PER_SECOND", 1),
+                )
+    return _budget
+
+
+def reset() -> None:
+    """Start over with a full budget from the current settings (for tests)."""
+    global _budget
+    with _budget_lock:
+        _budget = None
+
+
+def backoff(attempt: int) -> float:
+    """A random delay before retrying after the attempt-th attempt (full jitter)."""
+    base = getattr(settings, "FITBIT_RETRY_BASE_DELAY", 0.5)
+    cap = getattr(settings, "FITBIT_RETRY_MAX_DELAY", 30)
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def retry_after(status_code: int, headers: Mapping) -> Optional[float]:
+    """
+    Seconds the response asks us to wait, from Retry-After (seconds or an
+    HTTP date) or, on a 429, Fitbit-Rate-Limit-Reset.
+    """
+    value = headers.get("Retry-After")
+    if value is None and status_code == 429:
+        value = headers.get("Fitbit-Rate-Limit-Reset")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0)
+
+
+def is_idempotent(method: str, idempotent: Optional[bool] = None) -> bool:
+    if idempotent is not None:
+        return idempotent
+    return method.upper() in IDEMPOTENT_METHODS
+
+
+def retryable_status(
+    method: str, status_code: int, idempotent: Optional[bool] = None
+) -> bool:
+    if status_code == 429:
+        # rejected before Fitbit did anything with it
+        return True
+    return status_code in RETRY_STATUSES and is_idempotent(method, idempotent)
+
+
+def retryable_error(method: str, sent: bool, idempotent: Optional[bool] = None) -> bool:
+    """A connection error or timeout, ``sent`` if the request may have arrived."""
+    return not sent or is_idempotent(method, idempotent)
+
+
+def next_delay(
+    method: str,
+    attempt: int,
+    max_attempts: int,
+    retryable: bool,
+    wait: Optional[float] = None,
+) -> Optional[float]:
+    """
+    Seconds to wait before the next attempt, or None to give up: the
+    failure isn't retryable, the attempts are used up, the response asks
+    for a longer wait than FITBIT_RETRY_MAX_DELAY, or the budget is spent.
+    ``wait`` is what the response asked for (see retry_after).
+    """
+    if not retryable or attempt >= max_attempts:
+        return None
+    delay = backoff(attempt)
+    if wait is not None:
+        if wait > getattr(settings, "FITBIT_RETRY_MAX_DELAY", 30):
+            return None
+        # a little jitter on top, or everyone told to wait 5s comes back together
+        delay = max(delay, wait + backoff(1))
+    if not get_budget().withdraw():
+        logger.info("Retry budget spent, not retrying %s", method.upper())
+        return None
+    return delay
+
+
+def after_error(
+    method: str,
+    attempt: int,
+    max_attempts: int,
+    error: Exception,
+    sent: bool,
+    idempotent: Optional[bool] = None,
+) -> Optional[float]:
+    """
+    Seconds to wait before retrying after a connection error or timeout,
+    or None to give up. ``sent`` unless the connection was never made.
+    """
+    delay = next_delay(
+        method, attempt, max_attempts, retryable_error(method, sent, idempotent)
+    )
+    if delay is not None:
+        logger.info(f"{error!r}, retrying in {delay:.2f}s")
+    return delay
+
+
+def after_response(
+    method: str,
+    attempt: int,
+    max_attempts: int,
+    status_code: int,
+    headers: Mapping,
+    body: Callable[[], str],
+    idempotent: Optional[bool] = None,
+    reset_at: Optional[float] = None,
+) -> Tuple[Optional[float], Optional[Exception]]:
+    """
+    After an error response (not 2xx, and not a 401 the caller refreshes
+    the tokens for): ``(seconds to wait before retrying, None)``, or
+    ``(None, the error to give up with)``, RateLimited until reset_at for
+    a 429. body is only called when giving up.
+    """
+    delay = next_delay(
+        method,
+        attempt,
+        max_attempts,
+        retryable_status(method, status_code, idempotent),
+        retry_after(status_code, headers),
+    )
+    if delay is not None:
+        logger.info(f"{status_code} from Fitbit, retrying in {delay:.2f}s")
+        return (delay, None)
+    if status_code == 429:
+        # should propogate the error up to the caller
+        return (None, RateLimited(f"Backoff: {body()}", reset_at))
+    return (None, Exception(f"{status_code} from Fitbit: {body()}"))
@@ -0,0 +1,85 @@
+"""
+Compact encoding of intraday series.
+
+An intraday response holds up to 1440 ``{"time": ..., "value": ...}`` objects
+per day. We store a day as a fixed-length array of little-endian float32s,
+one slot per interval of the day (1440 for 1min, 288 for 5min, 96 for 15min)
+with NaN where Fitbit returned nothing, so a day of minutes is 5.6KB of bytes
+instead of thousands of Python objects, and days concatenate into one
+contiguous buffer.
+
+Buffers decode lazily into the standard library's ``array.array`` or,
+with the ``numpy`` extra (``pip install django-fitbit-healthkit[numpy]``),
+zero-copy NumPy views.
+"""
+
+import sys
+from array import array
+from typing import Dict, List, Union
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+TYPECODE = "f"
+ITEMSIZE = 4
+NAN = float("nan")
+INTERVAL_MINUTES = {"1min": 1, "5min": 5, "15min": 15}
+
+
+def slots(interval: str) -> int:
+    """How many values a day of interval holds."""
+    return 24 * 60 // INTERVAL_MINUTES[interval]
+
+
+def day_nbytes(interval: str) -> int:
+    return slots(interval) * ITEMSIZE
+
+
+def empty(n: int) -> bytearray:
+    """n NaN values."""
+    return bytearray(to_bytes(array(TYPECODE, [NAN])) * n)
+
+
+def to_bytes(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(TYPECODE, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode(dataset: List[Dict], interval: str, key: str = "value") -> bytes:
+    """
+    Encode the "dataset" list of an intraday response (or key of each entry,
+    e.g. "mets" for calories) as one day of interval.
+    """
+    step = INTERVAL_MINUTES[interval]
+    values = array(TYPECODE, [NAN]) * slots(interval)
+    for entry in dataset:
+        if key not in entry:
+            continue
+        hours, minutes, _ = entry["time"].split(":")
+        values[(int(hours) * 60 + int(minutes)) // step] = float(entry[key])
+    return to_bytes(values)
+
+
+def to_array(buf: Union[bytes, bytearray, memoryview]) -> array:
+    """Decode a buffer into an array.array of floats."""
+    values = array(TYPECODE)
+    values.frombytes(buf)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def to_numpy(buf: Union[bytes, bytearray, memoryview]) -> "numpy.ndarray":
+    """
+    A float32 NumPy view of a buffer, without copying
+    (read-only unless buf is writable).
+    """
+    if numpy is None:
+        raise ImportError(
+            "to_numpy requires numpy: pip install django-fitbit-healthkit[numpy]"
+        )
+    return numpy.frombuffer(buf, dtype="<f4")
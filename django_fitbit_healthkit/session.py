@@ -0,0 +1,90 @@
+"""
+A process-wide, pooled HTTP session for talking to Fitbit.
+
+Every call to ``requests.get``/``requests.post`` builds a throwaway session,
+so each request pays for a new TCP+TLS handshake with api.fitbit.com.
+Instead we keep a single ``requests.Session`` per process whose adapter
+holds a pool of keep-alive connections, and share it across threads
+(urllib3's connection pools are thread-safe).
+
+Pool sizing can be tuned from settings:
+
+* ``FITBIT_HTTP_POOL_CONNECTIONS``: number of per-host pools to cache (default 10)
+* ``FITBIT_HTTP_POOL_MAXSIZE``: connections kept per host (default 10)
+* ``FITBIT_HTTP_POOL_BLOCK``: block instead of opening extra connections
+  when a host's pool is exhausted (default False)
+* ``FITBIT_HTTP_TIMEOUT``: default request timeout in seconds (default 30)
+
+The session is dropped in forked children so that worker processes never
+share sockets with their parent.
+"""
+
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Optional
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+
+
+def _build_session() -> requests.Session:
+    adapter = HTTPAdapter(
+        pool_connections=getattr(settings, "FITBIT_HTTP_POOL_CONNECTIONS", 10),
+        pool_maxsize=getattr(settings, "FITBIT_HTTP_POOL_MAXSIZE", 10),
+        pool_block=getattr(settings, "FITBIT_HTTP_POOL_BLOCK", False),
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # the session is shared by every user in the process,
+    # so never let cookies from one response leak into another user's request
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Return the shared session for this process, creating it on first use.
+    """
+    global _session
+    session = _session
+    if session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session()
+            session = _session
+    return session
+
+
+def get_timeout() -> float:
+    return getattr(settings, "FITBIT_HTTP_TIMEOUT", 30)
+
+
+def reset_session() -> None:
+    """
+    Close the shared session and its pooled connections.
+    The next call to get_session() builds a fresh one
+    (e.g. after changing the pool settings).
+    """
+    global _session
+    with _lock:
+        session, _session = _session, None
+    if session is not None:
+        session.close()
+
+
+def _reset_after_fork() -> None:
+    # the child inherits the parent's sockets (and possibly a held lock),
+    # don't close them, just forget about them
+    global _lock, _session
+    _lock = threading.Lock()
+    _session = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,26 @@
+from django.dispatch import Signal
+
+# Sent by the notification worker (see notifications.py) for every endpoint
+# it fetched in response to a subscription notification, with the kwargs
+# fitbit_user, collection_type, date, endpoint (the methods.py helper) and response.
+notification_data_fetched = Signal()
+
+# Sent by make_request (and aio.make_request) for every response from Fitbit,
+# with the kwargs fitbit_user, method, endpoint (the URL path with dates and
+# times replaced, see requestlog.py), status_code, latency (seconds),
+# nbytes and attempt (1 for the first attempt, more for retries).
+request_completed = Signal()
+
+# Sent for every token refresh request made to Fitbit (not for callers that
+# picked up someone else's refresh), with the kwargs fitbit_user and error
+# (None on success).
+tokens_refreshed = Signal()
+
+# Sent by ratelimit.record whenever a response says where a user's rate limit
+# budget stands, with the kwargs fitbit_user, remaining and reset_at.
+rate_limit_updated = Signal()
+
+# Sent by ingest_notifications for every batch of notifications from Fitbit,
+# with the kwargs received (notifications in the batch) and stored
+# (rows stored after skipping unknown owners and duplicates).
+notifications_ingested = Signal()
@@ -0,0 +1,529 @@
+"""
+A local stand-in for the Fitbit Web API, for load testing offline.
+
+It answers the OAuth token endpoint, the subscription endpoints (see
+subscriptions.py, kept in memory) and the endpoints methods.py calls
+with synthetic data that is deterministic per user and date (so repeated
+runs fetch the same numbers), keeps a per-user rate limit budget with the
+usual ``Fitbit-Rate-Limit-*`` headers, and can inject latency, 401s, 429s
+and 5xx errors. It's the standard library's threaded ``http.server``,
+so it doesn't need Django or any extra installed:
+
+    python -m django_fitbit_healthkit.simulator --port 8001 --latency 0.05 --server-error-rate 0.01
+
+then point the app at it:
+
+    FITBIT_API_BASE_URL = "http://127.0.0.1:8001"
+    FITBIT_ACCESS_REFRESH_TOKEN_REQUEST_URI = "http://127.0.0.1:8001/oauth2/token"
+
+Any bearer token is accepted. The part of a token before the first "."
+names the simulated user (tokens the simulator hands out look like
+``<user>.<n>``), so every user's data survives token refreshes and
+users have separate rate limit budgets.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+TOKEN_EXPIRES_IN = 28800
+DATE = r"(\d{4}-\d{2}-\d{2})"
+RESOURCE = r"((?:tracker/)?[A-Za-z]+)"
+PERIOD_DAYS = {
+    "1d": 1,
+    "7d": 7,
+    "30d": 30,
+    "1w": 7,
+    "1m": 30,
+    "3m": 90,
+    "6m": 180,
+    "1y": 365,
+}
+INTERVAL_MINUTES = {"1min": 1, "5min": 5, "15min": 15}
+
+
+def _rng(user: str, *parts) -> random.Random:
+    # str seeds hash with SHA-512, so these are stable across runs and processes
+    return random.Random("/".join([user, *map(str, parts)]))
+
+
+def _dates(start: date, end: date) -> List[date]:
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def minute_values(user: str, activity: str, d: date) -> List[Tuple[float, float]]:
+    """(value, mets) for each minute of the day."""
+    rng = _rng(user, "intraday", activity, d)
+    values = []
+    for minute in range(1440):
+        awake = 7 * 60 <= minute < 23 * 60
+        mets = rng.choice([10, 10, 12, 15, 30, 60]) if awake else 10
+        steps = rng.randint(0, 12) * (mets - 8) if awake else 0
+        value = {
+            "calories": round(0.8 * mets / 10 + rng.random() * 0.2, 4),
+            "steps": steps,
+            "distance": round(steps * 0.0007, 5),
+            "floors": 1 if steps and rng.random() < 0.01 else 0,
+            "elevation": 3.0 if steps and rng.random() < 0.01 else 0.0,
+        }[activity]
+        values.append((value, mets))
+    return values
+
+
+def daily_value(user: str, resource: str, d: date) -> float:
+    """The day's total of a time series resource."""
+    resource = resource.split("/")[-1]
+    if resource in {"calories", "steps", "distance", "floors", "elevation"}:
+        total = sum(value for value, _ in minute_values(user, resource, d))
+        return round(total, 2)
+    rng = _rng(user, "daily", resource, d)
+    if resource == "activityCalories":
+        return float(rng.randint(300, 1500))
+    if resource == "caloriesBMR":
+        return float(rng.randint(1400, 1800))
+    if resource == "minutesSedentary":
+        return float(rng.randint(500, 900))
+    return float(rng.randint(0, 90))
+
+
+def activity_summary(user: str, d: date) -> Dict:
+    steps = daily_value(user, "steps", d)
+    return {
+        "activities": [],
+        "goals": {"steps": 10000, "caloriesOut": 2500, "floors": 10},
+        "summary": {
+            "steps": int(steps),
+            "caloriesOut": int(daily_value(user, "calories", d)),
+            "activityCalories": int(daily_value(user, "activityCalories", d)),
+            "caloriesBMR": int(daily_value(user, "caloriesBMR", d)),
+            "floors": int(daily_value(user, "floors", d)),
+            "elevation": daily_value(user, "elevation", d),
+            "distances": [
+                {"activity": "total", "distance": daily_value(user, "distance", d)}
+            ],
+            "sedentaryMinutes": int(daily_value(user, "minutesSedentary", d)),
+            "lightlyActiveMinutes": int(daily_value(user, "minutesLightlyActive", d)),
+            "fairlyActiveMinutes": int(daily_value(user, "minutesFairlyActive", d)),
+            "veryActiveMinutes": int(daily_value(user, "minutesVeryActive", d)),
+        },
+    }
+
+
+def sleep_log(user: str, d: date) -> Dict:
+    rng = _rng(user, "sleep", d)
+    start = datetime(d.year, d.month, d.day) - timedelta(minutes=rng.randint(0, 180))
+    minutes = rng.randint(300, 540)
+    awake = rng.randint(10, 60)
+    return {
+        "dateOfSleep": d.isoformat(),
+        "duration": minutes * 60000,
+        "efficiency": round(100 * (minutes - awake) / minutes),
+        "startTime": start.isoformat(timespec="milliseconds"),
+        "endTime": (start + timedelta(minutes=minutes)).isoformat(
+            timespec="milliseconds"
+        ),
+        "isMainSleep": True,
+        "logId": rng.randrange(10**10, 10**11),
+        "minutesAsleep": minutes - awake,
+        "minutesAwake": awake,
+        "minutesToFallAsleep": 0,
+        "timeInBed": minutes,
+        "type": "classic",
+    }
+
+
+def sleep(user: str, start: date, end: date) -> Dict:
+    logs = [sleep_log(user, d) for d in reversed(_dates(start, end))]
+    return {
+        "sleep": logs,
+        "summary": {
+            "totalMinutesAsleep": sum(log["minutesAsleep"] for log in logs),
+            "totalSleepRecords": len(logs),
+            "totalTimeInBed": sum(log["timeInBed"] for log in logs),
+        },
+    }
+
+
+def intraday(user: str, activity: str, d: date, interval: str) -> Dict:
+    step = INTERVAL_MINUTES[interval]
+    minutes = minute_values(user, activity, d)
+    dataset = []
+    for start in range(0, 1440, step):
+        chunk = minutes[start : start + step]
+        entry = {
+            "time": f"{start // 60:02d}:{start % 60:02d}:00",
+            "value": round(sum(value for value, _ in chunk), 4),
+        }
+        if activity == "calories":
+            mets = max(m for _, m in chunk)
+            entry["mets"] = mets
+            entry["level"] = 0 if mets < 15 else 1 if mets < 30 else 2
+        dataset.append(entry)
+    return {
+        f"activities-{activity}": [
+            {"dateTime": d.isoformat(), "value": str(daily_value(user, activity, d))}
+        ],
+        f"activities-{activity}-intraday": {
+            "dataset": dataset,
+            "datasetInterval": step,
+            "datasetType": "minute",
+        },
+    }
+
+
+def timeseries(user: str, resource: str, start: date, end: date) -> Dict:
+    return {
+        "activities-" + resource.replace("/", "-"): [
+            {"dateTime": d.isoformat(), "value": str(daily_value(user, resource, d))}
+            for d in _dates(start, end)
+        ]
+    }
+
+
+def _day(s: str) -> date:
+    return date.fromisoformat(s)
+
+
+# (pattern, function of (user, *groups) returning the body)
+ROUTES = [
+    (
+        r"/1/user/-/profile\.json",
+        lambda user: {"user": {"encodedId": user, "scope": "activity sleep profile"}},
+    ),
+    (
+        rf"/1/user/-/activities/date/{DATE}\.json",
+        lambda user, d: activity_summary(user, _day(d)),
+    ),
+    (
+        rf"/1\.2/user/-/sleep/date/{DATE}\.json",
+        lambda user, d: sleep(user, _day(d), _day(d)),
+    ),
+    (
+        rf"/1\.2/user/-/sleep/date/{DATE}/{DATE}\.json",
+        lambda user, start, end: sleep(user, _day(start), _day(end)),
+    ),
+    (
+        rf"/1/user/-/activities/([a-z]+)/date/{DATE}/1d/(1min|5min|15min)\.json",
+        lambda user, activity, d, interval: intraday(user, activity, _day(d), interval),
+    ),
+    (
+        rf"/1/user/-/activities/{RESOURCE}/date/{DATE}/(\d+[dwmy])\.json",
+        lambda user, resource, d, period: timeseries(
+            user,
+            resource,
+            _day(d) - timedelta(days=PERIOD_DAYS[period] - 1),
+            _day(d),
+        ),
+    ),
+    (
+        rf"/1/user/-/activities/{RESOURCE}/date/{DATE}/{DATE}\.json",
+        lambda user, resource, start, end: timeseries(
+            user, resource, _day(start), _day(end)
+        ),
+    ),
+]
+ROUTES = [(re.compile(pattern), handler) for pattern, handler in ROUTES]
+SUBSCRIPTIONS = re.compile(
+    r"/1/user/-(?:/([A-Za-z]+))?/apiSubscriptions(?:/([^/]+))?\.json"
+)
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    """
+    The simulator. latency (plus up to latency_jitter) is slept before
+    every response; the *_rate options are the fractions of API requests
+    that fail with that error regardless of the budget.
+    """
+
+    daemon_threads = True
+    # thousands of simulated users connect at once
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        address: Tuple[str, int] = ("127.0.0.1", 0),
+        latency: float = 0,
+        latency_jitter: float = 0,
+        unauthorized_rate: float = 0,
+        rate_limited_rate: float = 0,
+        server_error_rate: float = 0,
+        rate_limit: int = 150,
+        rate_limit_window: int = 3600,
+        seed: Optional[int] = None,
+    ):
+        super().__init__(address, SimulatorHandler)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.unauthorized_rate = unauthorized_rate
+        self.rate_limited_rate = rate_limited_rate
+        self.server_error_rate = server_error_rate
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # user -> (window, requests made in it)
+        self.usage: Dict[str, Tuple[int, int]] = {}
+        # user -> subscription id -> collection (None for all of them)
+        self.subscriptions: Dict[str, Dict[str, Optional[str]]] = {}
+        self.tokens_issued = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "SimulatorServer":
+        """Serve from a daemon thread, e.g. in tests."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def roll(self, rate: float) -> bool:
+        if not rate:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def delay(self) -> float:
+        if not self.latency_jitter:
+            return self.latency
+        with self.lock:
+            return self.latency + self.random.uniform(0, self.latency_jitter)
+
+    def take(self, user: str) -> Tuple[int, int]:
+        """Count a request against user's budget. Returns (remaining, reset)."""
+        now = time.time()
+        window = int(now // self.rate_limit_window)
+        with self.lock:
+            used_window, used = self.usage.get(user, (window, 0))
+            if used_window != window:
+                used = 0
+            used = min(used + 1, self.rate_limit + 1)
+            self.usage[user] = (window, used)
+        reset = int((window + 1) * self.rate_limit_window - now) + 1
+        return self.rate_limit - used, reset
+
+    def subscription(
+        self,
+        method: str,
+        user: str,
+        collection: Optional[str],
+        subscription_id: Optional[str],
+    ) -> Tuple[int, Optional[Dict]]:
+        """The subscription endpoints, returning (status, body)."""
+        with self.lock:
+            subscriptions = self.subscriptions.setdefault(user, {})
+            if method == "GET" and subscription_id is None:
+                return 200, {
+                    "apiSubscriptions": [
+                        {
+                            "collectionType": subscribed or "user",
+                            "ownerId": user,
+                            "ownerType": "user",
+                            "subscriberId": "1",
+                            "subscriptionId": sid,
+                        }
+                        for sid, subscribed in subscriptions.items()
+                        if collection in (None, subscribed)
+                    ]
+                }
+            if method == "POST" and subscription_id is not None:
+                if subscription_id in subscriptions:
+                    if subscriptions[subscription_id] != collection:
+                        return 409, None
+                    return 200, {"subscriptionId": subscription_id}
+                if collection in subscriptions.values():
+                    # subscribed under another id
+                    return 409, None
+                subscriptions[subscription_id] = collection
+                return 201, {"subscriptionId": subscription_id}
+            if method == "DELETE" and subscription_id is not None:
+                if subscriptions.pop(subscription_id, False) is False:
+                    return 404, None
+                return 204, None
+        return 405, None
+
+    def issue_tokens(self, user: str) -> Dict:
+        with self.lock:
+            self.tokens_issued += 1
+            n = self.tokens_issued
+        return {
+            "access_token": f"{user}.{n}",
+            "refresh_token": f"{user}.r{n}",
+            "expires_in": TOKEN_EXPIRES_IN,
+            "scope": "activity sleep profile",
+            "token_type": "Bearer",
+            "user_id": user,
+        }
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    """
+    A quiet keep-alive HTTP/1.1 handler answering in JSON, the base of the
+    simulator's and of the stand-ins in benchmarks/.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes,
+    # don't let Nagle + delayed ACK stall keep-alive connections
+    disable_nagle_algorithm = True
+
+    def send(self, status: int, data, headers: Optional[Dict] = None) -> None:
+        body = b"" if data is None else json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SimulatorHandler(JSONHandler):
+    server: SimulatorServer
+
+    def error(self, status: int, error_type: str, headers: Optional[Dict] = None):
+        self.send(
+            status,
+            {"errors": [{"errorType": error_type, "message": error_type}]},
+            headers,
+        )
+
+    def user(self) -> Optional[str]:
+        authorization = self.headers.get("Authorization", "")
+        if not authorization.startswith("Bearer ") or authorization == "Bearer ":
+            return None
+        return authorization[len("Bearer ") :].split(".")[0]
+
+    def route(self, method: str, path: str):
+        """A function of the user returning (status, body), or None."""
+        match = SUBSCRIPTIONS.fullmatch(path)
+        if match:
+            return lambda user: self.server.subscription(method, user, *match.groups())
+        if method != "GET":
+            return None
+        for pattern, handler in ROUTES:
+            match = pattern.fullmatch(path)
+            if match:
+                return lambda user: (200, handler(user, *match.groups()))
+        return None
+
+    def api(self, method: str) -> None:
+        self.delay()
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        user = self.user()
+        if user is None:
+            return self.error(401, "invalid_token")
+        handler = self.route(method, self.path.split("?")[0])
+        if handler is None:
+            return self.error(404, "not_found")
+        if self.server.roll(self.server.unauthorized_rate):
+            return self.error(401, "expired_token")
+        remaining, reset = self.server.take(user)
+        headers = {
+            "Fitbit-Rate-Limit-Limit": self.server.rate_limit,
+            "Fitbit-Rate-Limit-Remaining": max(remaining, 0),
+            "Fitbit-Rate-Limit-Reset": reset,
+        }
+        if remaining < 0 or self.server.roll(self.server.rate_limited_rate):
+            return self.error(429, "system", {**headers, "Retry-After": reset})
+        if self.server.roll(self.server.server_error_rate):
+            with self.server.lock:
+                status = self.server.random.choice([500, 502, 503])
+            return self.error(status, "system", {**headers, "Retry-After": 1})
+        try:
+            status, data = handler(user)
+        except (KeyError, ValueError):
+            return self.error(400, "validation")
+        if status >= 400:
+            return self.error(status, "request", headers)
+        self.send(status, data, headers)
+
+    def do_GET(self):
+        self.api("GET")
+
+    def do_DELETE(self):
+        self.api("DELETE")
+
+    def do_POST(self):
+        path, _, query = self.path.partition("?")
+        if path != "/oauth2/token":
+            return self.api("POST")
+        self.delay()
+        length = int(self.headers.get("Content-Length") or 0)
+        # the app sends its params in the query string, OAuth clients in the body
+        form = {**parse_qs(self.rfile.read(length).decode()), **parse_qs(query)}
+        grant = (form.get("refresh_token") or form.get("code") or [""])[0]
+        if not grant:
+            return self.error(400, "invalid_grant")
+        if self.server.roll(self.server.server_error_rate):
+            return self.error(503, "system", {"Retry-After": 1})
+        self.send(200, self.server.issue_tokens(grant.split(".")[0]))
+
+    def delay(self) -> None:
+        seconds = self.server.delay()
+        if seconds:
+            time.sleep(seconds)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument(
+        "--latency", type=float, default=0, help="Seconds to wait before responding."
+    )
+    parser.add_argument(
+        "--latency-jitter",
+        type=float,
+        default=0,
+        help="Up to this many more seconds, at random.",
+    )
+    parser.add_argument("--unauthorized-rate", type=float, default=0)
+    parser.add_argument("--rate-limited-rate", type=float, default=0)
+    parser.add_argument("--server-error-rate", type=float, default=0)
+    parser.add_argument(
+        "--rate-limit", type=int, default=150, help="Requests per user per window."
+    )
+    parser.add_argument(
+        "--rate-limit-window", type=int, default=3600, help="In seconds."
+    )
+    parser.add_argument("--seed", type=int, help="Seed for the injected faults.")
+    args = parser.parse_args(argv)
+    server = SimulatorServer(
+        (args.host, args.port),
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        unauthorized_rate=args.unauthorized_rate,
+        rate_limited_rate=args.rate_limited_rate,
+        server_error_rate=args.server_error_rate,
+        rate_limit=args.rate_limit,
+        rate_limit_window=args.rate_limit_window,
+        seed=args.seed,
+    )
+    print(f"Simulating the Fitbit Web API on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
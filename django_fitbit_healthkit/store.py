@@ -0,0 +1,263 @@
+"""
+A local store for fetched Fitbit data.
+
+The store_* functions bulk upsert responses from the methods.py helpers into
+DailyActivitySummary, SleepLog, TimeSeriesValue and IntradaySeries. The get_* functions
+read from the store first and only go to Fitbit when the data isn't there:
+past days are served from the store as long as they're stored, recent days
+(today and yesterday, which are still changing) only if they were fetched
+within ``FITBIT_STORE_RECENT_MAX_AGE`` seconds (default 300).
+
+Data fetched by the notification worker (see notifications.py) is stored
+as it comes in, so days Fitbit tells us have changed are kept up to date.
+"""
+
+from datetime import date, datetime, timedelta
+from array import array
+from typing import Dict, List, Optional, Tuple, Union
+
+from django.conf import settings
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import methods, ranges, series
+from .methods import timeseries_key
+from .models import (
+    DailyActivitySummary,
+    FitbitUser,
+    IntradaySeries,
+    SleepLog,
+    TimeSeriesValue,
+)
+from .signals import notification_data_fetched
+from .util import upsert
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _is_recent(d: date) -> bool:
+    return d >= date.today() - timedelta(days=1)
+
+
+def _fresh_since() -> datetime:
+    return timezone.now() - timedelta(
+        seconds=getattr(settings, "FITBIT_STORE_RECENT_MAX_AGE", 300)
+    )
+
+
+def store_daily_activity_summary(fitbitUser: FitbitUser, d: date, data: Dict) -> None:
+    upsert(
+        DailyActivitySummary,
+        [DailyActivitySummary(user=fitbitUser, date=d, data=data)],
+        unique_fields=["user", "date"],
+        update_fields=["data", "fetched"],
+    )
+
+
+def store_sleep_logs(
+    fitbitUser: FitbitUser, data: Dict, start_date: date, end_date: date
+) -> None:
+    """
+    Store the logs of a sleep response covering start_date to end_date,
+    removing stored logs in that range that Fitbit no longer returns.
+    """
+    logs = [
+        SleepLog(
+            user=fitbitUser,
+            log_id=log["logId"],
+            date_of_sleep=log["dateOfSleep"],
+            data=log,
+        )
+        for log in data.get("sleep", [])
+    ]
+    upsert(
+        SleepLog,
+        logs,
+        unique_fields=["user", "log_id"],
+        update_fields=["date_of_sleep", "data", "fetched"],
+    )
+    SleepLog.objects.filter(
+        user=fitbitUser, date_of_sleep__range=(start_date, end_date)
+    ).exclude(log_id__in=[log.log_id for log in logs]).delete()
+
+
+def store_timeseries(fitbitUser: FitbitUser, resource: str, data: Dict) -> None:
+    values = [
+        TimeSeriesValue(
+            user=fitbitUser,
+            resource=resource,
+            date=entry["dateTime"],
+            value=float(entry["value"]),
+        )
+        for entry in data.get(timeseries_key(resource), [])
+    ]
+    upsert(
+        TimeSeriesValue,
+        values,
+        unique_fields=["user", "resource", "date"],
+        update_fields=["value", "fetched"],
+    )
+
+
+def store_intraday(
+    fitbitUser: FitbitUser, activity: str, d: date, interval: str, data: Dict
+) -> List[IntradaySeries]:
+    """
+    Store an activity_intraday_by_date response as an IntradaySeries of
+    the values and, for calories, one of the METs (as "calories/mets").
+    Returns the stored series, values first.
+    """
+    dataset = data.get(f"activities-{activity}-intraday", {}).get("dataset", [])
+    rows = [
+        IntradaySeries(
+            user=fitbitUser,
+            resource=activity,
+            date=d,
+            interval=interval,
+            data=series.encode(dataset, interval),
+        )
+    ]
+    if dataset and "mets" in dataset[0]:
+        rows.append(
+            IntradaySeries(
+                user=fitbitUser,
+                resource=f"{activity}/mets",
+                date=d,
+                interval=interval,
+                data=series.encode(dataset, interval, key="mets"),
+            )
+        )
+    return upsert(
+        IntradaySeries,
+        rows,
+        unique_fields=["user", "resource", "interval", "date"],
+        update_fields=["data", "fetched"],
+    )
+
+
+def get_daily_activity_summary(
+    fitbitUser: FitbitUser, d: date
+) -> Tuple[Optional[Dict], Optional[Exception]]:
+    """The daily activity summary for d, from the store if it's there."""
+    stored = DailyActivitySummary.objects.filter(user=fitbitUser, date=d)
+    if _is_recent(d):
+        stored = stored.filter(fetched__gte=_fresh_since())
+    summary = stored.values_list("data", flat=True).first()
+    if summary is not None:
+        return (summary, None)
+
+    data, err = methods.fetch_json(methods.daily_activity_summary, fitbitUser, d)
+    if err is None:
+        store_daily_activity_summary(fitbitUser, d, data)
+    return (data, err)
+
+
+def get_sleep_logs(
+    fitbitUser: FitbitUser, d: date
+) -> Tuple[Optional[List[Dict]], Optional[Exception]]:
+    """
+    The sleep logs for the night ending on d, from the store if they're there.
+    (Nights without a stored log are always fetched.)
+    """
+    stored = SleepLog.objects.filter(user=fitbitUser, date_of_sleep=d)
+    if _is_recent(d):
+        stored = stored.filter(fetched__gte=_fresh_since())
+    logs = list(stored.order_by("log_id").values_list("data", flat=True))
+    if logs:
+        return (logs, None)
+
+    data, err = methods.fetch_json(methods.sleep_log_by_date, fitbitUser, d)
+    if err is not None:
+        return (None, err)
+    store_sleep_logs(fitbitUser, data, d, d)
+    return (data.get("sleep", []), None)
+
+
+def get_timeseries(
+    fitbitUser: FitbitUser, resource: str, start_date: date, end_date: date
+) -> Tuple[Optional[List[Tuple[date, float]]], Optional[Exception]]:
+    """
+    The (date, value) series for resource from start_date to end_date,
+    from the store if every day of it is there.
+    """
+    stored = TimeSeriesValue.objects.filter(
+        user=fitbitUser, resource=resource, date__range=(start_date, end_date)
+    )
+    fresh = stored
+    if _is_recent(end_date):
+        fresh = stored.exclude(
+            date__gte=date.today() - timedelta(days=1), fetched__lt=_fresh_since()
+        )
+    values = list(fresh.order_by("date").values_list("date", "value"))
+    if len(values) == (end_date - start_date).days + 1:
+        return (values, None)
+
+    data, err = ranges.activity_timeseries(fitbitUser, resource, start_date, end_date)
+    if err is not None:
+        return (None, err)
+    store_timeseries(fitbitUser, resource, data)
+    return (list(stored.order_by("date").values_list("date", "value")), None)
+
+
+def get_intraday(
+    fitbitUser: FitbitUser, activity: str, d: date, interval: str
+) -> Tuple[Optional[array], Optional[Exception]]:
+    """
+    One day of an intraday series as an array.array (NaN where Fitbit
+    returned nothing), from the store if it's there.
+    """
+    stored = IntradaySeries.objects.filter(
+        user=fitbitUser, resource=activity, interval=interval, date=d
+    )
+    if _is_recent(d):
+        stored = stored.filter(fetched__gte=_fresh_since())
+    buf = stored.values_list("data", flat=True).first()
+    if buf is not None:
+        return (series.to_array(buf), None)
+
+    data, err = methods.fetch_json(
+        methods.activity_intraday_by_date, fitbitUser, activity, d, interval
+    )
+    if err is not None:
+        return (None, err)
+    return (store_intraday(fitbitUser, activity, d, interval, data)[0].as_array(), None)
+
+
+def load_intraday(
+    fitbitUser: FitbitUser,
+    resource: str,
+    start_date: date,
+    end_date: date,
+    interval: str = "1min",
+    as_numpy: bool = False,
+) -> Union[array, "series.numpy.ndarray"]:
+    """
+    The stored intraday series for resource from start_date to end_date as
+    one contiguous buffer, day after day, NaN for days and times that
+    aren't stored. Only reads the store, it never fetches.
+    With as_numpy, returns a float32 NumPy array over the buffer.
+    """
+    nbytes = series.day_nbytes(interval)
+    buf = series.empty(series.slots(interval) * ((end_date - start_date).days + 1))
+    for d, data in IntradaySeries.objects.filter(
+        user=fitbitUser,
+        resource=resource,
+        interval=interval,
+        date__range=(start_date, end_date),
+    ).values_list("date", "data"):
+        offset = (d - start_date).days * nbytes
+        buf[offset : offset + nbytes] = data
+    if as_numpy:
+        return series.to_numpy(buf)
+    return series.to_array(buf)
+
+
+@receiver(notification_data_fetched)
+def store_notification_data(sender, fitbit_user, endpoint, response, **kwargs):
+    d = kwargs["date"]
+    if endpoint is methods.daily_activity_summary:
+        store_daily_activity_summary(fitbit_user, d, response.json())
+    elif endpoint is methods.sleep_log_by_date:
+        store_sleep_logs(fitbit_user, response.json(), d, d)
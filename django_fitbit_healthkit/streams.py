@@ -0,0 +1,127 @@
+"""
+Streaming long spans of time series data.
+
+iter_intraday() and iter_timeseries() yield ``(timestamp, value)`` records
+one day (or one API-sized chunk) at a time, fetching the next ``prefetch``
+chunks in a background thread while the current one is consumed, so memory
+stays flat however long the span is:
+
+    for ts, steps in iter_intraday(fitbitUser, "steps", start, end):
+        ...
+
+Unlike the helpers, errors are raised (the ``err`` of the failing chunk,
+e.g. a RateLimited) since a generator has nowhere to return them;
+the records before the failing chunk have been yielded by then.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Dict, Iterable, Iterator, Tuple
+
+from . import methods
+from .batch import call_safely
+from .models import FitbitUser
+from .ranges import date_chunks
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _fetch_ahead(
+    fitbitUser: FitbitUser,
+    endpoint: Callable,
+    calls: Iterable[Dict],
+    prefetch: int,
+) -> Iterator[Dict]:
+    """
+    Call endpoint(fitbitUser, **kwargs) for each kwargs in calls,
+    keeping up to prefetch calls ahead of the consumer,
+    and yield the parsed responses in order.
+    """
+    calls = iter(calls)
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        while True:
+            for kwargs in calls:
+                pending.append(
+                    executor.submit(
+                        call_safely, methods.fetch_json, endpoint, fitbitUser, **kwargs
+                    )
+                )
+                if len(pending) > prefetch:
+                    break
+            if not pending:
+                return
+            data, err = pending.popleft().result()
+            if err is not None:
+                raise err
+            yield data
+    finally:
+        # the consumer stopped early or a chunk failed,
+        # don't spend any more of the budget on chunks nobody will read
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def iter_intraday(
+    fitbitUser: FitbitUser,
+    activity: str,
+    start_date: date,
+    end_date: date,
+    interval: str = "1min",
+    prefetch: int = 1,
+) -> Iterator[Tuple[datetime, float]]:
+    """
+    Yield (datetime, value) for each interval of activity from start_date
+    to end_date, fetched one day at a time with activity_intraday_by_date.
+    Times are in the user's local time, as Fitbit returns them.
+    """
+    days = (
+        {
+            "activity": activity,
+            "d": start_date + timedelta(days=i),
+            "interval": interval,
+        }
+        for i in range((end_date - start_date).days + 1)
+    )
+    key = f"activities-{activity}-intraday"
+    d = start_date
+    for data in _fetch_ahead(
+        fitbitUser, methods.activity_intraday_by_date, days, prefetch
+    ):
+        for entry in data.get(key, {}).get("dataset", []):
+            yield (
+                datetime.combine(d, time.fromisoformat(entry["time"])),
+                float(entry["value"]),
+            )
+        d += timedelta(days=1)
+
+
+def iter_timeseries(
+    fitbitUser: FitbitUser,
+    resource: str,
+    start_date: date,
+    end_date: date,
+    prefetch: int = 1,
+) -> Iterator[Tuple[date, float]]:
+    """
+    Yield (date, value) for each day of resource from start_date to
+    end_date, fetched with activity_timeseries_by_date_range in the
+    longest chunks the API accepts.
+    """
+    chunks = (
+        {"resource": resource, "start_date": start, "end_date": end}
+        for start, end in date_chunks(
+            start_date, end_date, methods.timeseries_range_max_days(resource)
+        )
+    )
+    key = methods.timeseries_key(resource)
+    for data in _fetch_ahead(
+        fitbitUser, methods.activity_timeseries_by_date_range, chunks, prefetch
+    ):
+        for entry in data.get(key, []):
+            yield (date.fromisoformat(entry["dateTime"]), float(entry["value"]))
@@ -0,0 +1,181 @@
+"""
+Managing the Fitbit subscriptions that feed the webhook in views.py.
+
+With a subscription, Fitbit POSTs a notification whenever a user's data in
+that collection changes, so we only fetch what changed instead of polling
+every user. ``FITBIT_SUBSCRIPTION_COLLECTIONS`` (default activities and
+sleep, what store.py keeps) is the collections every user should be
+subscribed to; ``reconcile`` brings one user in line with it and
+``reconcile_many`` the whole user base, concurrently (see the
+``fitbit_subscriptions`` management command).
+
+Subscriptions are named ``<FitbitUser pk>-<collection>``, and if
+``FITBIT_SUBSCRIBER_ID`` is set they're created for that subscriber and
+subscriptions of other subscribers are left alone.
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from django.conf import settings
+
+from .batch import fetch_many
+from .methods import api_base_url
+from .models import FitbitUser
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_COLLECTIONS = [
+    "activities",
+    "body",
+    "foods",
+    "sleep",
+    "userRevokedAccess",
+]
+
+
+def desired_collections() -> List[str]:
+    return getattr(settings, "FITBIT_SUBSCRIPTION_COLLECTIONS", ["activities", "sleep"])
+
+
+def default_subscription_id(fitbitUser: FitbitUser, collection: Optional[str]) -> str:
+    return f"{fitbitUser.pk}-{collection or 'all'}"
+
+
+def _subscriptions_url(
+    collection: Optional[str], subscription_id: Optional[str] = None
+) -> Optional[str]:
+    if collection is not None and collection not in SUBSCRIPTION_COLLECTIONS:
+        logger.info(f"Invalid collection {collection}, won't try to subscribe.")
+        return None
+    path = f"{api_base_url()}/1/user/-"
+    if collection is not None:
+        path += f"/{collection}"
+    if subscription_id is None:
+        return f"{path}/apiSubscriptions.json"
+    return f"{path}/apiSubscriptions/{subscription_id}.json"
+
+
+def _subscriber_headers() -> Dict:
+    subscriber_id = getattr(settings, "FITBIT_SUBSCRIBER_ID", None)
+    if subscriber_id is None:
+        return {}
+    return {"X-Fitbit-Subscriber-Id": str(subscriber_id)}
+
+
+def create_subscription(
+    fitbitUser: FitbitUser,
+    collection: Optional[str] = None,
+    subscription_id: Optional[str] = None,
+) -> Tuple[Optional[requests.models.Response], Optional[Exception]]:
+    """
+    ref: https://dev.fitbit.com/build/reference/web-api/subscription/create-subscription/
+    format: /1/user/[user-id]/[collection-path]/apiSubscriptions/[subscription-id].json
+
+    All collections if collection is None. Fitbit answers 201 for a new
+    subscription and 200 if it already existed, so this is safe to retry.
+    """
+    if subscription_id is None:
+        subscription_id = default_subscription_id(fitbitUser, collection)
+    url = _subscriptions_url(collection, subscription_id)
+    if url is None:
+        return {}
+    return fitbitUser.make_request(
+        "post", url, headers=_subscriber_headers(), idempotent=True
+    )
+
+
+def list_subscriptions(
+    fitbitUser: FitbitUser, collection: Optional[str] = None
+) -> Tuple[Optional[requests.models.Response], Optional[Exception]]:
+    """
+    ref: https://dev.fitbit.com/build/reference/web-api/subscription/get-subscription-list/
+    format: /1/user/[user-id]/[collection-path]/apiSubscriptions.json
+    """
+    url = _subscriptions_url(collection)
+    if url is None:
+        return {}
+    return fitbitUser.make_request("get", url, headers=_subscriber_headers())
+
+
+def delete_subscription(
+    fitbitUser: FitbitUser, subscription_id: str, collection: Optional[str] = None
+) -> Tuple[Optional[requests.models.Response], Optional[Exception]]:
+    """
+    ref: https://dev.fitbit.com/build/reference/web-api/subscription/delete-subscription/
+    format: /1/user/[user-id]/[collection-path]/apiSubscriptions/[subscription-id].json
+    """
+    url = _subscriptions_url(collection, subscription_id)
+    if url is None:
+        return {}
+    return fitbitUser.make_request("delete", url, headers=_subscriber_headers())
+
+
+def reconcile(
+    fitbitUser: FitbitUser,
+    collections: Optional[Iterable[str]] = None,
+    dry_run: bool = False,
+) -> Tuple[Optional[Dict[str, List[str]]], Optional[Exception]]:
+    """
+    Subscribe the user to each of collections (default
+    FITBIT_SUBSCRIPTION_COLLECTIONS) they aren't subscribed to yet,
+    and delete their subscriptions to anything else.
+
+    Returns ``({"created": [...], "deleted": [...]}, error)`` with the
+    collections changed, as far as it got before an error. With dry_run,
+    what would change, without changing it.
+    """
+    desired = set(desired_collections() if collections is None else collections)
+    resp, err = list_subscriptions(fitbitUser)
+    if err is not None:
+        return (None, err)
+    subscriber_id = getattr(settings, "FITBIT_SUBSCRIBER_ID", None)
+    actual = {}
+    for subscription in resp.json().get("apiSubscriptions", []):
+        if subscriber_id is not None and str(subscription.get("subscriberId")) != str(
+            subscriber_id
+        ):
+            continue
+        # an all-collections subscription is listed as collectionType "user"
+        collection = subscription.get("collectionType")
+        actual[None if collection == "user" else collection] = subscription[
+            "subscriptionId"
+        ]
+
+    changes = {"created": [], "deleted": []}
+    for collection in sorted(set(actual) - desired, key=str):
+        if not dry_run:
+            _, err = delete_subscription(fitbitUser, actual[collection], collection)
+            if err is not None:
+                return (changes, err)
+        changes["deleted"].append(collection)
+    for collection in sorted(desired - set(actual), key=str):
+        if not dry_run:
+            _, err = create_subscription(fitbitUser, collection)
+            if err is not None:
+                return (changes, err)
+        changes["created"].append(collection)
+    return (changes, None)
+
+
+def reconcile_many(
+    users: Iterable[FitbitUser],
+    collections: Optional[Iterable[str]] = None,
+    dry_run: bool = False,
+    max_workers: Optional[int] = None,
+) -> Iterator[
+    Tuple[FitbitUser, Tuple[Optional[Dict[str, List[str]]], Optional[Exception]]]
+]:
+    """
+    reconcile() every user on a bounded thread pool (see batch.fetch_many),
+    yielding ``(user, (changes, error))`` in completion order.
+    """
+    kwargs = {"dry_run": dry_run}
+    if collections is not None:
+        kwargs["collections"] = list(collections)
+    for fitbitUser, _, result in fetch_many(
+        users, reconcile, max_workers=max_workers, **kwargs
+    ):
+        yield fitbitUser, result
@@ -0,0 +1,215 @@
+"""
+Syncing every user's recent data, across processes and machines.
+
+``sync_user`` fetches a user's last ``FITBIT_SYNC_DAYS`` days (default 2,
+yesterday and today) of daily activity summaries and sleep logs into the
+store (see store.py). The ``fitbit_sync`` management command runs it for the
+whole user base:
+
+* ``--shard i/N`` takes this node's share of the users, by a jump consistent
+  hash of their id, so N nodes split the user base with no coordination
+  (and going from N to N+1 nodes only moves 1/(N+1) of the users);
+* on each node, users are split again (by a differently salted hash) across
+  ``--processes`` worker processes, so a user is always synced by the same
+  process and token refreshes never race between them (see
+  FitbitUser.update_tokens);
+* each process syncs its users on its own thread pool and pooled session
+  (see batch.py and session.py) and reports progress back to the command.
+"""
+
+import hashlib
+import multiprocessing
+from queue import Empty
+from datetime import date, timedelta
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+from . import methods, store, sync_worker
+from .batch import fetch_many
+from .models import FitbitUser
+from .ratelimit import RateLimited
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# (synced, rate limited, failed) users
+Progress = Tuple[int, int, int]
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Lamping and Veach's jump consistent hash: the bucket in range(buckets)
+    for a 64-bit key. Growing buckets by one only moves keys into the new one.
+    """
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def user_key(pk, salt: str = "") -> int:
+    """A well mixed 64-bit key for a user id (pks are sequential)."""
+    digest = hashlib.blake2b(f"{salt}{pk}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def shard_of(pk, shards: int) -> int:
+    return jump_hash(user_key(pk), shards)
+
+
+def worker_of(pk, workers: int) -> int:
+    # salted, or a node's users would all land in the same few workers
+    return jump_hash(user_key(pk, "worker:"), workers)
+
+
+def shard_user_ids(shard: int, shards: int) -> List:
+    """The ids of the users in shard (of shards)."""
+    return [
+        pk
+        for pk in FitbitUser.objects.order_by("pk").values_list("pk", flat=True)
+        if shard_of(pk, shards) == shard
+    ]
+
+
+def sync_user(
+    fitbitUser: FitbitUser, days: Optional[int] = None
+) -> Tuple[Optional[FitbitUser], Optional[Exception]]:
+    """
+    Fetch and store the user's daily activity summaries (with the activity
+    scope) and sleep logs (with the sleep scope) for the last days days.
+    """
+    days = days or getattr(settings, "FITBIT_SYNC_DAYS", 2)
+    end_date = date.today()
+    start_date = end_date - timedelta(days=days - 1)
+    if "activity" in fitbitUser.scopes:
+        for i in range(days):
+            d = start_date + timedelta(days=i)
+            data, err = methods.fetch_json(
+                methods.daily_activity_summary, fitbitUser, d
+            )
+            if err is not None:
+                return (None, err)
+            store.store_daily_activity_summary(fitbitUser, d, data)
+    if "sleep" in fitbitUser.scopes:
+        data, err = methods.fetch_json(
+            methods.sleep_log_by_date_range, fitbitUser, start_date, end_date
+        )
+        if err is not None:
+            return (None, err)
+        store.store_sleep_logs(fitbitUser, data, start_date, end_date)
+    return (fitbitUser, None)
+
+
+def sync_users(
+    user_ids: Iterable,
+    days: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    batch_size: int = 100,
+    report: Optional[Callable[[Progress], None]] = None,
+) -> Progress:
+    """
+    sync_user() the users on a thread pool, batch_size users at a time,
+    calling report with each batch's progress. Returns the totals.
+    """
+    user_ids = list(user_ids)
+    totals = (0, 0, 0)
+    for i in range(0, len(user_ids), batch_size):
+        users = FitbitUser.objects.filter(pk__in=user_ids[i : i + batch_size])
+        synced = limited = failed = 0
+        for fitbitUser, _, (_, err) in fetch_many(
+            users.iterator(), sync_user, max_workers=max_workers, days=days
+        ):
+            if err is None:
+                synced += 1
+            elif isinstance(err, RateLimited):
+                limited += 1
+            else:
+                failed += 1
+                logger.info(f"Could not sync {fitbitUser.pk}: {err}")
+        progress = (synced, limited, failed)
+        totals = tuple(a + b for a, b in zip(totals, progress))
+        if report is not None:
+            report(progress)
+    return totals
+
+
+def sync_shard(
+    shard: int = 0,
+    shards: int = 1,
+    processes: int = 1,
+    days: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    batch_size: int = 100,
+    report: Optional[Callable[[Progress], None]] = None,
+) -> Progress:
+    """
+    Sync the users of shard (of shards) on processes worker processes
+    (in this one if processes is 1), calling report with every batch's
+    progress as it comes in. Returns the totals, or raises RuntimeError
+    once the others are done if a worker process failed or crashed.
+    """
+    user_ids = shard_user_ids(shard, shards)
+    if processes <= 1:
+        return sync_users(user_ids, days, max_workers, batch_size, report)
+
+    assigned = [[] for _ in range(processes)]
+    for pk in user_ids:
+        assigned[worker_of(pk, processes)].append(pk)
+    # spawned, not forked: children get their own db connections and sessions
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    connections.close_all()
+    workers = {
+        index: context.Process(
+            target=sync_worker.run,
+            args=(index, ids, days, max_workers, batch_size, queue),
+            daemon=True,
+        )
+        for index, ids in enumerate(assigned)
+        if ids
+    }
+    for worker in workers.values():
+        worker.start()
+
+    totals = (0, 0, 0)
+    running = set(workers)
+    crashed = []
+    while running:
+        try:
+            index, progress = queue.get(timeout=1)
+        except Empty:
+            # a worker that died without saying it's done won't say it anymore
+            for index in [i for i in running if not workers[i].is_alive()]:
+                logger.error(
+                    f"Sync worker {index} exited with {workers[index].exitcode}"
+                )
+                running.discard(index)
+                crashed.append(index)
+            continue
+        if progress is None:
+            running.discard(index)
+            continue
+        if isinstance(progress, str):
+            logger.error(f"Sync worker {index} failed: {progress}")
+            running.discard(index)
+            crashed.append(index)
+            continue
+        totals = tuple(a + b for a, b in zip(totals, progress))
+        if report is not None:
+            report(progress)
+    for index, worker in workers.items():
+        worker.join()
+        if worker.exitcode != 0 and index not in crashed:
+            logger.error(f"Sync worker {index} exited with {worker.exitcode}")
+            crashed.append(index)
+    if crashed:
+        raise RuntimeError(
+            f"{len(crashed)} of {len(workers)} sync workers crashed, "
+            f"after syncing {totals[0]} users."
+        )
+    return totals
@@ -0,0 +1,32 @@
+"""
+The entry point of the worker processes of sync.sync_shard.
+
+The workers are spawned, so this module is imported by a fresh interpreter
+before Django is set up: it mustn't import models (or anything that does)
+until it has called django.setup().
+"""
+
+
+def run(index: int, user_ids, days, max_workers, batch_size, queue) -> None:
+    """
+    Sync user_ids (see sync.sync_users), putting ``(index, progress)`` on
+    queue after every batch and ``(index, None)`` once done, or
+    ``(index, error)``, the repr of the exception, if syncing failed.
+    """
+    import django
+
+    django.setup()
+    from .sync import sync_users
+
+    try:
+        sync_users(
+            user_ids,
+            days=days,
+            max_workers=max_workers,
+            batch_size=batch_size,
+            report=lambda progress: queue.put((index, progress)),
+        )
+    except Exception as e:
+        queue.put((index, repr(e)))
+        raise
+    queue.put((index, None))
@@ -0,0 +1,57 @@
+"""
+Refresh access tokens ahead of time, in bulk.
+
+Run refresh_expiring_tokens (or the ``fitbit_refresh_tokens`` management
+command) periodically with a window longer than the period, and user-facing
+requests never have to stop for a token refresh.
+"""
+
+from datetime import timedelta
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from .batch import fetch_many
+from .models import FitbitUser
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def expiring_users(within: timedelta) -> QuerySet:
+    """Users whose access token expires within the window (or is unknown)."""
+    return FitbitUser.objects.filter(
+        Q(expires_at__lte=timezone.now() + within) | Q(expires_at__isnull=True)
+    ).exclude(refresh_token="")
+
+
+def _refresh(fitbitUser: FitbitUser) -> Tuple[FitbitUser, None]:
+    fitbitUser.update_tokens()
+    return (fitbitUser, None)
+
+
+def refresh_expiring_tokens(
+    within: Optional[timedelta] = None, max_workers: Optional[int] = None
+) -> Tuple[int, int]:
+    """
+    Refresh every token expiring within ``within``
+    (default ``FITBIT_TOKEN_REFRESH_WINDOW`` seconds, 3600),
+    running up to ``max_workers`` refreshes at a time.
+    Returns the number of (refreshed, failed) users.
+    """
+    if within is None:
+        within = timedelta(
+            seconds=getattr(settings, "FITBIT_TOKEN_REFRESH_WINDOW", 3600)
+        )
+    refreshed, failed = 0, 0
+    users = expiring_users(within).iterator()
+    for fitbitUser, _, (_, err) in fetch_many(users, _refresh, max_workers=max_workers):
+        if err is None:
+            refreshed += 1
+        else:
+            failed += 1
+            logger.info(f"Could not refresh tokens for {fitbitUser.pk}: {err}")
+    return refreshed, failed
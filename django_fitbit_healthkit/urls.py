@@ -6,4 +6,10 @@ urlpatterns = [
     path("login", views.login, name="fitbitlogin"),
     path("success", views.success, name="fitbitsuccess"),
     path("webhook", views.fitbit_subscription, name="fitbitsubscription"),
+    path(
+        "webhook/async",
+        views.fitbit_subscription_async,
+        name="fitbitsubscriptionasync",
+    ),
+    path("metrics", views.metrics, name="fitbitmetrics"),
 ]
@@ -3,6 +3,12 @@ import hashlib
 import hmac
 
 from django.conf import settings
+from django.db import connections, router, transaction
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
 
 
 def verify_fitbit_signature(sig: str, data: str) -> bool:
@@ -22,6 +28,38 @@ def make_digest(key: str, message: str) -> str:
     return str(signature2, "UTF-8")
 
 
+def upsert(model, objs, unique_fields, update_fields) -> list:
+    """
+    Insert objs, updating the update_fields of those whose unique_fields
+    match a stored row instead, in one query where the database can:
+    MySQL and MariaDB can't be told which unique key to match on and match
+    on any of them, databases without upserts get a query or two per object.
+    """
+    features = connections[router.db_for_write(model)].features
+    if features.supports_update_conflicts_with_target:
+        return model.objects.bulk_create(
+            objs,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=update_fields,
+        )
+    if features.supports_update_conflicts:
+        return model.objects.bulk_create(
+            objs, update_conflicts=True, update_fields=update_fields
+        )
+    with transaction.atomic(using=router.db_for_write(model)):
+        for obj in objs:
+            # pre_save: what bulk_create would store, e.g. auto_now dates
+            values = {
+                name: model._meta.get_field(name).pre_save(obj, True)
+                for name in update_fields
+            }
+            lookup = {name: getattr(obj, name) for name in unique_fields}
+            if not model.objects.filter(**lookup).update(**values):
+                obj.save(force_insert=True)
+    return objs
+
+
 def encoded_secret(client_id: str, client_secret: str) -> str:
     return base64.b64encode(f"{client_id}:{client_secret}".encode("latin1")).decode(
         "latin1"
@@ -49,3 +87,28 @@ def extract_active_from_total(total: float, METs_sum: int, minutes: int) -> floa
     if minutes_10 > METs_sum:
         return 0.0
     return total * ((METs_sum - minutes_10) / METs_sum)
+
+
+def extract_active_from_totals(totals, METs_sums, minutes) -> "numpy.ndarray":
+    """
+    extract_active_from_total over whole arrays at once,
+    e.g. a day of intraday calories and METs:
+
+        active = extract_active_from_totals(calories, mets, 1).sum()
+
+    minutes is the length of each interval, a number or an array.
+    Same rules as the scalar version: 0 where METs_sum is 0 or below the
+    baseline. Requires the numpy extra.
+    """
+    if numpy is None:
+        raise ImportError(
+            "extract_active_from_totals requires numpy: "
+            "pip install django-fitbit-healthkit[numpy]"
+        )
+    totals = numpy.asarray(totals, dtype=numpy.float64)
+    METs_sums = numpy.asarray(METs_sums, dtype=numpy.float64)
+    minutes_10 = numpy.asarray(minutes, dtype=numpy.float64) * 10
+    # the masked entries may divide by 0, they're replaced below
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        active = totals * ((METs_sums - minutes_10) / METs_sums)
+    return numpy.where((METs_sums == 0) | (minutes_10 > METs_sums), 0.0, active)
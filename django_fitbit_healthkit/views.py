@@ -1,6 +1,7 @@
+import hmac
 import json
 import urllib
-from datetime import datetime
+from datetime import timedelta
 
 import requests
 from django.conf import settings
@@ -8,8 +9,14 @@ from django.contrib.sites.shortcuts import get_current_site
 from django.http import Http404, HttpRequest, HttpResponse, HttpResponseRedirect
 from django.shortcuts import render
 from django.urls import reverse
-
-from .models import FitbitNotification, FitbitUser
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+
+from . import metrics as fitbit_metrics
+from .backfill import plan_backfill
+from .models import FitbitUser, NotificationPayload
+from .notifications import ingest_notifications, validate_notifications
+from .session import get_session, get_timeout
 from .util import encoded_secret, verify_fitbit_signature
 
 
@@ -52,8 +59,11 @@ def success(request: HttpRequest) -> HttpResponse:
     headers = {
         "Authorization": f"Basic {encoded_secret(settings.FITBIT_CLIENT_ID, settings.FITBIT_CLIENT_SECRET)}"
     }
-    r = requests.post(
-        settings.FITBIT_ACCESS_REFRESH_TOKEN_REQUEST_URI, data=data, headers=headers
+    r = get_session().post(
+        settings.FITBIT_ACCESS_REFRESH_TOKEN_REQUEST_URI,
+        data=data,
+        headers=headers,
+        timeout=get_timeout(),
     )
     # rather than raise an application error, pass that error back to the user:
     # r.raise_for_status()
@@ -67,6 +77,8 @@ def success(request: HttpRequest) -> HttpResponse:
     if settings.DEBUG:
         print(fitbit_user)
 
+    expires_at = timezone.now() + timedelta(seconds=fitbit_user.get("expires_in"))
+
     # update the token too
     fb_user, created = FitbitUser.objects.get_or_create(
         user=request.user,
@@ -74,6 +86,7 @@ def success(request: HttpRequest) -> HttpResponse:
             "access_token": fitbit_user.get("access_token"),
             "refresh_token": fitbit_user.get("refresh_token"),
             "expires_in": fitbit_user.get("expires_in"),
+            "expires_at": expires_at,
             "fitbit_id": fitbit_user.get("user_id"),
             "scopes": fitbit_user.get("scope"),
         },
@@ -84,14 +97,13 @@ def success(request: HttpRequest) -> HttpResponse:
         fb_user.access_token = fitbit_user.get("access_token")
         fb_user.refresh_token = fitbit_user.get("refresh_token")
         fb_user.expires_in = fitbit_user.get("expires_in")
+        fb_user.expires_at = expires_at
         fb_user.fitbit_id = fitbit_user.get("user_id")
         fb_user.scopes = fitbit_user.get("scope")
         fb_user.save()
 
-    # get_athlete_activities(ath, max_requests=1)
-    # t = threading.Thread(target=get_user_data, args=[s, 100])
-    # t.setDaemon(True)
-    # t.start()
+    # queue up their history for the fitbit_backfill workers
+    plan_backfill(fb_user)
 
     redir_uri = (
         settings.FITBIT_SUCCESS_TEMPLATE
@@ -101,36 +113,85 @@ def success(request: HttpRequest) -> HttpResponse:
     return render(request, redir_uri, fitbit_user)
 
 
+def _verify_subscriber(request: HttpRequest) -> HttpResponse:
+    # Fitbit checks a new subscriber endpoint with a GET
+    verify = request.GET.get("verify")
+    if verify == settings.FITBIT_SUBSCRIPTION_VERIFICATION_CODE:
+        return HttpResponse(status=204)
+    return HttpResponse(status=404)
+
+
+def _signed(request: HttpRequest) -> bool:
+    fitbit_signature = request.headers.get("x-fitbit-signature")
+    try:
+        body = request.body.decode("utf-8")
+    except UnicodeDecodeError:
+        return False
+    return verify_fitbit_signature(fitbit_signature, body)
+
+
+@csrf_exempt
 def fitbit_subscription(request: HttpRequest) -> HttpResponse:
     """
     Fitbit sends a subscription notification to this endpoint.
 
-    As of yet, we still need to:
-    - Create subscriptions for users we want them on
-    - Handle the notifications (go get the data)
+    The notifications are only stored here, the data they point at is
+    fetched by the fitbit_process_notifications worker (see notifications.py).
+    Users are subscribed by the fitbit_subscriptions command (see subscriptions.py).
     """
     if request.method == "GET":
-        verify = request.GET.get("verify")
-        if verify == settings.FITBIT_SUBSCRIPTION_VERIFICATION_CODE:
-            return HttpResponse(status=204)
-        return HttpResponse(status=404)
+        return _verify_subscriber(request)
 
     # we have a post request
     # check signature
-    fitbit_signature = request.headers.get("x-fitbit-signature")
-    if not verify_fitbit_signature(fitbit_signature, request.body):
+    if not _signed(request):
         return HttpResponse(status=404)
 
     # save the notifications
     # we get up to 100 at a time so use a bulk load
-    data = json.loads(request.body)
-    objs = [
-        FitbitNotification(
-            user=FitbitUser.objects.get(fitbit_id=d["ownerId"]),
-            notification=d["collectionType"],
-            date=datetime.strptime(d["date"], "%Y-%m-%d").date(),
-        )
-        for d in data
-    ]
-    FitbitNotification.objects.bulk_create(objs)
+    try:
+        data = json.loads(request.body)
+        validate_notifications(data)
+    except ValueError:
+        return HttpResponse(status=400)
+    ingest_notifications(data)
+    return HttpResponse(status=204)
+
+
+async def fitbit_subscription_async(request: HttpRequest) -> HttpResponse:
+    """
+    The same endpoint as fitbit_subscription, for ASGI servers: after
+    checking the signature it only queues the raw POST with one insert and
+    answers, so bursts of deliveries don't wait on owner lookups. The
+    fitbit_process_notifications workers expand the queue into
+    notifications (see notifications.ingest_pending_payloads).
+    """
+    if request.method == "GET":
+        return _verify_subscriber(request)
+    if not _signed(request):
+        return HttpResponse(status=404)
+    await NotificationPayload.objects.acreate(body=request.body.decode("utf-8"))
     return HttpResponse(status=204)
+
+
+# set directly: before Django 5.0 the csrf_exempt decorator wraps views
+# in a sync function, which would run this one in a thread
+fitbit_subscription_async.csrf_exempt = True
+
+
+def metrics(request: HttpRequest) -> HttpResponse:
+    """
+    Metrics about our calls to Fitbit in the Prometheus text format,
+    see metrics.py. Scrapers have to send FITBIT_METRICS_TOKEN as a bearer
+    token, and there's nothing here until it's set.
+    """
+    token = getattr(settings, "FITBIT_METRICS_TOKEN", None)
+    if not token:
+        return HttpResponse(status=404)
+    if not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return HttpResponse(status=403)
+    return HttpResponse(
+        fitbit_metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
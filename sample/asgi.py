@@ -3,6 +3,11 @@ ASGI config for sample project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Served this way (e.g. ``uvicorn sample.asgi:application``), point the Fitbit
+subscriber endpoint at ``/fitbit/webhook/async``, which answers without
+waiting on the database beyond one insert, and run
+``python manage.py fitbit_process_notifications`` to expand what it queued.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
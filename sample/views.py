@@ -1,6 +1,7 @@
 # a simple view that just loads index.html
 # and puts the user in the context
 from datetime import date
+from functools import partial
 
 from django.contrib.auth import login as auth_login
 from django.contrib.auth import logout
@@ -8,12 +9,12 @@ from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import redirect, render
 
+from django_fitbit_healthkit.batch import gather
 from django_fitbit_healthkit.methods import (
     check_fitbit_access,
     activity_intraday_by_date,
-    daily_activity_summary,
-    sleep_log_by_date,
 )
+from django_fitbit_healthkit.store import get_daily_activity_summary, get_sleep_logs
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,32 +24,44 @@ def index(request: HttpRequest) -> HttpResponse:
     # if the user is logged in, get the daily fitbit data
     context = {"user": request.user}
     if request.user.is_authenticated and hasattr(request.user, "fitbituser"):
-        # first let's hit a fitbit api to check if our token is valid
-        # to do this, we shouldn't need any specific API scopes
-        access = check_fitbit_access(request.user.fitbituser)
+        fitbit_user = request.user.fitbituser
+        # first check if our token is valid
+        # (decided locally unless it has expired)
+        access = check_fitbit_access(fitbit_user)
         context["connection"] = access
         if access:
-            if "activity" in request.user.fitbituser.scopes:
-                resp, _ = daily_activity_summary(request.user.fitbituser, date.today())
-                context["daily_activity"] = resp.json()
-
+            today = date.today()
+            calls = {}
+            if "activity" in fitbit_user.scopes:
+                # read through the local store, so reloads don't hit fitbit
+                calls["daily_activity"] = partial(
+                    get_daily_activity_summary, fitbit_user, today
+                )
                 # intraday is "special"
                 # either a personal API token or
                 # the app must have been granted this special access from fitbit
-                intraday, err = activity_intraday_by_date(
-                    request.user.fitbituser, "steps", date.today(), "15min"
+                calls["activity_intraday"] = partial(
+                    activity_intraday_by_date, fitbit_user, "steps", today, "15min"
                 )
+            if "sleep" in fitbit_user.scopes:
+                calls["sleep_log"] = partial(get_sleep_logs, fitbit_user, today)
+
+            # fetch everything at once, so the page takes as long as the
+            # slowest call; whatever failed or missed the deadline is left out
+            results = gather(calls, timeout=5)
+
+            if "daily_activity" in results:
+                context["daily_activity"], _ = results["daily_activity"]
+            if "activity_intraday" in results:
+                intraday, err = results["activity_intraday"]
                 logger.info((intraday, err))
                 # if we get a 404 on intraday, it's because we don't have access to that endpoint
                 if intraday is None or intraday.status_code == 404:
                     context["activity_intraday"] = "Intraday access not available"
                 else:
                     context["activity_intraday"] = intraday.json()
-
-            if "sleep" in request.user.fitbituser.scopes:
-                context["sleep_log"] = sleep_log_by_date(
-                    request.user.fitbituser, date.today()
-                )[0].json()
+            if "sleep_log" in results:
+                context["sleep_log"], _ = results["sleep_log"]
 
     return render(request, "sample/index.html", context)
 
@@ -0,0 +1,209 @@
+import asyncio
+import json
+from datetime import date
+from unittest import mock
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from django_fitbit_healthkit import aio
+from django_fitbit_healthkit.models import FitbitUser
+
+from .utils import make_fitbit_user, no_blocking_cache_calls
+
+httpx = pytest.importorskip("httpx")
+
+
+def mock_client(handler) -> "httpx.AsyncClient":
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class AsyncClientTestCase(TestCase):
+    def setUp(self):
+        self.fitbit_user = make_fitbit_user()
+
+    def test_daily_activity_summary(self):
+        seen = []
+
+        def handler(request):
+            seen.append(request)
+            return httpx.Response(200, json={"summary": {"steps": 10}})
+
+        async def run():
+            with mock.patch.object(
+                aio, "get_client", return_value=mock_client(handler)
+            ):
+                return await aio.daily_activity_summary(
+                    self.fitbit_user, date(2024, 1, 2)
+                )
+
+        resp, err = async_to_sync(run)()
+        assert err is None
+        assert resp.json() == {"summary": {"steps": 10}}
+        assert seen[0].method == "GET"
+        assert seen[0].url.path == "/1/user/-/activities/date/2024-01-02.json"
+        assert seen[0].headers["authorization"] == "Bearer access"
+
+    def test_invalid_arguments_match_sync_helpers(self):
+        result = async_to_sync(aio.activity_intraday_by_date)(
+            self.fitbit_user, "heartrate", date(2024, 1, 2), "1min"
+        )
+        assert result == {}
+
+    def test_refresh_on_401_persists_tokens(self):
+        def handler(request):
+            if request.url.path == "/oauth2/token":
+                return httpx.Response(
+                    200,
+                    json={
+                        "access_token": "new",
+                        "refresh_token": "new-refresh",
+                        "expires_in": 60,
+                    },
+                )
+            if request.headers["authorization"] == "Bearer access":
+                return httpx.Response(401)
+            return httpx.Response(200, json={"sleep": []})
+
+        async def run():
+            return await aio.make_request(
+                self.fitbit_user,
+                "get",
+                "https://api.fitbit.com/1.2/user/-/sleep/date/2024-01-02.json",
+                client=mock_client(handler),
+            )
+
+        resp, err = async_to_sync(run)()
+        assert err is None
+        assert resp.status_code == 200
+        self.fitbit_user.refresh_from_db()
+        assert self.fitbit_user.access_token == "new"
+
+    @override_settings(FITBIT_RETRY_BASE_DELAY=0)
+    def test_retries_5xx_but_not_post(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request.method)
+            if len(calls) % 2:
+                return httpx.Response(503)
+            return httpx.Response(200, json={})
+
+        async def run(method):
+            return await aio.make_request(
+                self.fitbit_user,
+                method,
+                "https://api.fitbit.com/1/user/-/profile.json",
+                client=mock_client(handler),
+            )
+
+        resp, err = async_to_sync(run)("get")
+        assert err is None
+        assert calls == ["GET", "GET"]
+        resp, err = async_to_sync(run)("post")
+        assert resp is None
+        assert calls[2:] == ["POST"]
+
+    @override_settings(FITBIT_RETRY_BASE_DELAY=0)
+    def test_post_is_only_retried_when_never_sent(self):
+        errors = [httpx.ReadError("reset"), httpx.ConnectError("refused")]
+        calls = []
+
+        def handler(request):
+            calls.append(request.method)
+            if errors:
+                raise errors.pop()
+            return httpx.Response(200, json={})
+
+        async def run():
+            return await aio.make_request(
+                self.fitbit_user,
+                "post",
+                "https://api.fitbit.com/1/user/-/apiSubscriptions/1.json",
+                client=mock_client(handler),
+            )
+
+        # refused: retried, then the read error may have been after Fitbit got it
+        resp, err = async_to_sync(run)()
+        assert isinstance(err, httpx.ReadError)
+        assert calls == ["POST", "POST"]
+
+    def test_many_requests_in_flight(self):
+        in_flight = 0
+        peak = 0
+
+        async def handler(request):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return httpx.Response(200, content=json.dumps({}).encode())
+
+        async def run():
+            client = mock_client(handler)
+            return await asyncio.gather(
+                *(
+                    aio.make_request(
+                        self.fitbit_user,
+                        "get",
+                        "https://api.fitbit.com/",
+                        client=client,
+                    )
+                    for _ in range(20)
+                )
+            )
+
+        results = async_to_sync(run)()
+        assert all(err is None for _, err in results)
+        assert peak == 20
+
+    def test_concurrent_refreshes_coalesce(self):
+        refreshes = 0
+
+        async def handler(request):
+            nonlocal refreshes
+            refreshes += 1
+            await asyncio.sleep(0.01)
+            return httpx.Response(
+                200,
+                json={
+                    "access_token": "new",
+                    "refresh_token": "new-refresh",
+                    "expires_in": 60,
+                },
+            )
+
+        instances = [FitbitUser.objects.get(pk=self.fitbit_user.pk) for _ in range(5)]
+
+        async def run():
+            client = mock_client(handler)
+            await asyncio.gather(*(aio.update_tokens(i, client) for i in instances))
+
+        async_to_sync(run)()
+        assert refreshes == 1
+        assert {i.refresh_token for i in instances} == {"new-refresh"}
+
+    def test_check_fitbit_access_caches_the_verdict(self):
+        self.fitbit_user.expires_at = timezone.now()
+        self.fitbit_user.save()
+        refreshes = 0
+
+        def handler(request):
+            nonlocal refreshes
+            refreshes += 1
+            return httpx.Response(401, json={"errors": []})
+
+        async def run():
+            with mock.patch.object(
+                aio, "get_client", return_value=mock_client(handler)
+            ):
+                return [await aio.check_fitbit_access(self.fitbit_user) for _ in "ab"]
+
+        cache.clear()
+        with no_blocking_cache_calls("get", "set"):
+            assert async_to_sync(run)() == [False, False]
+        assert refreshes == 1
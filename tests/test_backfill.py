@@ -0,0 +1,122 @@
+import time
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from django_fitbit_healthkit import methods
+from django_fitbit_healthkit.backfill import (
+    claim_chunks,
+    plan_backfill,
+    process_pending_chunks,
+)
+from django_fitbit_healthkit.models import (
+    BackfillChunk,
+    DailyActivitySummary,
+    TimeSeriesValue,
+)
+from django_fitbit_healthkit.ratelimit import RateLimited
+
+from .utils import make_fitbit_user, make_response
+
+END = date(2024, 6, 30)
+
+
+def fake_request(request_type, url, **kwargs):
+    if "/sleep/" in url:
+        return (make_response(200, {"sleep": []}), None)
+    if url.endswith(f"/steps/date/{END - timedelta(days=9)}/{END}.json"):
+        return (
+            make_response(
+                200,
+                {"activities-steps": [{"dateTime": END.isoformat(), "value": "10"}]},
+            ),
+            None,
+        )
+    return (make_response(200, {"summary": {"steps": 10}}), None)
+
+
+@override_settings(FITBIT_BACKFILL_DAYS=10, FITBIT_BACKFILL_TIMESERIES=["steps"])
+class PlanBackfillTestCase(TestCase):
+    def test_plan(self):
+        fitbit_user = make_fitbit_user()
+        assert plan_backfill(fitbit_user, end_date=END) == 10 + 1 + 1
+        assert set(BackfillChunk.objects.values_list("kind", "resource")) == {
+            ("summary", ""),
+            ("timeseries", "steps"),
+            ("sleep", ""),
+        }
+        # planning again only adds the days since
+        assert plan_backfill(fitbit_user, end_date=END) == 0
+        assert plan_backfill(fitbit_user, end_date=END + timedelta(days=1)) == 3
+        assert BackfillChunk.objects.count() == 15
+
+    def test_plan_follows_scopes(self):
+        plan_backfill(make_fitbit_user(scopes="sleep"), end_date=END)
+        assert set(BackfillChunk.objects.values_list("kind", flat=True)) == {"sleep"}
+
+
+@override_settings(FITBIT_BACKFILL_DAYS=10, FITBIT_BACKFILL_TIMESERIES=["steps"])
+class ProcessBackfillTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.fitbit_user = make_fitbit_user()
+        plan_backfill(self.fitbit_user, end_date=END)
+
+    def test_process_stores_data_and_checkpoints(self):
+        with mock.patch.object(
+            methods.FitbitUser, "make_request", side_effect=fake_request
+        ) as make_request:
+            assert process_pending_chunks(batch_size=5) == 5
+            assert BackfillChunk.objects.filter(completed__isnull=False).count() == 5
+            while process_pending_chunks(batch_size=5):
+                pass
+        assert make_request.call_count == 12
+        assert DailyActivitySummary.objects.count() == 10
+        assert TimeSeriesValue.objects.get().value == 10
+        assert not BackfillChunk.objects.filter(completed__isnull=True).exists()
+
+    def test_crashed_worker_chunks_are_reclaimed(self):
+        claimed = claim_chunks(batch_size=3)
+        assert len(claimed) == 3
+        assert len(claim_chunks(batch_size=100)) == 9
+        BackfillChunk.objects.filter(pk__in=[c.pk for c in claimed]).update(
+            available_at=None
+        )
+        with mock.patch.object(
+            methods.FitbitUser, "make_request", side_effect=fake_request
+        ) as make_request:
+            assert process_pending_chunks() == 3
+        assert make_request.call_count == 3
+
+    def test_rate_limited_chunks_wait_for_reset(self):
+        retry_at = time.time() + 600
+        with mock.patch.object(
+            methods.FitbitUser,
+            "make_request",
+            side_effect=[
+                fake_request("get", ""),
+                (None, RateLimited("Backoff", retry_at)),
+            ],
+        ) as make_request:
+            assert process_pending_chunks() == 12
+            assert process_pending_chunks() == 0
+        assert make_request.call_count == 2
+        assert BackfillChunk.objects.filter(completed__isnull=False).count() == 1
+        pending = BackfillChunk.objects.filter(completed__isnull=True)
+        assert pending.count() == 11
+        assert all(abs(c.available_at.timestamp() - retry_at) < 1 for c in pending)
+        assert all(c.attempts == 0 for c in pending)
+
+    def test_command(self):
+        BackfillChunk.objects.all().delete()
+        out = StringIO()
+        with mock.patch.object(
+            methods.FitbitUser, "make_request", side_effect=fake_request
+        ):
+            call_command("fitbit_backfill", "--plan", "--once", stdout=out)
+        assert "Planned 12 chunks." in out.getvalue()
+        assert "Processed 12 chunks in total." in out.getvalue()
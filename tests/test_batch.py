@@ -0,0 +1,102 @@
+import threading
+import time
+from datetime import date, timedelta
+from functools import partial
+from unittest import mock
+
+from django.test import TestCase
+
+from django_fitbit_healthkit import session as fitbit_session
+from django_fitbit_healthkit.batch import fetch_many, gather
+from django_fitbit_healthkit.methods import daily_activity_summary
+
+from .utils import make_fitbit_user, make_response
+
+
+class FetchManyTestCase(TestCase):
+    def setUp(self):
+        self.users = [make_fitbit_user(f"user{i}") for i in range(3)]
+
+    def test_fetch_many_with_helper(self):
+        dates = [date(2024, 1, 1) + timedelta(days=i) for i in range(4)]
+        with mock.patch.object(
+            fitbit_session.get_session(),
+            "request",
+            return_value=make_response(200, {"summary": {}}),
+        ) as request:
+            results = list(fetch_many(self.users, daily_activity_summary, dates))
+        assert len(results) == 12
+        assert request.call_count == 12
+        assert {(u.pk, d) for u, d, _ in results} == {
+            (u.pk, d) for u in self.users for d in dates
+        }
+        assert all(err is None for _, _, (_, err) in results)
+
+    def test_fetch_many_completion_order_and_errors(self):
+        slow = self.users[0]
+
+        def endpoint(fitbitUser, d):
+            if fitbitUser == slow:
+                time.sleep(0.05)
+            if fitbitUser == self.users[1]:
+                raise ValueError("boom")
+            return ("resp", None)
+
+        results = list(fetch_many(self.users, endpoint, [date(2024, 1, 1)]))
+        assert results[-1][0] == slow
+        errors = {u.pk: result for u, _, result in results}
+        assert isinstance(errors[self.users[1].pk][1], ValueError)
+        assert errors[slow.pk] == ("resp", None)
+
+    def test_fetch_many_is_bounded(self):
+        lock = threading.Lock()
+        in_flight = 0
+        peak = 0
+
+        def endpoint(fitbitUser, **kwargs):
+            nonlocal in_flight, peak
+            with lock:
+                in_flight += 1
+                peak = max(peak, in_flight)
+            time.sleep(0.01)
+            with lock:
+                in_flight -= 1
+            return (kwargs, None)
+
+        results = list(fetch_many(self.users * 5, endpoint, max_workers=2, x=1))
+        assert len(results) == 15
+        assert results[0][2] == ({"x": 1}, None)
+        assert peak == 2
+
+
+def test_gather_runs_calls_at_once():
+    def slow(result):
+        time.sleep(0.2)
+        return (result, None)
+
+    started = time.monotonic()
+    results = gather({name: partial(slow, name) for name in ["a", "b", "c"]})
+    assert time.monotonic() - started < 0.5
+    assert results == {"a": ("a", None), "b": ("b", None), "c": ("c", None)}
+
+
+def test_gather_partial_results():
+    release = threading.Event()
+
+    def boom():
+        raise ValueError("boom")
+
+    def stuck():
+        release.wait(5)
+        return ("late", None)
+
+    started = time.monotonic()
+    results = gather(
+        {"ok": lambda: ("ok", None), "boom": boom, "stuck": stuck}, timeout=0.1
+    )
+    release.set()
+    assert time.monotonic() - started < 1
+    assert results["ok"] == ("ok", None)
+    assert isinstance(results["boom"][1], ValueError)
+    assert results["stuck"][0] is None
+    assert isinstance(results["stuck"][1], TimeoutError)
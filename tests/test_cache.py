@@ -0,0 +1,156 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase, override_settings
+
+from django_fitbit_healthkit import methods
+from django_fitbit_healthkit.notifications import ingest_notifications
+
+from .utils import make_fitbit_user, make_response
+
+
+@override_settings(FITBIT_RESPONSE_CACHE="default")
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.fitbit_user = make_fitbit_user()
+        patcher = mock.patch.object(
+            methods.FitbitUser,
+            "make_request",
+            side_effect=lambda *args, **kwargs: (
+                make_response(200, {"summary": {"steps": 100}}),
+                None,
+            ),
+        )
+        self.make_request = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def notify(self, collection, d):
+        ingest_notifications(
+            [
+                {
+                    "collectionType": collection,
+                    "date": d.isoformat(),
+                    "ownerId": self.fitbit_user.fitbit_id,
+                    "ownerType": "user",
+                    "subscriptionId": "1",
+                }
+            ]
+        )
+
+    def test_responses_are_cached(self):
+        d = date(2024, 1, 2)
+        resp, err = methods.daily_activity_summary(self.fitbit_user, d)
+        cached, err = methods.daily_activity_summary(self.fitbit_user, d)
+        assert err is None
+        assert self.make_request.call_count == 1
+        assert cached.status_code == 200
+        assert cached.json() == resp.json()
+        # other users have their own entries
+        methods.daily_activity_summary(make_fitbit_user("other"), d)
+        assert self.make_request.call_count == 2
+
+    def test_errors_are_not_cached(self):
+        self.make_request.side_effect = None
+        self.make_request.return_value = (None, Exception("boom"))
+        methods.sleep_log_by_date(self.fitbit_user, date(2024, 1, 2))
+        methods.sleep_log_by_date(self.fitbit_user, date(2024, 1, 2))
+        assert self.make_request.call_count == 2
+
+    def test_recent_days_get_short_ttls(self):
+        with mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+            methods.daily_activity_summary(self.fitbit_user, date.today())
+            methods.daily_activity_summary(self.fitbit_user, date(2024, 1, 2))
+        timeouts = [call.kwargs["timeout"] for call in cache_set.call_args_list[::2]]
+        assert timeouts == [60, 7 * 24 * 3600]
+
+    def test_notifications_invalidate_covering_responses(self):
+        d = date(2024, 1, 2)
+        methods.daily_activity_summary(self.fitbit_user, d)
+        methods.daily_activity_summary(self.fitbit_user, d + timedelta(days=1))
+        methods.activity_timeseries_by_date_range(
+            self.fitbit_user, "steps", d - timedelta(days=5), d
+        )
+        methods.activity_timeseries_by_date(self.fitbit_user, "steps", d, "7d")
+        methods.sleep_log_by_date(self.fitbit_user, d)
+        assert self.make_request.call_count == 5
+
+        self.notify("activities", d)
+        methods.daily_activity_summary(self.fitbit_user, d)
+        methods.activity_timeseries_by_date_range(
+            self.fitbit_user, "steps", d - timedelta(days=5), d
+        )
+        methods.activity_timeseries_by_date(self.fitbit_user, "steps", d, "7d")
+        assert self.make_request.call_count == 8
+        # responses not covering the notified collection and date are kept
+        methods.daily_activity_summary(self.fitbit_user, d + timedelta(days=1))
+        methods.sleep_log_by_date(self.fitbit_user, d)
+        assert self.make_request.call_count == 8
+
+    def test_concurrent_fetches_are_all_indexed(self):
+        days = [date(2024, 1, 1) + timedelta(days=i) for i in range(30)]
+        get = LocMemCache.get
+
+        def slow_get(*args, **kwargs):
+            # a cache round trip, so index updates overlap
+            value = get(*args, **kwargs)
+            time.sleep(0.003)
+            return value
+
+        with mock.patch.object(LocMemCache, "get", slow_get):
+            with ThreadPoolExecutor(max_workers=10) as executor:
+                list(
+                    executor.map(
+                        lambda d: methods.daily_activity_summary(self.fitbit_user, d),
+                        days,
+                    )
+                )
+        assert self.make_request.call_count == 30
+
+        for d in days:
+            self.notify("activities", d)
+        for d in days:
+            methods.daily_activity_summary(self.fitbit_user, d)
+        assert self.make_request.call_count == 60
+
+    def test_fetch_overlapping_an_invalidation_is_not_cached(self):
+        d = date(2024, 1, 2)
+
+        def notified_during_fetch(*args, **kwargs):
+            # Fitbit answered with the old data, then the change came in
+            self.notify("activities", d)
+            return (make_response(200, {"summary": {"steps": 100}}), None)
+
+        self.make_request.side_effect = notified_during_fetch
+        methods.daily_activity_summary(self.fitbit_user, d)
+        self.make_request.side_effect = None
+        self.make_request.return_value = (
+            make_response(200, {"summary": {"steps": 200}}),
+            None,
+        )
+        resp, err = methods.daily_activity_summary(self.fitbit_user, d)
+        assert resp.json() == {"summary": {"steps": 200}}
+        assert self.make_request.call_count == 2
+        # fetches after the invalidation are cached as usual
+        methods.daily_activity_summary(self.fitbit_user, d)
+        assert self.make_request.call_count == 2
+
+    @override_settings(FITBIT_RESPONSE_CACHE_MAX_ENTRIES=2)
+    def test_oldest_entries_are_evicted(self):
+        days = [date(2024, 1, 1) + timedelta(days=i) for i in range(3)]
+        for d in days:
+            methods.daily_activity_summary(self.fitbit_user, d)
+        methods.daily_activity_summary(self.fitbit_user, days[2])
+        assert self.make_request.call_count == 3
+        methods.daily_activity_summary(self.fitbit_user, days[0])
+        assert self.make_request.call_count == 4
+
+    @override_settings(FITBIT_RESPONSE_CACHE=None)
+    def test_disabled(self):
+        methods.daily_activity_summary(self.fitbit_user, date(2024, 1, 2))
+        methods.daily_activity_summary(self.fitbit_user, date(2024, 1, 2))
+        assert self.make_request.call_count == 2
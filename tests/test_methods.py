@@ -0,0 +1,53 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from django_fitbit_healthkit import session as fitbit_session
+from django_fitbit_healthkit.methods import check_fitbit_access
+
+from .utils import make_fitbit_user, make_response
+
+
+class CheckFitbitAccessTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def post(self, *responses):
+        return mock.patch.object(
+            fitbit_session.get_session(), "post", side_effect=responses
+        )
+
+    def test_valid_token_is_decided_locally(self):
+        fitbit_user = make_fitbit_user(expires_at=timezone.now() + timedelta(hours=1))
+        with self.post() as post, self.assertNumQueries(0):
+            assert check_fitbit_access(fitbit_user)
+        post.assert_not_called()
+
+    def test_expired_token_is_refreshed(self):
+        fitbit_user = make_fitbit_user(expires_at=timezone.now())
+        tokens = make_response(
+            200,
+            {"access_token": "new", "refresh_token": "new-refresh", "expires_in": 60},
+        )
+        with self.post(tokens) as post:
+            assert check_fitbit_access(fitbit_user)
+            assert check_fitbit_access(fitbit_user)
+        assert post.call_count == 1
+        assert fitbit_user.access_token == "new"
+
+    def test_failed_refresh_is_cached(self):
+        fitbit_user = make_fitbit_user(expires_at=timezone.now())
+        with self.post(make_response(401)) as post:
+            assert not check_fitbit_access(fitbit_user)
+            assert not check_fitbit_access(fitbit_user)
+        assert post.call_count == 1
+
+        # connecting again gets a new refresh token, and a new check
+        fitbit_user.refresh_token = "reconnected"
+        fitbit_user.save()
+        with self.post(make_response(401)) as post:
+            assert not check_fitbit_access(fitbit_user)
+        assert post.call_count == 1
@@ -0,0 +1,121 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from django_fitbit_healthkit import metrics
+from django_fitbit_healthkit import session as fitbit_session
+from django_fitbit_healthkit.notifications import ingest_notifications
+
+from .utils import make_fitbit_user, make_response
+
+URL = "https://api.fitbit.com/1/user/-/activities/date/2024-01-02.json"
+ENDPOINT = "/1/user/-/activities/date/{date}.json"
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.fitbit_user = make_fitbit_user()
+
+    def test_requests_retries_and_refreshes(self):
+        tokens = make_response(
+            200,
+            {"access_token": "new", "refresh_token": "new-refresh", "expires_in": 60},
+        )
+        with (
+            mock.patch.object(
+                fitbit_session.get_session(),
+                "request",
+                side_effect=[
+                    make_response(401),
+                    make_response(
+                        200,
+                        {"summary": {}},
+                        {
+                            "Fitbit-Rate-Limit-Remaining": "7",
+                            "Fitbit-Rate-Limit-Reset": "60",
+                        },
+                    ),
+                ],
+            ),
+            mock.patch.object(
+                fitbit_session.get_session(), "post", return_value=tokens
+            ),
+        ):
+            resp, err = self.fitbit_user.make_request("get", URL)
+        assert err is None
+
+        text = metrics.render()
+        assert (
+            f'fitbit_requests_total{{method="GET",endpoint="{ENDPOINT}",status="401"}} 1'
+            in text
+        )
+        assert (
+            f'fitbit_requests_total{{method="GET",endpoint="{ENDPOINT}",status="200"}} 1'
+            in text
+        )
+        assert (
+            f'fitbit_request_retries_total{{method="GET",endpoint="{ENDPOINT}"}} 1'
+            in text
+        )
+        assert (
+            f'fitbit_request_duration_seconds_count{{method="GET",endpoint="{ENDPOINT}"}} 2'
+            in text
+        )
+        assert 'fitbit_token_refreshes_total{result="success"} 1' in text
+        assert 'fitbit_rate_limit_remaining_bucket{le="10"} 1' in text
+        assert 'fitbit_rate_limit_remaining_bucket{le="5"} 0' in text
+
+    def test_webhook_ingest_sizes(self):
+        ingest_notifications(
+            [
+                {
+                    "collectionType": "activities",
+                    "date": "2024-01-02",
+                    "ownerId": owner,
+                    "ownerType": "user",
+                    "subscriptionId": "1",
+                }
+                for owner in [self.fitbit_user.fitbit_id, "unknown"]
+            ]
+        )
+        text = metrics.render()
+        assert "fitbit_webhook_notifications_total 2" in text
+        assert "fitbit_webhook_notifications_stored_total 1" in text
+        assert 'fitbit_webhook_batch_size_bucket{le="1"} 0' in text
+        assert 'fitbit_webhook_batch_size_bucket{le="5"} 1' in text
+
+    @override_settings(FITBIT_METRICS_TOKEN="scrape")
+    def test_view(self):
+        metrics.REQUESTS.inc("GET", 'a"b', 200)
+        response = self.client.get(
+            reverse("fitbitmetrics"), HTTP_AUTHORIZATION="Bearer scrape"
+        )
+        assert response.status_code == 200
+        assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert (
+            'fitbit_requests_total{method="GET",endpoint="a\\"b",status="200"} 1'
+            in response.content.decode()
+        )
+
+    def test_view_without_token(self):
+        assert self.client.get(reverse("fitbitmetrics")).status_code == 404
+
+    @override_settings(FITBIT_METRICS_TOKEN="scrape")
+    def test_view_token(self):
+        assert self.client.get(reverse("fitbitmetrics")).status_code == 403
+        assert (
+            self.client.get(
+                reverse("fitbitmetrics"), HTTP_AUTHORIZATION="Bearer other"
+            ).status_code
+            == 403
+        )
+        assert (
+            self.client.get(
+                reverse("fitbitmetrics"), HTTP_AUTHORIZATION="Bearer scrape"
+            ).status_code
+            == 200
+        )
@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from django_fitbit_healthkit import models
+from django_fitbit_healthkit import session as fitbit_session
+from django_fitbit_healthkit.models import FitbitUser
+
+from .utils import make_fitbit_user, make_response
+
+
+class MakeRequestTestCase(TestCase):
+    def setUp(self):
+        self.fitbit_user = make_fitbit_user()
+
+    def test_make_request_uses_shared_session(self):
+        with mock.patch.object(
+            fitbit_session.get_session(),
+            "request",
+            return_value=make_response(200, {"ok": True}),
+        ) as request:
+            resp, err = self.fitbit_user.make_request("get", "https://example.com/a")
+            resp2, err2 = self.fitbit_user.make_request("get", "https://example.com/b")
+        assert err is None and err2 is None
+        assert resp.json() == {"ok": True}
+        assert request.call_count == 2
+        method, url = request.call_args_list[0].args
+        assert method == "GET"
+        assert url == "https://example.com/a"
+        kwargs = request.call_args_list[0].kwargs
+        assert kwargs["headers"]["authorization"] == "Bearer access"
+        assert kwargs["timeout"] == fitbit_session.get_timeout()
+
+    def test_make_request_refreshes_on_401(self):
+        responses = [make_response(401), make_response(200, {"ok": True})]
+        tokens = make_response(
+            200,
+            {"access_token": "new", "refresh_token": "new-refresh", "expires_in": 60},
+        )
+        session = fitbit_session.get_session()
+        with (
+            mock.patch.object(session, "request", side_effect=responses),
+            mock.patch.object(session, "post", return_value=tokens),
+        ):
+            resp, err = self.fitbit_user.make_request("get", "https://example.com")
+        assert err is None
+        assert resp.status_code == 200
+        self.fitbit_user.refresh_from_db()
+        assert self.fitbit_user.access_token == "new"
+        assert self.fitbit_user.refresh_token == "new-refresh"
+
+
+class SessionTestCase(TestCase):
+    def tearDown(self):
+        fitbit_session.reset_session()
+
+    def test_session_is_shared(self):
+        assert fitbit_session.get_session() is fitbit_session.get_session()
+
+    @override_settings(FITBIT_HTTP_POOL_MAXSIZE=32)
+    def test_pool_settings(self):
+        fitbit_session.reset_session()
+        adapter = fitbit_session.get_session().get_adapter("https://api.fitbit.com")
+        assert adapter._pool_maxsize == 32
+
+    def test_session_reset_in_forked_child(self):
+        if not hasattr(os, "fork"):
+            self.skipTest("fork not available")
+        parent_session = fitbit_session.get_session()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            is_new = fitbit_session.get_session() is not parent_session
+            os.write(write_fd, b"1" if is_new else b"0")
+            os._exit(0)
+        os.close(write_fd)
+        os.waitpid(pid, 0)
+        assert os.read(read_fd, 1) == b"1"
+        os.close(read_fd)
+
+
+class SingleFlightRefreshTestCase(TransactionTestCase):
+    def setUp(self):
+        self.fitbit_user = make_fitbit_user()
+
+    def tokens(self, *args, **kwargs):
+        time.sleep(0.05)
+        self.refreshes += 1
+        return make_response(
+            200,
+            {
+                "access_token": f"access-{self.refreshes}",
+                "refresh_token": f"refresh-{self.refreshes}",
+                "expires_in": 28800,
+            },
+        )
+
+    def test_concurrent_refreshes_coalesce(self):
+        self.refreshes = 0
+        instances = [FitbitUser.objects.get(pk=self.fitbit_user.pk) for _ in range(4)]
+        errors = []
+
+        def refresh(instance):
+            try:
+                instance.update_tokens()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        with mock.patch.object(
+            fitbit_session.get_session(), "post", side_effect=self.tokens
+        ):
+            threads = [threading.Thread(target=refresh, args=(i,)) for i in instances]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        assert errors == []
+        assert self.refreshes == 1
+        assert {i.access_token for i in instances} == {"access-1"}
+        self.fitbit_user.refresh_from_db()
+        assert self.fitbit_user.refresh_token == "refresh-1"
+
+    def test_refresh_locks_are_bounded(self):
+        locks = {models._refresh_lock(pk) for pk in range(10000)}
+        assert len(locks) == models.REFRESH_LOCK_STRIPES
+        assert models._refresh_lock(1) is models._refresh_lock(1)
+
+    def test_refresh_writes_only_token_fields(self):
+        self.refreshes = 0
+        stale = FitbitUser.objects.get(pk=self.fitbit_user.pk)
+        FitbitUser.objects.filter(pk=stale.pk).update(fitbit_id="changed")
+        with mock.patch.object(
+            fitbit_session.get_session(), "post", side_effect=self.tokens
+        ):
+            stale.update_tokens()
+        self.fitbit_user.refresh_from_db()
+        assert self.fitbit_user.fitbit_id == "changed"
+        assert self.fitbit_user.access_token == "access-1"
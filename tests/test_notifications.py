@@ -0,0 +1,116 @@
+import time
+from datetime import date
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from django_fitbit_healthkit import methods, notifications
+from django_fitbit_healthkit.models import FitbitNotification
+from django_fitbit_healthkit.notifications import (
+    claim_notifications,
+    ingest_notifications,
+    process_pending_notifications,
+)
+from django_fitbit_healthkit.ratelimit import RateLimited
+from django_fitbit_healthkit.signals import notification_data_fetched
+
+from .utils import make_fitbit_user, make_response
+
+
+def notification(owner, collection="activities", d="2024-01-02"):
+    return {
+        "collectionType": collection,
+        "date": d,
+        "ownerId": owner,
+        "ownerType": "user",
+        "subscriptionId": "1",
+    }
+
+
+class NotificationWorkerTestCase(TestCase):
+    def setUp(self):
+        self.fitbit_user = make_fitbit_user()
+        self.fetched = []
+        notification_data_fetched.connect(self.on_fetched)
+
+    def tearDown(self):
+        notification_data_fetched.disconnect(self.on_fetched)
+
+    def on_fetched(self, sender, **kwargs):
+        self.fetched.append(
+            (kwargs["collection_type"], kwargs["date"], kwargs["endpoint"])
+        )
+
+    def patch_fetchers(self, result):
+        endpoint = mock.Mock(return_value=result, __name__="endpoint")
+        return mock.patch.dict(
+            notifications.NOTIFICATION_FETCHERS, {"activities": [endpoint]}
+        )
+
+    def test_process_pending_notifications(self):
+        ingest_notifications(
+            [
+                notification(self.fitbit_user.fitbit_id),
+                notification(self.fitbit_user.fitbit_id, "sleep"),
+                notification(self.fitbit_user.fitbit_id, "foods"),
+            ]
+        )
+        with mock.patch.object(
+            methods.FitbitUser,
+            "make_request",
+            return_value=(make_response(200, {"sleep": []}), None),
+        ) as make_request:
+            assert process_pending_notifications() == 3
+        assert make_request.call_count == 2
+        assert set(self.fetched) == {
+            ("activities", date(2024, 1, 2), methods.daily_activity_summary),
+            ("sleep", date(2024, 1, 2), methods.sleep_log_by_date),
+        }
+        assert not FitbitNotification.objects.filter(processed__isnull=True).exists()
+        assert process_pending_notifications() == 0
+
+    def test_claimed_notifications_are_not_claimed_twice(self):
+        ingest_notifications([notification(self.fitbit_user.fitbit_id)])
+        assert len(claim_notifications()) == 1
+        assert claim_notifications() == []
+
+    def test_new_notification_requeues_processed_row(self):
+        data = [notification(self.fitbit_user.fitbit_id)]
+        ingest_notifications(data)
+        with self.patch_fetchers(("resp", None)):
+            process_pending_notifications()
+            ingest_notifications(data)
+            assert process_pending_notifications() == 1
+        assert FitbitNotification.objects.count() == 1
+
+    def test_rate_limited_notifications_are_deferred(self):
+        ingest_notifications([notification(self.fitbit_user.fitbit_id)])
+        retry_at = time.time() + 600
+        with self.patch_fetchers((None, RateLimited("Backoff", retry_at))):
+            process_pending_notifications()
+        stored = FitbitNotification.objects.get()
+        assert stored.processed is None
+        assert stored.attempts == 0
+        assert abs(stored.available_at.timestamp() - retry_at) < 1
+        assert process_pending_notifications() == 0
+
+    def test_failures_back_off_then_give_up(self):
+        ingest_notifications([notification(self.fitbit_user.fitbit_id)])
+        with self.patch_fetchers((None, Exception("boom"))):
+            for attempt in range(1, 6):
+                FitbitNotification.objects.update(available_at=None)
+                process_pending_notifications()
+                stored = FitbitNotification.objects.get()
+                assert stored.attempts == attempt
+                assert stored.last_error == "boom"
+        assert stored.processed is not None
+        assert stored.processed <= timezone.now()
+
+    def test_command(self):
+        ingest_notifications([notification(self.fitbit_user.fitbit_id, "foods")])
+        out = StringIO()
+        call_command("fitbit_process_notifications", "--once", stdout=out)
+        assert "Processed 1 notifications in total." in out.getvalue()
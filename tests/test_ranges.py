@@ -0,0 +1,104 @@
+import re
+from datetime import date, timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from django_fitbit_healthkit import methods, ranges, ratelimit
+from django_fitbit_healthkit.ranges import date_chunks
+
+from .utils import make_fitbit_user, make_response
+
+RANGE_URL = re.compile(r"/date/(\d{4}-\d{2}-\d{2})/(\d{4}-\d{2}-\d{2})\.json$")
+
+
+def days(start, end):
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def fake_range_request(request_type, url, **kwargs):
+    start, end = (date.fromisoformat(d) for d in RANGE_URL.search(url).groups())
+    if "/sleep/" in url:
+        data = {
+            "sleep": [
+                {"logId": d.toordinal(), "dateOfSleep": d.isoformat()}
+                for d in days(start, end)
+            ]
+        }
+    else:
+        # overlap the previous chunk by a day to check boundaries are deduplicated
+        data = {
+            "activities-steps": [
+                {"dateTime": d.isoformat(), "value": str(d.toordinal())}
+                for d in days(start - timedelta(days=1), end)
+            ]
+        }
+    return (make_response(200, data), None)
+
+
+def test_date_chunks():
+    start = date(2024, 1, 1)
+    assert date_chunks(start, start, 100) == [(start, start)]
+    chunks = date_chunks(start, date(2024, 12, 31), 100)
+    assert [(end - begin).days for begin, end in chunks] == [100, 100, 100, 62]
+    assert all(b[0] - a[1] == timedelta(days=1) for a, b in zip(chunks, chunks[1:]))
+    assert chunks[-1][1] == date(2024, 12, 31)
+
+
+class RangesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.fitbit_user = make_fitbit_user()
+
+    def test_activity_timeseries_over_years(self):
+        start, end = date(2018, 1, 1), date(2024, 6, 30)
+        with mock.patch.object(
+            methods.FitbitUser, "make_request", side_effect=fake_range_request
+        ) as make_request:
+            data, err = ranges.activity_timeseries(
+                self.fitbit_user, "steps", start, end
+            )
+        assert err is None
+        assert make_request.call_count == 3
+        assert [entry["dateTime"] for entry in data["activities-steps"]] == [
+            d.isoformat() for d in days(start - timedelta(days=1), end)
+        ]
+
+    def test_sleep_logs(self):
+        start, end = date(2024, 1, 1), date(2024, 12, 31)
+        with mock.patch.object(
+            methods.FitbitUser, "make_request", side_effect=fake_range_request
+        ) as make_request:
+            data, err = ranges.sleep_logs(self.fitbit_user, start, end)
+        assert err is None
+        assert make_request.call_count == 4
+        assert [log["dateOfSleep"] for log in data["sleep"]] == [
+            d.isoformat() for d in days(start, end)
+        ]
+
+    def test_any_failed_chunk_fails_the_range(self):
+        with mock.patch.object(
+            methods.FitbitUser,
+            "make_request",
+            side_effect=[(make_response(200, {}), None), (None, Exception("boom"))],
+        ):
+            data, err = ranges.sleep_logs(
+                self.fitbit_user, date(2024, 1, 1), date(2024, 6, 1), max_workers=1
+            )
+        assert data is None
+        assert str(err) == "boom"
+
+    def test_not_enough_budget(self):
+        ratelimit.record(
+            self.fitbit_user,
+            200,
+            {"Fitbit-Rate-Limit-Remaining": "2", "Fitbit-Rate-Limit-Reset": "600"},
+        )
+        with mock.patch.object(methods.FitbitUser, "make_request") as make_request:
+            data, err = ranges.sleep_logs(
+                self.fitbit_user, date(2024, 1, 1), date(2024, 12, 31)
+            )
+        make_request.assert_not_called()
+        assert isinstance(err, ratelimit.RateLimited)
+        assert err.retry_at == ratelimit.reset_at(self.fitbit_user)
@@ -0,0 +1,122 @@
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase, override_settings
+
+from django_fitbit_healthkit import ratelimit
+from django_fitbit_healthkit import session as fitbit_session
+
+from .utils import make_fitbit_user, make_response, no_blocking_cache_calls
+
+
+class RateLimitTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.fitbit_user = make_fitbit_user()
+
+    @override_settings(FITBIT_RATE_LIMIT_PER_HOUR=2)
+    def test_budget_defers_before_429(self):
+        assert ratelimit.acquire(self.fitbit_user) is None
+        assert ratelimit.acquire(self.fitbit_user) is None
+        err = ratelimit.acquire(self.fitbit_user)
+        assert isinstance(err, ratelimit.RateLimited)
+        assert err.retry_at > time.time()
+
+    def test_headers_update_shared_budget(self):
+        headers = {
+            "Fitbit-Rate-Limit-Limit": "150",
+            "Fitbit-Rate-Limit-Remaining": "1",
+            "Fitbit-Rate-Limit-Reset": "120",
+        }
+        reset_at = ratelimit.record(self.fitbit_user, 200, headers)
+        assert 119 < reset_at - time.time() <= 120
+        assert ratelimit.remaining(self.fitbit_user) == 1
+        assert ratelimit.acquire(self.fitbit_user) is None
+        err = ratelimit.acquire(self.fitbit_user)
+        assert err.retry_at == reset_at
+
+    def test_waits_for_reset_within_max_wait(self):
+        ratelimit.record(
+            self.fitbit_user,
+            200,
+            {"Fitbit-Rate-Limit-Remaining": "0", "Fitbit-Rate-Limit-Reset": "0.05"},
+        )
+        with mock.patch.object(ratelimit.time, "sleep") as sleep:
+            sleep.side_effect = lambda seconds: cache.clear()
+            assert ratelimit.acquire(self.fitbit_user, max_wait=1) is None
+        sleep.assert_called_once()
+
+    @override_settings(FITBIT_RATE_LIMIT_PER_HOUR=2)
+    def test_budget_with_decr_stopping_at_zero(self):
+        # like memcached's
+        def decr(cache, key, delta=1, version=None):
+            value = cache.get(key, version=version)
+            return LocMemCache.incr(cache, key, -min(delta, value or 0), version)
+
+        with mock.patch.object(LocMemCache, "decr", decr):
+            assert ratelimit.acquire(self.fitbit_user) is None
+            assert ratelimit.acquire(self.fitbit_user) is None
+            err = ratelimit.acquire(self.fitbit_user)
+            assert isinstance(err, ratelimit.RateLimited)
+            assert isinstance(
+                ratelimit.acquire(self.fitbit_user), ratelimit.RateLimited
+            )
+        assert ratelimit.remaining(self.fitbit_user) == 0
+
+    def test_new_window_after_reset(self):
+        ratelimit.record(
+            self.fitbit_user,
+            200,
+            {"Fitbit-Rate-Limit-Remaining": "0", "Fitbit-Rate-Limit-Reset": "10"},
+        )
+        assert isinstance(ratelimit.acquire(self.fitbit_user), ratelimit.RateLimited)
+        with mock.patch.object(ratelimit.time, "time", return_value=time.time() + 10.5):
+            assert ratelimit.acquire(self.fitbit_user) is None
+
+    def test_new_window_before_cache_expiry(self):
+        # a cache that hasn't expired the last window's keys yet
+        budget_key, used_key, reset_key = ratelimit._keys(self.fitbit_user.pk)
+        cache.set_many(
+            {budget_key: 0, used_key: 0, reset_key: time.time() - 1}, timeout=60
+        )
+        assert ratelimit.acquire(self.fitbit_user) is None
+        assert ratelimit.remaining(self.fitbit_user) == 149
+
+    @override_settings(FITBIT_RATE_LIMIT_PER_HOUR=1)
+    def test_async_versions_use_async_cache_methods(self):
+        headers = {"Fitbit-Rate-Limit-Remaining": "1", "Fitbit-Rate-Limit-Reset": "60"}
+
+        async def run():
+            assert await ratelimit.aacquire(self.fitbit_user) is None
+            first = await ratelimit.aacquire(self.fitbit_user)
+            reset_at = await ratelimit.arecord(self.fitbit_user, 200, headers)
+            return first, reset_at, await ratelimit.aacquire(self.fitbit_user)
+
+        with no_blocking_cache_calls("get_many", "add", "incr", "delete", "set_many"):
+            first, reset_at, after_record = async_to_sync(run)()
+        assert isinstance(first, ratelimit.RateLimited)
+        assert after_record is None
+        assert ratelimit.remaining(self.fitbit_user) == 0
+        assert 59 < reset_at - time.time() <= 60
+
+    def test_make_request_defers_and_records_429(self):
+        throttled = make_response(
+            429,
+            {"errors": []},
+            {"Retry-After": "600", "Fitbit-Rate-Limit-Reset": "600"},
+        )
+        with mock.patch.object(
+            fitbit_session.get_session(), "request", return_value=throttled
+        ) as request:
+            resp, err = self.fitbit_user.make_request("get", "https://example.com")
+            assert resp is None
+            assert isinstance(err, ratelimit.RateLimited)
+            assert str(err).startswith("Backoff")
+            # the next call doesn't even go out
+            resp, err = self.fitbit_user.make_request("get", "https://example.com")
+        assert isinstance(err, ratelimit.RateLimited)
+        assert request.call_count == 1
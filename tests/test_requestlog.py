@@ -0,0 +1,71 @@
+import logging
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from django_fitbit_healthkit import session as fitbit_session
+from django_fitbit_healthkit.requestlog import endpoint_template, log_response
+
+from .utils import make_fitbit_user, make_response
+
+URL = "https://api.fitbit.com/1/user/-/activities/steps/date/2024-01-02/1d/1min/time/08:00/09:30.json"
+
+
+def test_endpoint_template():
+    assert (
+        endpoint_template(URL)
+        == "/1/user/-/activities/steps/date/{date}/1d/1min/time/{time}/{time}.json"
+    )
+    assert (
+        endpoint_template(
+            "https://api.fitbit.com/1/user/-/sleep/apiSubscriptions/12-sleep.json"
+        )
+        == "/1/user/-/sleep/apiSubscriptions/{subscription_id}.json"
+    )
+    assert (
+        endpoint_template("https://api.fitbit.com/1/user/-/apiSubscriptions.json")
+        == "/1/user/-/apiSubscriptions.json"
+    )
+
+
+class RequestLogTestCase(TestCase):
+    def test_make_request_logs_a_summary(self):
+        fitbit_user = make_fitbit_user()
+        with mock.patch.object(
+            fitbit_session.get_session(),
+            "request",
+            return_value=make_response(200, {"steps": 1}),
+        ):
+            with self.assertLogs("django_fitbit_healthkit.requestlog") as logs:
+                fitbit_user.make_request("get", URL)
+        [record] = logs.records
+        assert record.getMessage().startswith(
+            "GET /1/user/-/activities/steps/date/{date}/1d/1min/time/{time}/{time}.json 200 "
+        )
+        assert record.fitbit_status == 200
+        assert record.fitbit_bytes == len(b'{"steps": 1}')
+        assert '{"steps": 1}' not in record.getMessage()
+
+    def test_bodies_are_not_read_at_info(self):
+        body = mock.Mock(return_value="{}")
+        with self.assertLogs("django_fitbit_healthkit.requestlog", logging.INFO):
+            log_response("GET", URL, 200, 0.1, 2, body)
+        body.assert_not_called()
+
+    @override_settings(FITBIT_LOG_BODIES=True)
+    def test_bodies_under_debug(self):
+        with self.assertLogs(
+            "django_fitbit_healthkit.requestlog", logging.DEBUG
+        ) as logs:
+            log_response("GET", URL, 200, 0.1, 2, lambda: '{"steps": 1}')
+        assert logs.records[-1].levelno == logging.DEBUG
+        assert logs.records[-1].getMessage().endswith('body: {"steps": 1}')
+
+    @override_settings(FITBIT_LOG_BODY_SAMPLE_RATE=0.5)
+    def test_body_sample_rate(self):
+        body = mock.Mock(return_value="{}")
+        with self.assertLogs("django_fitbit_healthkit.requestlog", logging.DEBUG):
+            with mock.patch("random.random", side_effect=[0.9, 0.1]):
+                log_response("GET", URL, 200, 0.1, 2, body)
+                log_response("GET", URL, 200, 0.1, 2, body)
+        assert body.call_count == 1
@@ -0,0 +1,144 @@
+import email.utils
+import time
+from unittest import mock
+
+import requests
+import urllib3
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from django_fitbit_healthkit import models, ratelimit, retry
+from django_fitbit_healthkit import session as fitbit_session
+
+from .utils import make_fitbit_user, make_response
+
+URL = "https://api.fitbit.com/1/user/-/activities/date/2024-01-02.json"
+
+
+def test_backoff_full_jitter():
+    with mock.patch.object(retry.random, "uniform", side_effect=lambda a, b: b):
+        assert [retry.backoff(attempt) for attempt in [1, 2, 3]] == [0.5, 1, 2]
+        assert retry.backoff(20) == 30
+    assert all(0 <= retry.backoff(3) <= 2 for _ in range(100))
+
+
+def test_retry_after():
+    assert retry.retry_after(503, {"Retry-After": "7"}) == 7
+    assert retry.retry_after(429, {"Fitbit-Rate-Limit-Reset": "60"}) == 60
+    assert retry.retry_after(503, {"Fitbit-Rate-Limit-Reset": "60"}) is None
+    when = email.utils.formatdate(time.time() + 120, usegmt=True)
+    assert 100 < retry.retry_after(503, {"Retry-After": when}) <= 120
+    assert retry.retry_after(503, {"Retry-After": "soon"}) is None
+
+
+def test_budget():
+    budget = retry.RetryBudget(ratio=0.5, min_per_second=0)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+class RetryTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        retry.reset()
+        self.addCleanup(retry.reset)
+        self.fitbit_user = make_fitbit_user()
+        sleep = mock.patch.object(models.time, "sleep")
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def request(self, *responses, method="get", **kwargs):
+        with mock.patch.object(
+            fitbit_session.get_session(), "request", side_effect=responses
+        ) as request:
+            resp, err = self.fitbit_user.make_request(method, URL, **kwargs)
+        return resp, err, request.call_count
+
+    def test_backs_off_on_5xx(self):
+        resp, err, calls = self.request(make_response(503), make_response(200))
+        assert err is None
+        assert calls == 2
+        [(delay,), _] = self.sleep.call_args
+        assert 0 <= delay <= 0.5
+
+    def test_gives_up_on_other_4xx(self):
+        resp, err, calls = self.request(make_response(404), make_response(200))
+        assert resp is None
+        assert str(err).startswith("404 from Fitbit")
+        assert calls == 1
+        self.sleep.assert_not_called()
+
+    @override_settings(FITBIT_RATE_LIMIT_ENABLED=False)
+    def test_waits_out_a_short_429(self):
+        resp, err, calls = self.request(
+            make_response(429, headers={"Retry-After": "2"}), make_response(200)
+        )
+        assert err is None
+        assert calls == 2
+        [(delay,), _] = self.sleep.call_args
+        assert 2 <= delay <= 2.5
+
+    def test_defers_a_long_429(self):
+        resp, err, calls = self.request(
+            make_response(429, headers={"Fitbit-Rate-Limit-Reset": "600"}),
+        )
+        assert isinstance(err, ratelimit.RateLimited)
+        assert calls == 1
+        self.sleep.assert_not_called()
+
+    def test_post_is_only_retried_when_safe(self):
+        resp, err, calls = self.request(
+            make_response(503), make_response(200), method="post"
+        )
+        assert resp is None
+        assert calls == 1
+
+        resp, err, calls = self.request(
+            make_response(503), make_response(200), method="post", idempotent=True
+        )
+        assert err is None
+        assert calls == 2
+
+        resp, err, calls = self.request(
+            requests.exceptions.ConnectionError(), make_response(200), method="post"
+        )
+        assert isinstance(err, requests.exceptions.ConnectionError)
+        assert calls == 1
+
+        # never got sent
+        resp, err, calls = self.request(
+            requests.exceptions.ConnectTimeout(), make_response(200), method="post"
+        )
+        assert err is None
+        assert calls == 2
+
+    def test_post_is_retried_when_the_connection_was_refused(self):
+        refused = requests.exceptions.ConnectionError(
+            urllib3.exceptions.MaxRetryError(
+                None, URL, urllib3.exceptions.NewConnectionError(None, "refused")
+            )
+        )
+        resp, err, calls = self.request(refused, make_response(200), method="post")
+        assert err is None
+        assert calls == 2
+
+    def test_get_retries_connection_errors(self):
+        resp, err, calls = self.request(
+            requests.exceptions.ReadTimeout(), make_response(200)
+        )
+        assert err is None
+        assert calls == 2
+
+    @override_settings(
+        FITBIT_RETRY_BUDGET_RATIO=0, FITBIT_RETRY_BUDGET_MIN_PER_SECOND=0
+    )
+    def test_budget_stops_retries(self):
+        resp, err, calls = self.request(
+            make_response(503), make_response(503), make_response(200)
+        )
+        # a budget of one retry
+        assert resp is None
+        assert calls == 2
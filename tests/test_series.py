@@ -0,0 +1,24 @@
+import math
+
+from django_fitbit_healthkit import series
+
+
+def test_encode_places_values_by_time():
+    dataset = [
+        {"time": "00:00:00", "value": 3},
+        {"time": "00:15:00", "value": 5},
+        {"time": "23:45:00", "value": 7},
+    ]
+    buf = series.encode(dataset, "15min")
+    assert len(buf) == series.day_nbytes("15min") == 96 * 4
+    values = series.to_array(buf)
+    assert (values[0], values[1], values[95]) == (3.0, 5.0, 7.0)
+    assert math.isnan(values[2])
+
+
+def test_to_numpy_is_a_view():
+    buf = series.empty(1440)
+    values = series.to_numpy(buf)
+    assert values.shape == (1440,)
+    buf[:4] = series.encode([{"time": "00:00:00", "value": 1}], "1min")[:4]
+    assert values[0] == 1.0
@@ -0,0 +1,112 @@
+from datetime import date
+
+import requests
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from django_fitbit_healthkit import methods
+from django_fitbit_healthkit.simulator import SimulatorServer
+
+from .utils import make_fitbit_user
+
+SUMMARY_PATH = "/1/user/-/activities/date/2024-01-02.json"
+
+
+class SimulatorTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.simulator = SimulatorServer().start()
+        cls.settings = override_settings(
+            FITBIT_API_BASE_URL=cls.simulator.url,
+            FITBIT_ACCESS_REFRESH_TOKEN_REQUEST_URI=f"{cls.simulator.url}/oauth2/token",
+        )
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        cls.simulator.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.fitbit_user = make_fitbit_user()
+
+    def test_helpers_use_the_base_url(self):
+        d = date(2024, 1, 2)
+        resp, err = methods.daily_activity_summary(self.fitbit_user, d)
+        assert err is None
+        assert resp.json()["summary"]["steps"] > 0
+        assert int(resp.headers["Fitbit-Rate-Limit-Remaining"]) == 149
+
+        resp, err = methods.sleep_log_by_date_range(
+            self.fitbit_user, d, date(2024, 1, 8)
+        )
+        assert err is None
+        assert len(resp.json()["sleep"]) == 7
+
+        resp, err = methods.activity_intraday_by_date(
+            self.fitbit_user, "calories", d, "15min"
+        )
+        assert err is None
+        dataset = resp.json()["activities-calories-intraday"]["dataset"]
+        assert len(dataset) == 96
+        assert {"time", "value", "mets", "level"} <= set(dataset[0])
+
+        resp, err = methods.activity_timeseries_by_date(
+            self.fitbit_user, "tracker/steps", d, "7d"
+        )
+        assert err is None
+        assert len(resp.json()["activities-tracker-steps"]) == 7
+
+    def test_data_is_deterministic_per_user(self):
+        def steps(token):
+            return requests.get(
+                self.simulator.url + SUMMARY_PATH,
+                headers={"Authorization": f"Bearer {token}"},
+            ).json()["summary"]["steps"]
+
+        assert steps("alice.1") == steps("alice.2")
+        assert steps("alice.1") != steps("bob.1")
+
+    def test_token_refresh(self):
+        self.fitbit_user.access_token = "expired"
+        self.fitbit_user.update_tokens()
+        assert self.fitbit_user.access_token.startswith("refresh.")
+        resp, err = self.fitbit_user.make_request(
+            "get", self.simulator.url + SUMMARY_PATH
+        )
+        assert resp.status_code == 200
+
+
+class SimulatorFaultsTestCase(TestCase):
+    def get(self, simulator, token="alice"):
+        return requests.get(
+            simulator.url + SUMMARY_PATH,
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+    def test_rate_limit(self):
+        simulator = SimulatorServer(rate_limit=2).start()
+        self.addCleanup(simulator.stop)
+        assert self.get(simulator).headers["Fitbit-Rate-Limit-Remaining"] == "1"
+        assert self.get(simulator).headers["Fitbit-Rate-Limit-Remaining"] == "0"
+        resp = self.get(simulator)
+        assert resp.status_code == 429
+        assert 0 < int(resp.headers["Retry-After"]) <= 3601
+        # budgets are per user
+        assert self.get(simulator, "bob").status_code == 200
+
+    def test_injected_errors(self):
+        simulator = SimulatorServer(unauthorized_rate=1).start()
+        self.addCleanup(simulator.stop)
+        assert self.get(simulator).status_code == 401
+
+        simulator = SimulatorServer(server_error_rate=1).start()
+        self.addCleanup(simulator.stop)
+        assert self.get(simulator).status_code in {500, 502, 503}
+
+        simulator = SimulatorServer(rate_limited_rate=1).start()
+        self.addCleanup(simulator.stop)
+        assert self.get(simulator).status_code == 429
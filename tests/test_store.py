@@ -0,0 +1,167 @@
+import math
+from datetime import date, timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from django_fitbit_healthkit import methods
+from django_fitbit_healthkit.models import (
+    DailyActivitySummary,
+    IntradaySeries,
+    SleepLog,
+)
+from django_fitbit_healthkit.notifications import (
+    ingest_notifications,
+    process_pending_notifications,
+)
+from django_fitbit_healthkit.store import (
+    get_daily_activity_summary,
+    get_intraday,
+    get_sleep_logs,
+    get_timeseries,
+    load_intraday,
+    store_intraday,
+    store_sleep_logs,
+)
+
+from .utils import make_fitbit_user, make_response
+
+
+def sleep_log(log_id, d):
+    return {"logId": log_id, "dateOfSleep": d.isoformat(), "minutesAsleep": 400}
+
+
+class StoreTestCase(TestCase):
+    def setUp(self):
+        self.fitbit_user = make_fitbit_user()
+
+    def patch_request(self, data):
+        return mock.patch.object(
+            methods.FitbitUser,
+            "make_request",
+            return_value=(make_response(200, data), None),
+        )
+
+    def test_past_days_are_fetched_once(self):
+        d = date(2024, 1, 2)
+        with self.patch_request({"summary": {"steps": 100}}) as make_request:
+            assert get_daily_activity_summary(self.fitbit_user, d) == (
+                {"summary": {"steps": 100}},
+                None,
+            )
+            assert get_daily_activity_summary(self.fitbit_user, d) == (
+                {"summary": {"steps": 100}},
+                None,
+            )
+        assert make_request.call_count == 1
+
+    def test_recent_days_are_refetched_when_stale(self):
+        d = date.today()
+        with self.patch_request({"summary": {"steps": 100}}) as make_request:
+            get_daily_activity_summary(self.fitbit_user, d)
+            get_daily_activity_summary(self.fitbit_user, d)
+            assert make_request.call_count == 1
+            DailyActivitySummary.objects.update(
+                fetched=timezone.now() - timedelta(hours=1)
+            )
+            get_daily_activity_summary(self.fitbit_user, d)
+        assert make_request.call_count == 2
+        assert DailyActivitySummary.objects.count() == 1
+
+    def test_errors_are_not_stored(self):
+        with mock.patch.object(
+            methods.FitbitUser, "make_request", return_value=(None, Exception("boom"))
+        ):
+            data, err = get_daily_activity_summary(self.fitbit_user, date(2024, 1, 2))
+        assert data is None
+        assert str(err) == "boom"
+        assert not DailyActivitySummary.objects.exists()
+
+    def test_sleep_logs_missing_from_a_response_are_removed(self):
+        d = date(2024, 1, 2)
+        store_sleep_logs(
+            self.fitbit_user, {"sleep": [sleep_log(1, d), sleep_log(2, d)]}, d, d
+        )
+        store_sleep_logs(self.fitbit_user, {"sleep": [sleep_log(2, d)]}, d, d)
+        assert list(SleepLog.objects.values_list("log_id", flat=True)) == [2]
+        with mock.patch.object(methods.FitbitUser, "make_request") as make_request:
+            assert get_sleep_logs(self.fitbit_user, d) == ([sleep_log(2, d)], None)
+        make_request.assert_not_called()
+
+    def test_timeseries_fetches_only_when_incomplete(self):
+        start, end = date(2024, 1, 1), date(2024, 1, 3)
+        data = {
+            "activities-tracker-steps": [
+                {"dateTime": (start + timedelta(days=i)).isoformat(), "value": str(i)}
+                for i in range(3)
+            ]
+        }
+        with self.patch_request(data) as make_request:
+            series, err = get_timeseries(self.fitbit_user, "tracker/steps", start, end)
+            assert err is None
+            assert series == [(start, 0.0), (date(2024, 1, 2), 1.0), (end, 2.0)]
+            assert get_timeseries(
+                self.fitbit_user, "tracker/steps", start, end + timedelta(days=1)
+            )
+        assert make_request.call_count == 2
+
+    def test_notification_data_is_stored(self):
+        ingest_notifications(
+            [
+                {
+                    "collectionType": "activities",
+                    "date": "2024-01-02",
+                    "ownerId": self.fitbit_user.fitbit_id,
+                    "ownerType": "user",
+                    "subscriptionId": "1",
+                }
+            ]
+        )
+        with self.patch_request({"summary": {"steps": 100}}):
+            process_pending_notifications()
+        with mock.patch.object(methods.FitbitUser, "make_request") as make_request:
+            data, _ = get_daily_activity_summary(self.fitbit_user, date(2024, 1, 2))
+        make_request.assert_not_called()
+        assert data == {"summary": {"steps": 100}}
+
+    def test_intraday_is_stored_compactly(self):
+        d = date(2024, 1, 2)
+        data = {
+            "activities-calories-intraday": {
+                "dataset": [
+                    {"time": "00:00:00", "value": 1.5, "mets": 10, "level": 0},
+                    {"time": "00:01:00", "value": 2.5, "mets": 20, "level": 0},
+                ]
+            }
+        }
+        with self.patch_request(data) as make_request:
+            values, err = get_intraday(self.fitbit_user, "calories", d, "1min")
+            again, _ = get_intraday(self.fitbit_user, "calories", d, "1min")
+        assert make_request.call_count == 1
+        assert err is None
+        assert len(values) == 1440
+        assert list(values[:2]) == list(again[:2]) == [1.5, 2.5]
+        mets = IntradaySeries.objects.get(resource="calories/mets")
+        assert list(mets.as_numpy()[:2]) == [10, 20]
+
+    def test_load_intraday_is_one_buffer(self):
+        start = date(2024, 1, 1)
+        for i in (0, 2):
+            store_intraday(
+                self.fitbit_user,
+                "steps",
+                start + timedelta(days=i),
+                "1min",
+                {
+                    "activities-steps-intraday": {
+                        "dataset": [{"time": "00:00:00", "value": i + 1}]
+                    }
+                },
+            )
+        month = load_intraday(
+            self.fitbit_user, "steps", start, start + timedelta(days=2), as_numpy=True
+        )
+        assert month.shape == (3 * 1440,)
+        assert month[0] == 1 and month[2 * 1440] == 3
+        assert math.isnan(month[1440])
@@ -0,0 +1,102 @@
+import re
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+from django.test import TestCase
+
+from django_fitbit_healthkit import methods
+from django_fitbit_healthkit.ratelimit import RateLimited
+from django_fitbit_healthkit.streams import iter_intraday, iter_timeseries
+
+from .utils import make_fitbit_user, make_response
+
+DAY_URL = re.compile(r"/steps/date/(\d{4}-\d{2}-\d{2})/1d/15min\.json$")
+RANGE_URL = re.compile(r"/date/(\d{4}-\d{2}-\d{2})/(\d{4}-\d{2}-\d{2})\.json$")
+
+
+def fake_intraday(request_type, url, **kwargs):
+    d = date.fromisoformat(DAY_URL.search(url).group(1))
+    dataset = [
+        {"time": "00:00:00", "value": d.day},
+        {"time": "23:45:00", "value": d.day + 0.5},
+    ]
+    return (
+        make_response(200, {"activities-steps-intraday": {"dataset": dataset}}),
+        None,
+    )
+
+
+def fake_timeseries(request_type, url, **kwargs):
+    start, end = (date.fromisoformat(d) for d in RANGE_URL.search(url).groups())
+    entries = [
+        {"dateTime": (start + timedelta(days=i)).isoformat(), "value": str(i)}
+        for i in range((end - start).days + 1)
+    ]
+    return (make_response(200, {"activities-steps": entries}), None)
+
+
+class StreamsTestCase(TestCase):
+    def setUp(self):
+        self.fitbit_user = make_fitbit_user()
+
+    def test_iter_intraday(self):
+        start = date(2024, 1, 1)
+        with mock.patch.object(
+            methods.FitbitUser, "make_request", side_effect=fake_intraday
+        ) as make_request:
+            records = list(
+                iter_intraday(
+                    self.fitbit_user, "steps", start, date(2024, 1, 3), "15min"
+                )
+            )
+        assert make_request.call_count == 3
+        assert records[:2] == [
+            (datetime(2024, 1, 1, 0, 0), 1.0),
+            (datetime(2024, 1, 1, 23, 45), 1.5),
+        ]
+        assert records[-1] == (datetime(2024, 1, 3, 23, 45), 3.5)
+
+    def test_iter_timeseries_in_chunks(self):
+        start, end = date(2020, 1, 1), date(2024, 1, 1)
+        with mock.patch.object(
+            methods.FitbitUser, "make_request", side_effect=fake_timeseries
+        ) as make_request:
+            records = list(iter_timeseries(self.fitbit_user, "steps", start, end))
+        assert make_request.call_count == 2
+        assert [d for d, _ in records] == [
+            start + timedelta(days=i) for i in range((end - start).days + 1)
+        ]
+
+    def test_stopping_early_only_prefetches_one_chunk(self):
+        with mock.patch.object(
+            methods.FitbitUser, "make_request", side_effect=fake_intraday
+        ) as make_request:
+            records = iter_intraday(
+                self.fitbit_user, "steps", date(2024, 1, 1), date(2024, 1, 31), "15min"
+            )
+            next(records)
+            records.close()
+        assert make_request.call_count <= 2
+
+    def test_errors_are_raised(self):
+        with mock.patch.object(
+            methods.FitbitUser,
+            "make_request",
+            side_effect=[
+                fake_intraday("get", "/steps/date/2024-01-01/1d/15min.json"),
+                (None, RateLimited("Backoff")),
+            ],
+        ):
+            records = iter_intraday(
+                self.fitbit_user, "steps", date(2024, 1, 1), date(2024, 1, 2), "15min"
+            )
+            assert len([next(records), next(records)]) == 2
+            with self.assertRaises(RateLimited):
+                next(records)
+
+    def test_invalid_arguments_are_raised(self):
+        records = iter_intraday(
+            self.fitbit_user, "steps", date(2024, 1, 1), date(2024, 1, 2), "2min"
+        )
+        with self.assertRaises(ValueError):
+            next(records)
@@ -0,0 +1,109 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from django_fitbit_healthkit import subscriptions
+from django_fitbit_healthkit.simulator import SimulatorServer
+
+from .utils import make_fitbit_user, make_response
+
+
+class SubscriptionsTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.simulator = SimulatorServer().start()
+        cls.settings = override_settings(FITBIT_API_BASE_URL=cls.simulator.url)
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        cls.simulator.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.simulator.subscriptions.clear()
+        self.fitbit_user = make_fitbit_user(access_token="alice")
+
+    def collections(self, fitbit_user=None):
+        resp, err = subscriptions.list_subscriptions(fitbit_user or self.fitbit_user)
+        assert err is None
+        return sorted(s["collectionType"] for s in resp.json()["apiSubscriptions"])
+
+    def test_create_list_delete(self):
+        resp, err = subscriptions.create_subscription(self.fitbit_user, "sleep")
+        assert resp.status_code == 201
+        # already there
+        resp, err = subscriptions.create_subscription(self.fitbit_user, "sleep")
+        assert resp.status_code == 200
+        assert self.collections() == ["sleep"]
+
+        resp, err = subscriptions.delete_subscription(
+            self.fitbit_user, f"{self.fitbit_user.pk}-sleep", "sleep"
+        )
+        assert err is None
+        assert resp.status_code == 204
+        assert self.collections() == []
+
+    def test_invalid_collection(self):
+        assert subscriptions.create_subscription(self.fitbit_user, "heartrate") == {}
+
+    def test_reconcile(self):
+        subscriptions.create_subscription(self.fitbit_user, "body")
+        subscriptions.create_subscription(self.fitbit_user, "sleep")
+
+        changes, err = subscriptions.reconcile(self.fitbit_user, dry_run=True)
+        assert changes == {"created": ["activities"], "deleted": ["body"]}
+        assert self.collections() == ["body", "sleep"]
+
+        changes, err = subscriptions.reconcile(self.fitbit_user)
+        assert err is None
+        assert changes == {"created": ["activities"], "deleted": ["body"]}
+        assert self.collections() == ["activities", "sleep"]
+        assert subscriptions.reconcile(self.fitbit_user) == (
+            {"created": [], "deleted": []},
+            None,
+        )
+
+    @override_settings(FITBIT_SUBSCRIBER_ID="2")
+    def test_reconcile_leaves_other_subscribers_alone(self):
+        listed = make_response(
+            200,
+            {
+                "apiSubscriptions": [
+                    {
+                        "collectionType": "body",
+                        "subscriberId": "1",
+                        "subscriptionId": "other",
+                    }
+                ]
+            },
+        )
+        with mock.patch.object(
+            subscriptions, "list_subscriptions", return_value=(listed, None)
+        ):
+            changes, err = subscriptions.reconcile(
+                self.fitbit_user, ["activities"], dry_run=True
+            )
+        assert changes == {"created": ["activities"], "deleted": []}
+
+    def test_command(self):
+        users = [self.fitbit_user] + [
+            make_fitbit_user(f"user{i}", access_token=f"user{i}") for i in range(5)
+        ]
+        out = StringIO()
+        call_command("fitbit_subscriptions", "--workers", "3", stdout=out)
+        assert "Created 12 and deleted 0 subscriptions." in out.getvalue()
+        for fitbit_user in users:
+            assert self.collections(fitbit_user) == ["activities", "sleep"]
+
+        out = StringIO()
+        call_command(
+            "fitbit_subscriptions", "--collection", "sleep", "--dry-run", stdout=out
+        )
+        assert "Would create 0 and delete 6 subscriptions." in out.getvalue()
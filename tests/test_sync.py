@@ -0,0 +1,180 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+from io import StringIO
+from pathlib import Path
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+
+from django_fitbit_healthkit import sync
+from django_fitbit_healthkit.models import DailyActivitySummary, SleepLog
+from django_fitbit_healthkit.simulator import SimulatorServer
+
+from .utils import make_fitbit_user
+
+
+class JumpHashTestCase(TestCase):
+    def test_buckets_are_even(self):
+        counts = Counter(sync.shard_of(pk, 4) for pk in range(4000))
+        assert sorted(counts) == [0, 1, 2, 3]
+        assert all(800 < count < 1200 for count in counts.values())
+
+    def test_adding_a_shard_only_moves_users_to_it(self):
+        for pk in range(2000):
+            before, after = sync.shard_of(pk, 5), sync.shard_of(pk, 6)
+            assert after in (before, 5)
+        moved = sum(sync.shard_of(pk, 5) != sync.shard_of(pk, 6) for pk in range(2000))
+        assert 200 < moved < 470
+
+    def test_workers_are_independent_of_shards(self):
+        shard = [pk for pk in range(4000) if sync.shard_of(pk, 4) == 0]
+        counts = Counter(sync.worker_of(pk, 4) for pk in shard)
+        assert all(count > 150 for count in counts.values())
+
+
+class SyncTestCase(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.simulator = SimulatorServer().start()
+        cls.settings = override_settings(FITBIT_API_BASE_URL=cls.simulator.url)
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        cls.simulator.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            make_fitbit_user(f"user{i}", access_token=f"user{i}") for i in range(6)
+        ]
+
+    def test_shards_split_the_users(self):
+        shards = [sync.shard_user_ids(i, 3) for i in range(3)]
+        assert sorted(sum(shards, [])) == sorted(u.pk for u in self.users)
+
+    def test_sync_user(self):
+        fitbit_user = self.users[0]
+        assert sync.sync_user(fitbit_user, days=3) == (fitbit_user, None)
+        assert DailyActivitySummary.objects.filter(user=fitbit_user).count() == 3
+
+        fitbit_user.scopes = "sleep"
+        fitbit_user.save()
+        DailyActivitySummary.objects.all().delete()
+        sync.sync_user(fitbit_user)
+        assert not DailyActivitySummary.objects.exists()
+        assert SleepLog.objects.filter(user=fitbit_user).exists()
+
+    def test_command(self):
+        out = StringIO()
+        # one thread: SQLite's test database doesn't take concurrent writes
+        call_command(
+            "fitbit_sync",
+            *("--processes", "1", "--threads", "1", "--batch-size", "4"),
+            stdout=out,
+        )
+        output = out.getvalue()
+        assert "(4 users done)" in output
+        assert "(6 users done)" in output
+        assert "Shard 0/1: synced 6 users, 0 rate limited, 0 failed." in output
+        assert DailyActivitySummary.objects.count() == 12
+
+    def test_command_shard(self):
+        out = StringIO()
+        call_command(
+            "fitbit_sync",
+            *("--shard", "1/2", "--processes", "1", "--threads", "1"),
+            stdout=out,
+        )
+        synced = len(sync.shard_user_ids(1, 2))
+        assert f"Shard 1/2: synced {synced} users" in out.getvalue()
+        assert DailyActivitySummary.objects.values("user").distinct().count() == synced
+
+    def test_invalid_shard(self):
+        for value in ["2/2", "1", "a/b"]:
+            with self.assertRaises(CommandError):
+                call_command("fitbit_sync", "--shard", value, "--processes", "1")
+
+
+class WorkerProcessesTestCase(SimpleTestCase):
+    """
+    The spawned workers set Django up from scratch, so they can't see the
+    test database: run the command for real, against a database file.
+    """
+
+    def setUp(self):
+        self.simulator = SimulatorServer().start()
+        self.addCleanup(self.simulator.stop)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db = Path(tmp.name) / "db.sqlite3"
+        self.settings_file = Path(tmp.name) / "sync_test_settings.py"
+        self.settings_file.write_text(
+            "from sample.settings import *\n"
+            f"DATABASES = {{'default': {{'ENGINE': 'django.db.backends.sqlite3', "
+            f"'NAME': {str(self.db)!r}, 'OPTIONS': {{'timeout': 30}}}}}}\n"
+            f"FITBIT_API_BASE_URL = {self.simulator.url!r}\n"
+        )
+        root = Path(__file__).resolve().parent.parent
+        self.env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": "sync_test_settings",
+            "PYTHONPATH": os.pathsep.join([tmp.name, str(root)]),
+        }
+        self.django("migrate", "-v0")
+        self.django(
+            "shell",
+            "-c",
+            "from tests.utils import make_fitbit_user\n"
+            "for i in range(8): make_fitbit_user(f'user{i}', access_token=f'user{i}')",
+        )
+
+    def django(self, *args) -> str:
+        return subprocess.run(
+            [sys.executable, "-m", "django", *args],
+            env=self.env,
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=120,
+        ).stdout
+
+    def test_processes(self):
+        output = self.django(
+            "fitbit_sync", *("--processes", "3", "--threads", "1", "--batch-size", "2")
+        )
+        assert "(8 users done)" in output
+        assert "Shard 0/1: synced 8 users, 0 rate limited, 0 failed." in output
+        with sqlite3.connect(self.db) as db:
+            (summaries,) = db.execute(
+                "select count(distinct user_id) from fitbit_dailyactivitysummary"
+            ).fetchone()
+        assert summaries == 8
+
+    def test_failed_worker_fails_the_run(self):
+        # only the workers build thread pools, and they can't have 0 threads
+        with self.settings_file.open("a") as f:
+            f.write("FITBIT_BATCH_MAX_WORKERS = 0\n")
+        output = self.django(
+            "shell",
+            "-c",
+            "from django_fitbit_healthkit.sync import sync_shard\n"
+            "try:\n"
+            "    sync_shard(processes=2)\n"
+            "except RuntimeError as e:\n"
+            "    print(f'RuntimeError: {e}')",
+        )
+        assert "RuntimeError: 2 of 2 sync workers crashed" in output
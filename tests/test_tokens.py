@@ -0,0 +1,53 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from django_fitbit_healthkit import session as fitbit_session
+from django_fitbit_healthkit.models import FitbitUser
+from django_fitbit_healthkit.tokens import expiring_users
+
+from .utils import make_fitbit_user, make_response
+
+
+class ExpiresAtTestCase(TestCase):
+    def test_is_expired_uses_expires_at(self):
+        fitbit_user = make_fitbit_user(expires_at=timezone.now() - timedelta(seconds=1))
+        assert fitbit_user.is_expired
+        # saving for any other reason doesn't extend the token
+        fitbit_user.scopes = "sleep"
+        fitbit_user.save()
+        assert fitbit_user.is_expired
+
+    def test_expiring_users(self):
+        soon = make_fitbit_user("soon", expires_at=timezone.now())
+        make_fitbit_user("later", expires_at=timezone.now() + timedelta(days=1))
+        unknown = make_fitbit_user("unknown")
+        make_fitbit_user("no-refresh", refresh_token="")
+        assert set(expiring_users(timedelta(hours=1))) == {soon, unknown}
+
+
+class RefreshTokensCommandTestCase(TransactionTestCase):
+    def test_command_refreshes_expiring_tokens(self):
+        soon = make_fitbit_user("soon", expires_at=timezone.now())
+        later = make_fitbit_user("later", expires_at=timezone.now() + timedelta(days=1))
+        tokens = make_response(
+            200,
+            {"access_token": "new", "refresh_token": "new-refresh", "expires_in": 60},
+        )
+        out = StringIO()
+        with mock.patch.object(
+            fitbit_session.get_session(), "post", return_value=tokens
+        ) as post:
+            call_command("fitbit_refresh_tokens", "--within", "3600", stdout=out)
+        assert post.call_count == 1
+        assert "Refreshed 1 tokens, 0 failed." in out.getvalue()
+        soon = FitbitUser.objects.get(pk=soon.pk)
+        assert soon.access_token == "new"
+        assert (
+            timezone.now() < soon.expires_at <= timezone.now() + timedelta(seconds=60)
+        )
+        assert FitbitUser.objects.get(pk=later.pk).access_token == "access"
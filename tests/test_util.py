@@ -1,15 +1,25 @@
 import os
+import random
+from datetime import date
+from unittest import mock
 
 import django
+import numpy
+from django.db import connection
 from django.test import TestCase, override_settings
 
+from django_fitbit_healthkit.models import DailyActivitySummary
 from django_fitbit_healthkit.util import (
     encoded_secret,
     extract_active_from_total,
+    extract_active_from_totals,
     make_digest,
+    upsert,
     verify_fitbit_signature,
 )
 
+from .utils import make_fitbit_user
+
 # use the same app's settings
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sample.settings")
 django.setup()
@@ -37,3 +47,58 @@ def test_encoded_secret():
 
 def test_extract_active_from_total():
     assert extract_active_from_total(1, 0, 1) == 0
+
+
+def test_extract_active_from_totals_matches_scalar():
+    rng = random.Random(0)
+    totals = [rng.uniform(0, 20) for _ in range(1000)]
+    METs_sums = [
+        rng.choice([0, 5, 10, 150, 300]) + rng.randint(0, 200) for _ in range(1000)
+    ]
+    METs_sums[:3] = [0, 149, 150]
+    minutes = [rng.choice([1, 5, 15]) for _ in range(1000)]
+    expected = [
+        extract_active_from_total(t, m, n)
+        for t, m, n in zip(totals, METs_sums, minutes)
+    ]
+    assert extract_active_from_totals(totals, METs_sums, minutes).tolist() == expected
+    # a single interval length for the whole array
+    assert extract_active_from_totals(totals, METs_sums, 15).tolist() == [
+        extract_active_from_total(t, m, 15) for t, m in zip(totals, METs_sums)
+    ]
+    assert (
+        extract_active_from_totals(
+            numpy.array([1.0, 2.0]), numpy.array([0, 20]), 1
+        ).sum()
+        == 1.0
+    )
+
+
+class UpsertTestCase(TestCase):
+    def upsert_summary(self, fitbit_user, steps):
+        upsert(
+            DailyActivitySummary,
+            [
+                DailyActivitySummary(
+                    user=fitbit_user, date=date(2024, 1, 2), data={"steps": steps}
+                )
+            ],
+            unique_fields=["user", "date"],
+            update_fields=["data", "fetched"],
+        )
+        return list(DailyActivitySummary.objects.values_list("data", flat=True))
+
+    def test_upsert(self):
+        fitbit_user = make_fitbit_user()
+        assert self.upsert_summary(fitbit_user, 1) == [{"steps": 1}]
+        assert self.upsert_summary(fitbit_user, 2) == [{"steps": 2}]
+
+    def test_upsert_without_database_upserts(self):
+        fitbit_user = make_fitbit_user()
+        with mock.patch.multiple(
+            connection.features,
+            supports_update_conflicts=False,
+            supports_update_conflicts_with_target=False,
+        ):
+            assert self.upsert_summary(fitbit_user, 1) == [{"steps": 1}]
+            assert self.upsert_summary(fitbit_user, 2) == [{"steps": 2}]
@@ -1,5 +1,26 @@
-from django.test import TestCase
+import json
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+
+from django_fitbit_healthkit.models import (
+    BackfillChunk,
+    FitbitNotification,
+    FitbitUser,
+    NotificationPayload,
+)
+from django_fitbit_healthkit.notifications import ingest_pending_payloads
+from django_fitbit_healthkit.session import get_session
+from django_fitbit_healthkit.util import make_digest
+
+from .utils import make_fitbit_user, make_response
 
 # path("login", views.login, name="fitbitlogin"),
 # path("success", views.success, name="fitbitsuccess"),
@@ -27,8 +48,206 @@ class MyViewTest(TestCase):
         # Compare the base URL without query parameters
         self.assertEqual(base_redirect_url, "https://www.fitbit.com/oauth2/authorize")
 
+    @override_settings(FITBIT_BACKFILL_DAYS=10)
     def test_success(self):
-        pass
+        user = get_user_model().objects.create_user(username="new")
+        self.client.force_login(user)
+        tokens = {
+            "access_token": "access",
+            "refresh_token": "refresh",
+            "expires_in": 28800,
+            "user_id": "FB1",
+            "scope": "activity sleep",
+        }
+        with mock.patch.object(
+            get_session(), "post", return_value=make_response(200, tokens)
+        ) as post:
+            response = self.client.get(reverse("fitbitsuccess"), {"code": "c0de"})
+        assert response.status_code == 200
+        assert post.call_args.kwargs["data"]["code"] == "c0de"
+
+        fitbit_user = FitbitUser.objects.get(user=user)
+        assert fitbit_user.fitbit_id == "FB1"
+        assert fitbit_user.access_token == "access"
+        expected = timezone.now() + timedelta(seconds=28800)
+        assert abs(fitbit_user.expires_at - expected) < timedelta(seconds=5)
+        planned = BackfillChunk.objects.filter(user=fitbit_user).count()
+        assert planned > 0
+
+        # connecting again updates the tokens, and doesn't plan the same days again
+        tokens.update(access_token="access2", refresh_token="refresh2", expires_in=60)
+        with mock.patch.object(
+            get_session(), "post", return_value=make_response(200, tokens)
+        ):
+            self.client.get(reverse("fitbitsuccess"), {"code": "c0de"})
+        fitbit_user.refresh_from_db()
+        assert fitbit_user.access_token == "access2"
+        assert fitbit_user.expires_at < timezone.now() + timedelta(seconds=61)
+        assert BackfillChunk.objects.filter(user=fitbit_user).count() == planned
+
+    def test_success_handshake_error(self):
+        self.client.force_login(get_user_model().objects.create_user(username="new"))
+        with mock.patch.object(
+            get_session(), "post", return_value=make_response(400, {"errors": []})
+        ):
+            response = self.client.get(reverse("fitbitsuccess"), {"code": "c0de"})
+        assert response.status_code == 404
+        assert not FitbitUser.objects.exists()
+
+
+def notification(owner, collection="activities", d="2024-01-02"):
+    return {
+        "collectionType": collection,
+        "date": d,
+        "ownerId": owner,
+        "ownerType": "user",
+        "subscriptionId": "1",
+    }
+
+
+@override_settings(
+    FITBIT_CLIENT_SECRET="secret", FITBIT_SUBSCRIPTION_VERIFICATION_CODE="verify-me"
+)
+class WebhookTest(TestCase):
+    def post_notifications(self, data, signature=None):
+        body = json.dumps(data)
+        return self.client.post(
+            reverse("fitbitsubscription"),
+            body,
+            content_type="application/json",
+            headers={"x-fitbit-signature": signature or make_digest("secret&", body)},
+        )
+
+    def test_verify(self):
+        url = reverse("fitbitsubscription")
+        assert self.client.get(url, {"verify": "verify-me"}).status_code == 204
+        assert self.client.get(url, {"verify": "wrong"}).status_code == 404
+
+    def test_bad_signature(self):
+        response = self.post_notifications([], signature="wrong")
+        assert response.status_code == 404
+
+    def test_body_not_utf8(self):
+        response = self.client.post(
+            reverse("fitbitsubscription"),
+            b"\xff\xfe",
+            content_type="application/json",
+            headers={"x-fitbit-signature": "wrong"},
+        )
+        assert response.status_code == 404
+
+    def assert_rejected(self, data):
+        response = self.post_notifications(data)
+        assert response.status_code == 400
+        assert not FitbitNotification.objects.exists()
+
+    def test_notification_without_collection_type(self):
+        alice = make_fitbit_user("alice")
+        item = notification(alice.fitbit_id)
+        del item["collectionType"]
+        self.assert_rejected([notification(alice.fitbit_id), item])
+
+    def test_notification_without_owner(self):
+        item = notification("alice")
+        del item["ownerId"]
+        self.assert_rejected([item])
+
+    def test_notification_without_date(self):
+        item = notification("alice")
+        del item["date"]
+        self.assert_rejected([item])
+
+    def test_notification_with_malformed_date(self):
+        make_fitbit_user("alice")
+        self.assert_rejected([notification("FB-alice", d="2024-13-01")])
+        self.assert_rejected([notification("FB-alice", d="yesterday")])
+
+    def test_notifications_not_a_list(self):
+        self.assert_rejected({"collectionType": "activities"})
+        self.assert_rejected(["activities"])
 
     def test_webhook(self):
-        pass
+        alice = make_fitbit_user("alice")
+        bob = make_fitbit_user("bob")
+        data = [
+            notification(alice.fitbit_id),
+            notification(alice.fitbit_id),
+            notification(alice.fitbit_id, "sleep"),
+            notification(bob.fitbit_id, d="2024-01-03"),
+            notification("unknown-owner"),
+        ]
+        with self.assertNumQueries(2):
+            response = self.post_notifications(data)
+        assert response.status_code == 204
+        stored = set(
+            FitbitNotification.objects.values_list("user", "notification", "date")
+        )
+        assert stored == {
+            (alice.pk, "activities", date(2024, 1, 2)),
+            (alice.pk, "sleep", date(2024, 1, 2)),
+            (bob.pk, "activities", date(2024, 1, 3)),
+        }
+
+        # redelivery doesn't pile up duplicates
+        assert self.post_notifications(data).status_code == 204
+        assert FitbitNotification.objects.count() == 3
+
+
+@override_settings(
+    FITBIT_CLIENT_SECRET="secret", FITBIT_SUBSCRIPTION_VERIFICATION_CODE="verify-me"
+)
+class AsyncWebhookTest(TestCase):
+    async def apost(self, data, signature=None):
+        body = data if isinstance(data, (str, bytes)) else json.dumps(data)
+        return await self.async_client.post(
+            reverse("fitbitsubscriptionasync"),
+            body,
+            content_type="application/json",
+            headers={"x-fitbit-signature": signature or make_digest("secret&", body)},
+        )
+
+    async def test_verify_async(self):
+        url = reverse("fitbitsubscriptionasync")
+        response = await self.async_client.get(url, {"verify": "verify-me"})
+        assert response.status_code == 204
+
+    async def test_bad_signature_async(self):
+        response = await self.apost([], signature="wrong")
+        assert response.status_code == 404
+        response = await self.apost(b"\xff\xfe", signature="wrong")
+        assert response.status_code == 404
+        assert not await NotificationPayload.objects.aexists()
+
+    def test_queue_then_expand(self):
+        alice = make_fitbit_user("alice")
+        data = [
+            notification(alice.fitbit_id),
+            notification(alice.fitbit_id, "sleep"),
+            notification("unknown-owner"),
+        ]
+        # one insert, no owner lookups
+        with self.assertNumQueries(1):
+            response = async_to_sync(self.apost)(data)
+        assert response.status_code == 204
+        assert async_to_sync(self.apost)("not json").status_code == 204
+        assert not FitbitNotification.objects.exists()
+
+        assert ingest_pending_payloads() == 2
+        assert not NotificationPayload.objects.exists()
+        stored = set(
+            FitbitNotification.objects.values_list("user", "notification", "date")
+        )
+        assert stored == {
+            (alice.pk, "activities", date(2024, 1, 2)),
+            (alice.pk, "sleep", date(2024, 1, 2)),
+        }
+
+    def test_command_expands_the_queue(self):
+        alice = make_fitbit_user("alice")
+        NotificationPayload.objects.create(
+            body=json.dumps([notification(alice.fitbit_id, "foods")])
+        )
+        out = StringIO()
+        call_command("fitbit_process_notifications", "--once", stdout=out)
+        assert "Ingested 1 webhook payloads." in out.getvalue()
+        assert FitbitNotification.objects.get().processed is not None
@@ -0,0 +1,60 @@
+import asyncio
+import contextlib
+import json
+from typing import Dict, Iterator, Optional
+from unittest import mock
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.cache.backends.locmem import LocMemCache
+
+from django_fitbit_healthkit.models import FitbitUser
+
+
+def make_response(
+    status_code: int = 200, data=None, headers: Optional[Dict] = None
+) -> requests.models.Response:
+    """Build a requests Response without touching the network."""
+    response = requests.models.Response()
+    response.status_code = status_code
+    response._content = json.dumps({} if data is None else data).encode()
+    response.headers.update(headers or {})
+    return response
+
+
+def make_fitbit_user(username: str = "test", **kwargs) -> FitbitUser:
+    user = get_user_model().objects.create_user(username=username)
+    fields = {
+        "fitbit_id": f"FB-{username}",
+        "access_token": "access",
+        "refresh_token": "refresh",
+        "expires_in": 28800,
+        "scopes": "activity sleep",
+        **kwargs,
+    }
+    return FitbitUser.objects.create(user=user, **fields)
+
+
+@contextlib.contextmanager
+def no_blocking_cache_calls(*names: str) -> Iterator[None]:
+    """
+    Fail if any of the named (sync) cache methods is called on a running
+    event loop. The async methods (aget, ...) run them in a thread.
+    """
+
+    def off_the_loop(name):
+        method = getattr(LocMemCache, name)
+
+        def check(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return method(*args, **kwargs)
+            raise AssertionError(f"Blocking cache.{name}() on the event loop")
+
+        return mock.patch.object(LocMemCache, name, check)
+
+    with contextlib.ExitStack() as stack:
+        for name in names:
+            stack.enter_context(off_the_loop(name))
+        yield